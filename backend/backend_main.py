@@ -1,26 +1,70 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from typing import List, Optional
-import uvicorn
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import NotFound
 import os
 import secrets
+import socket
 import string
 import qrcode
+from qr_rendering import QR_RENDERERS, QrPdfSheetWriter, render_qr_bitmap, render_qr_png
 import io
 import base64
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from twilio.rest import Client
-from apscheduler.schedulers.background import BackgroundScheduler
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 import asyncio
+import heapq
+import anyio
+import threading
+import time
+import zlib
+import contextvars
+import copy
+import hashlib
+import math
+import json
+import random
+import sqlite3
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from enum import Enum
 
+if __name__ == "__main__":
+    # Start przez `python backend_main.py` - przekaż proces do uvicorn, zanim wykona się reszta modułu.
+    # Skrypt uruchomiony bezpośrednio jest importowany ponownie jako __mp_main__ w każdym procesie
+    # puli eksportu QR, więc nie może inicjalizować Firebase ani kolejki SMS (patrz start.sh)
+    import sys
+    port = int(os.getenv("PORT", 8000))
+    
+    print("🚀 Uruchamianie next review booster API...")
+    print(f"🔧 Port: {port}")
+    print(f"🌐 API: http://0.0.0.0:{port}")
+    print(f"📚 Dokumentacja: http://0.0.0.0:{port}/docs")
+    print(f"❤️  Health Check: http://0.0.0.0:{port}/health")
+
+    is_production = os.getenv("ENVIRONMENT") == "production" or os.getenv("RENDER") == "true"
+    
+    command = [sys.executable, "-m", "uvicorn", "backend_main:app", "--host", "0.0.0.0", "--port", str(port)]
+    if not is_production:
+        command.append("--reload")
+    sys.stdout.flush()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.execv(sys.executable, command)
+
 # Enum dla uprawnień użytkownika
 class UserPermission(str, Enum):
     ADMIN = "Admin"
@@ -37,35 +81,42 @@ def get_sms_limit_for_permission(permission: UserPermission) -> int:
     }
     return limits.get(permission, 10)  # Domyślnie 10 dla nieznanych uprawnień
 
+def get_user_sms_limit(username: str) -> Optional[int]:
+    """Pobierz miesięczny limit SMS użytkownika (None jeśli użytkownik nie istnieje)"""
+    settings_data = get_tenant_settings(username)
+    
+    if settings_data is None:
+        return None
+    
+    settings = UserSettings(**settings_data)
+    
+    # Pobierz limit z ustawień lub na podstawie uprawnień
+    sms_limit = settings.messaging.smsLimit
+    if sms_limit is None:
+        sms_limit = get_sms_limit_for_permission(settings.permission)
+    
+    # Sprawdź czy trzeba zresetować limit (nowy miesiąc)
+    current_month = datetime.now().strftime("%Y-%m")
+    last_reset_month = settings_data.get("messaging", {}).get("lastResetMonth", "")
+    
+    if last_reset_month != current_month:
+        # Nowy miesiąc - zresetuj limit
+        reset_sms_limit_for_month(username, current_month, sms_limit)
+    
+    return sms_limit
+
 def check_sms_limit(username: str) -> dict:
     """Sprawdź czy użytkownik nie przekroczył limitu SMS"""
     try:
-        # Pobierz ustawienia użytkownika
-        doc_ref = db.collection(username).document("Dane")
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return {"allowed": False, "message": "Użytkownik nie istnieje"}
-        
-        settings_data = doc.to_dict()
-        settings = UserSettings(**settings_data)
+        sms_limit = get_user_sms_limit(username)
         
-        # Pobierz limit z ustawień lub na podstawie uprawnień
-        sms_limit = settings.messaging.smsLimit
         if sms_limit is None:
-            sms_limit = get_sms_limit_for_permission(settings.permission)
+            return {"allowed": False, "message": "Użytkownik nie istnieje"}
         
-        # Sprawdź czy trzeba zresetować limit (nowy miesiąc)
         current_month = datetime.now().strftime("%Y-%m")
-        last_reset_month = settings_data.get("messaging", {}).get("lastResetMonth", "")
         
-        if last_reset_month != current_month:
-            # Nowy miesiąc - zresetuj limit
-            reset_sms_limit_for_month(username, current_month, sms_limit)
-        
-        # Policz wysłane SMS w tym miesiącu
-        sms_collection = db.collection(username).document("SMS").collection(current_month)
-        sent_sms_count = len(list(sms_collection.stream()))
+        # Pobierz liczbę wysłanych SMS w tym miesiącu z licznika miesięcznego
+        sent_sms_count = get_monthly_sms_count(username, current_month)
         
         print(f"📊 Limit SMS dla {username}: {sms_limit}, wysłane: {sent_sms_count}")
         
@@ -89,6 +140,76 @@ def check_sms_limit(username: str) -> dict:
         print(f"❌ Błąd podczas sprawdzania limitu SMS: {str(e)}")
         return {"allowed": False, "message": f"Błąd sprawdzania limitu: {str(e)}"}
 
+@firestore.transactional
+def _reserve_sms_quota_in_transaction(transaction, username: str, month: str, count: int, sms_limit: int) -> int:
+    """Zarezerwuj w transakcji do `count` SMS w miesięcznym liczniku, zwróć liczbę przyznanych"""
+    counter_ref = get_sms_counter_ref(username, month)
+    counter_doc = counter_ref.get(transaction=transaction)
+    if counter_doc.exists:
+        sent_count = counter_doc.to_dict().get("count", 0)
+    else:
+        sent_count = count_documents(db.collection(username).document("SMS").collection(month))
+    
+    granted = max(0, min(count, sms_limit - sent_count))
+    if granted:
+        transaction.set(counter_ref, {
+            "count": sent_count + granted,
+            "month": month,
+            "updated_at": datetime.now()
+        }, merge=True)
+    return granted
+
+def reserve_sms_quota(username: str, count: int = 1) -> dict:
+    """Zarezerwuj limit SMS przed wysyłką (atomowo - bez przekroczenia limitu przy równoległych wysyłkach)
+    
+    allowed=False oznacza tylko brak limitu. Błąd odczytu lub transakcji (np. przejściowy błąd
+    Firestore) jest przekazywany dalej - kolejka SMS ponowi wtedy wysyłkę zamiast ją porzucić.
+    """
+    try:
+        sms_limit = get_user_sms_limit(username)
+        
+        if sms_limit is None:
+            return {"allowed": False, "granted": 0, "message": "Użytkownik nie istnieje"}
+        
+        current_month = datetime.now().strftime("%Y-%m")
+        granted = _reserve_sms_quota_in_transaction(db.transaction(), username, current_month, count, sms_limit)
+        
+        print(f"📊 Rezerwacja SMS dla {username}: przyznano {granted} z {count} (limit: {sms_limit})")
+        
+        if not granted:
+            return {
+                "allowed": False,
+                "granted": 0,
+                "month": current_month,
+                "limit": sms_limit,
+                "message": f"Przekroczono limit SMS ({sms_limit})"
+            }
+        
+        return {
+            "allowed": True,
+            "granted": granted,
+            "month": current_month,
+            "limit": sms_limit,
+            "message": f"Zarezerwowano {granted} SMS"
+        }
+        
+    except Exception as e:
+        print(f"❌ Błąd podczas rezerwacji limitu SMS: {str(e)}")
+        raise
+
+def release_sms_quota(username: str, month: str, count: int = 1):
+    """Zwolnij niewykorzystaną rezerwację SMS (np. po błędzie wysyłki)"""
+    if count <= 0:
+        return
+    try:
+        get_sms_counter_ref(username, month).set({
+            "count": firestore.Increment(-count),
+            "updated_at": datetime.now()
+        }, merge=True)
+        print(f"↩️ Zwolniono {count} zarezerwowanych SMS dla {username}")
+    except Exception as e:
+        print(f"⚠️ Błąd zwalniania rezerwacji SMS: {str(e)}")
+
 def reset_sms_limit_for_month(username: str, current_month: str, sms_limit: int):
     """Zresetuj limit SMS dla nowego miesiąca"""
     try:
@@ -115,6 +236,8 @@ def reset_sms_limit_for_month(username: str, current_month: str, sms_limit: int)
         
         # Zapisz zaktualizowane ustawienia
         doc_ref.set(settings_data)
+        invalidate_tenant_settings(username)
+        sync_tenant_registry(username, settings_data)
         
         print(f"✅ Limit SMS zresetowany dla {username}: {sms_limit} SMS na miesiąc {current_month}")
         return True
@@ -157,11 +280,9 @@ def get_user_permission_from_db(username: str) -> UserPermission:
         return UserPermission.DEMO
     
     try:
-        doc_ref = db.collection(username).document("Dane")
-        doc = doc_ref.get()
+        settings_data = get_tenant_settings(username)
         
-        if doc.exists:
-            settings_data = doc.to_dict()
+        if settings_data is not None:
             settings = UserSettings(**settings_data)
             return settings.permission
         else:
@@ -233,6 +354,13 @@ Dziękujemy!""",
         })
         
         doc_ref.set(settings_dict)
+        invalidate_tenant_settings(username)
+        sync_tenant_registry(username, settings_dict)
+        
+        # Zapisz email w katalogu emaili
+        if email:
+            register_user_email(email, username, UserPermission.DEMO)
+        
         print(f"✅ Utworzono rekord użytkownika {username} z uprawnieniami Demo")
         return True
         
@@ -327,6 +455,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Maksymalna liczba wątków wykonujących synchroniczne operacje Firestore.
+# Endpointy bez await oraz run_in_threadpool korzystają z tej samej puli wątków,
+# dzięki czemu zapytania do Firestore nie blokują pętli zdarzeń uvicorn.
+FIRESTORE_THREADPOOL_SIZE = int(os.getenv("FIRESTORE_THREADPOOL_SIZE", "40"))
+
+@app.on_event("startup")
+async def configure_firestore_threadpool():
+    """Ustaw rozmiar puli wątków dla operacji Firestore"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = FIRESTORE_THREADPOOL_SIZE
+    print(f"✅ Pula wątków Firestore: {FIRESTORE_THREADPOOL_SIZE}")
+
 class HealthResponse(BaseModel):
     status: str
     message: str
@@ -449,6 +588,7 @@ class SMSResponse(BaseModel):
     success: bool
     message: str
     sid: Optional[str] = None
+    queue_id: Optional[int] = None
 
 # Modele dla formularza kontaktowego
 class ContactFormRequest(BaseModel):
@@ -461,6 +601,107 @@ class ContactFormResponse(BaseModel):
     success: bool
     message: str
 
+# Pula klientów Twilio - jeden klient (i jedna sesja HTTP keep-alive) na zestaw poświadczeń
+TWILIO_CLIENT_POOL_SIZE = int(os.getenv("TWILIO_CLIENT_POOL_SIZE", "100"))
+_twilio_clients = OrderedDict()
+_twilio_user_keys = {}
+_twilio_clients_lock = threading.Lock()
+
+# Asynchroniczni klienci Twilio (sesja aiohttp) - osobna pula dla każdej pętli zdarzeń,
+# bo sesja aiohttp jest związana z pętlą, w której została utworzona
+_async_twilio_clients = {}
+
+def _twilio_credentials_key(account_sid: str, auth_token: str) -> tuple:
+    """Klucz puli: account_sid + skrót auth_token (token nie jest trzymany jako klucz)"""
+    return (account_sid, hashlib.sha256(auth_token.encode("utf-8")).hexdigest())
+
+def _close_twilio_client(client: Client):
+    """Zamknij sesję HTTP (keep-alive) klienta Twilio usuniętego z puli"""
+    session = getattr(client.http_client, "session", None)
+    if session is not None:
+        try:
+            session.close()
+        except Exception as e:
+            print(f"⚠️ Błąd zamykania sesji Twilio: {e}")
+
+def get_pooled_twilio_client(username: str, account_sid: str, auth_token: str) -> Client:
+    """Pobierz klienta Twilio z puli lub utwórz nowy z sesją HTTP wielokrotnego użytku"""
+    key = _twilio_credentials_key(account_sid, auth_token)
+    with _twilio_clients_lock:
+        _twilio_user_keys[username] = key
+        client = _twilio_clients.get(key)
+        if client is not None:
+            _twilio_clients.move_to_end(key)
+            return client
+
+        client = Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True))
+        _twilio_clients[key] = client
+        while len(_twilio_clients) > TWILIO_CLIENT_POOL_SIZE:
+            evicted_key, evicted_client = _twilio_clients.popitem(last=False)
+            _close_twilio_client(evicted_client)
+            for evicted_username in [name for name, user_key in _twilio_user_keys.items() if user_key == evicted_key]:
+                del _twilio_user_keys[evicted_username]
+        return client
+
+def evict_twilio_client_for_user(username: str, twilio_settings: Optional[dict] = None):
+    """Usuń z puli klienta Twilio użytkownika, jeśli jego poświadczenia się zmieniły"""
+    twilio_settings = twilio_settings or {}
+    account_sid = twilio_settings.get("account_sid") or ""
+    auth_token = twilio_settings.get("auth_token") or ""
+    new_key = _twilio_credentials_key(account_sid, auth_token) if account_sid and auth_token else None
+
+    with _twilio_clients_lock:
+        old_key = _twilio_user_keys.get(username)
+        if old_key is None or old_key == new_key:
+            return
+        _twilio_user_keys.pop(username, None)
+        if old_key not in _twilio_user_keys.values():
+            old_client = _twilio_clients.pop(old_key, None)
+            if old_client is not None:
+                _close_twilio_client(old_client)
+            for loop, clients in _async_twilio_clients.items():
+                async_client = clients.pop(old_key, None)
+                if async_client is not None:
+                    _schedule_async_twilio_close(loop, async_client)
+            print(f"🔄 Usunięto klienta Twilio z puli dla użytkownika: {username}")
+
+def get_async_twilio_client(account_sid: str, auth_token: str) -> Client:
+    """Pobierz klienta Twilio z asynchronicznym transportem HTTP dla bieżącej pętli zdarzeń"""
+    loop = asyncio.get_running_loop()
+    key = _twilio_credentials_key(account_sid, auth_token)
+    with _twilio_clients_lock:
+        clients = _async_twilio_clients.setdefault(loop, OrderedDict())
+        client = clients.get(key)
+        if client is not None:
+            clients.move_to_end(key)
+            return client
+
+        client = Client(account_sid, auth_token, http_client=AsyncTwilioHttpClient(pool_connections=True))
+        clients[key] = client
+        while len(clients) > TWILIO_CLIENT_POOL_SIZE:
+            _, evicted = clients.popitem(last=False)
+            _schedule_async_twilio_close(loop, evicted)
+        return client
+
+def _schedule_async_twilio_close(loop, client: Client):
+    """Zamknij sesję aiohttp klienta w pętli, do której należy (także z innego wątku)"""
+    if loop.is_closed():
+        return
+    loop.call_soon_threadsafe(lambda: loop.create_task(client.http_client.close()))
+
+async def close_async_twilio_clients():
+    """Zamknij wszystkie sesje aiohttp klientów Twilio należące do bieżącej pętli zdarzeń"""
+    loop = asyncio.get_running_loop()
+    with _twilio_clients_lock:
+        clients = _async_twilio_clients.pop(loop, OrderedDict())
+    for client in clients.values():
+        await client.http_client.close()
+
+@app.on_event("shutdown")
+async def shutdown_twilio_clients():
+    """Zamknij sesje HTTP klientów Twilio przy zatrzymaniu serwera"""
+    await close_async_twilio_clients()
+
 # Funkcja do inicjalizacji Twilio dla konkretnego użytkownika
 def get_twilio_client_for_user(username: str):
     """Pobierz klienta Twilio dla konkretnego użytkownika z Firebase"""
@@ -469,14 +710,12 @@ def get_twilio_client_for_user(username: str):
     
     try:
         # Pobierz ustawienia użytkownika
-        settings_doc = db.collection(username).document("Dane").get()
+        settings_data = get_tenant_settings(username)
         
-        if not settings_doc.exists:
+        if settings_data is None:
             print(f"⚠️ Brak ustawień dla użytkownika: {username}")
             return None
         
-        settings_data = settings_doc.to_dict()
-        
         # Sprawdź czy użytkownik ma skonfigurowane Twilio
         if "twilio" not in settings_data:
             print(f"⚠️ Użytkownik {username} nie ma skonfigurowanego Twilio")
@@ -499,12 +738,14 @@ def get_twilio_client_for_user(username: str):
             print(f"⚠️ Brak messaging_service_sid ani phone_number dla użytkownika: {username}")
             return None
         
-        # Utwórz klienta Twilio
-        client = Client(account_sid, auth_token)
+        # Pobierz klienta Twilio z puli (ponowne użycie połączenia HTTPS)
+        client = get_pooled_twilio_client(username, account_sid, auth_token)
         print(f"✅ Twilio skonfigurowany dla użytkownika: {username}")
         
         return {
             "client": client,
+            "account_sid": account_sid,
+            "auth_token": auth_token,
             "phone_number": phone_number,
             "messaging_service_sid": messaging_service_sid
         }
@@ -513,20 +754,103 @@ def get_twilio_client_for_user(username: str):
         print(f"❌ Błąd inicjalizacji Twilio dla użytkownika {username}: {e}")
         return None
 
+# Funkcja do zapisywania wysłanego SMS w bazie danych
+def record_sent_sms(username: str, to_phone: str, message: str, sid: str):
+    """Zapisz wysłany SMS w kolekcji miesięcznej i zwiększ liczniki użytkownika"""
+    try:
+        record_sent_sms_batch(username, [{"to_phone": to_phone, "message": message, "sid": sid}])
+        print(f"📝 Zapisano informację o SMS w bazie danych")
+    except Exception as e:
+        print(f"⚠️ Błąd zapisywania SMS do bazy danych: {str(e)}")
+
+def record_sent_sms_batch(username: str, sent_messages: list):
+    """Zapisz wysłane SMS-y i statusy klientów zbiorczo (batche po maks. 400 operacji)
+    
+    Każdy element sent_messages to słownik z to_phone, message, sid oraz opcjonalnie
+    client_id, review_status i sms_count (przed wysyłką) - wtedy aktualizowany jest też
+    dokument klienta razem z terminem następnego przypomnienia.
+    Miesięczny licznik SMS został już zwiększony przy rezerwacji limitu.
+    """
+    if not sent_messages:
+        return
+    
+    now = datetime.now()
+    current_month = now.strftime("%Y-%m")
+    reminder_frequency = get_reminder_frequency(username)
+    batch = db.batch()
+    batch_size = 0
+    
+    for sent in sent_messages:
+        # Zapisz szczegóły SMS do kolekcji miesięcznej
+        sms_doc_ref = db.collection(username).document("SMS").collection(current_month).document()
+        batch.set(sms_doc_ref, {
+            "to_phone": sent["to_phone"],
+            "message": sent["message"],
+            "sid": sent["sid"],
+            "sent_at": now,
+            "status": "sent"
+        })
+        batch_size += 1
+        
+        # Zaktualizuj status klienta (bez ponownego odczytu dokumentu)
+        if sent.get("client_id"):
+            update_data = {
+                "last_sms_sent": now,
+                "updated_at": now,
+                "sms_count": firestore.Increment(1)
+            }
+            if sent.get("review_status") == "not_sent":
+                update_data["review_status"] = "sent"
+            # Drugi SMS jest ostatnim - kolejne przypomnienie tylko gdy klient dostał dopiero pierwszy
+            if (sent.get("sms_count") or 0) + 1 >= 2:
+                update_data["next_reminder_at"] = None
+            else:
+                update_data["next_reminder_at"] = now + timedelta(days=reminder_frequency)
+            batch.update(db.collection(username).document(sent["client_id"]), update_data)
+            batch_size += 1
+        
+        # Firestore pozwala na maksymalnie 500 operacji w jednym batchu
+        if batch_size >= 400:
+            batch.commit()
+            batch = db.batch()
+            batch_size = 0
+    
+    batch.commit()
+    
+    # Zwiększ licznik SMS w ustawieniach użytkownika (atomowo, bez odczytu) - osobno od batcha,
+    # bo brak dokumentu Dane cofnąłby zapis SMS-ów i statusów klientów
+    try:
+        db.collection(username).document("Dane").update({
+            "messaging.smsCount": firestore.Increment(len(sent_messages)),
+            "updated_at": now.isoformat()
+        })
+    except NotFound:
+        print(f"⚠️ Brak dokumentu Dane użytkownika {username} - pominięto licznik smsCount")
+    invalidate_tenant_settings(username)
+    # Licznik w rejestrze poza batchem - brak wpisu w rejestrze nie może cofnąć zapisu statusów klientów
+    increment_tenant_counter(username, "smsSent", len(sent_messages))
+
 # Funkcja do wysyłania SMS przez Twilio
-async def send_sms(to_phone: str, message: str, twilio_config: dict, username: str = None) -> dict:
-    """Wysyła SMS przez Twilio używając Messaging Service SID lub numeru telefonu"""
+async def send_sms(to_phone: str, message: str, twilio_config: dict, username: str = None, quota_reserved: bool = False, record_sms: bool = True) -> dict:
+    """Wysyła SMS przez Twilio używając Messaging Service SID lub numeru telefonu
+    
+    quota_reserved=True oznacza, że wywołujący zarezerwował już limit (reserve_sms_quota)
+    i sam zwolni niewykorzystane miejsca. record_sms=False oznacza, że wywołujący
+    sam zapisze SMS w bazie (np. zbiorczo przez record_sent_sms_batch).
+    """
     if not twilio_config:
         raise HTTPException(status_code=500, detail="Twilio nie jest skonfigurowany")
     
-    # Sprawdź limit SMS jeśli podano username
-    if username:
-        limit_check = check_sms_limit(username)
-        if not limit_check["allowed"]:
-            raise HTTPException(status_code=429, detail=limit_check["message"])
+    # Zarezerwuj limit SMS jeśli podano username
+    reservation = None
+    if username and not quota_reserved:
+        reservation = await run_in_threadpool(reserve_sms_quota, username, 1)
+        if not reservation["allowed"]:
+            raise HTTPException(status_code=429, detail=reservation["message"])
     
     try:
-        client = twilio_config["client"]
+        # Klient z asynchronicznym transportem - oczekiwanie na Twilio nie blokuje pętli zdarzeń
+        client = get_async_twilio_client(twilio_config["account_sid"], twilio_config["auth_token"])
         messaging_service_sid = twilio_config.get("messaging_service_sid")
         phone_number = twilio_config.get("phone_number")
         
@@ -549,7 +873,7 @@ async def send_sms(to_phone: str, message: str, twilio_config: dict, username: s
         if messaging_service_sid:
             print(f"📞 Używając Messaging Service SID: {messaging_service_sid}")
             # Dokładnie taka sama składnia jak w przykładzie Twilio SDK
-            message_obj = client.messages.create(
+            message_obj = await client.messages.create_async(
                 messaging_service_sid=messaging_service_sid,
                 body=message,
                 to=formatted_phone,
@@ -557,7 +881,7 @@ async def send_sms(to_phone: str, message: str, twilio_config: dict, username: s
             )
         elif phone_number:
             print(f"📞 Używając numeru telefonu: {phone_number}")
-            message_obj = client.messages.create(
+            message_obj = await client.messages.create_async(
                 body=message,
                 from_=phone_number,
                 to=formatted_phone
@@ -568,41 +892,8 @@ async def send_sms(to_phone: str, message: str, twilio_config: dict, username: s
         print(f"✅ SMS wysłany pomyślnie. SID: {message_obj.sid}")
         
         # Zapisz informację o wysłanym SMS do bazy danych i zwiększ licznik
-        if username:
-            try:
-                # Zapisz szczegóły SMS do kolekcji miesięcznej
-                current_month = datetime.now().strftime("%Y-%m")
-                sms_doc_ref = db.collection(username).document("SMS").collection(current_month).document()
-                sms_data = {
-                    "to_phone": to_phone,
-                    "message": message,
-                    "sid": message_obj.sid,
-                    "sent_at": datetime.now(),
-                    "status": "sent"
-                }
-                sms_doc_ref.set(sms_data)
-                
-                # Zwiększ licznik SMS w ustawieniach użytkownika
-                settings_doc_ref = db.collection(username).document("Dane")
-                settings_doc = settings_doc_ref.get()
-                if settings_doc.exists:
-                    settings_data = settings_doc.to_dict()
-                    if "messaging" not in settings_data:
-                        settings_data["messaging"] = {}
-                    if "smsCount" not in settings_data["messaging"]:
-                        settings_data["messaging"]["smsCount"] = 0
-                    
-                    # Zwiększ licznik o 1
-                    settings_data["messaging"]["smsCount"] = settings_data["messaging"]["smsCount"] + 1
-                    settings_data["updated_at"] = datetime.now().isoformat()
-                    
-                    # Zapisz zaktualizowane ustawienia
-                    settings_doc_ref.set(settings_data)
-                    print(f"📊 Licznik SMS zwiększony do: {settings_data['messaging']['smsCount']}")
-                
-                print(f"📝 Zapisano informację o SMS w bazie danych")
-            except Exception as e:
-                print(f"⚠️ Błąd zapisywania SMS do bazy danych: {str(e)}")
+        if username and record_sms:
+            await run_in_threadpool(record_sent_sms, username, to_phone, message, message_obj.sid)
         
         return {
             "success": True,
@@ -612,7 +903,909 @@ async def send_sms(to_phone: str, message: str, twilio_config: dict, username: s
         
     except Exception as e:
         print(f"❌ Błąd wysyłania SMS: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Błąd wysyłania SMS: {str(e)}")
+        # SMS nie został wysłany - zwolnij zarezerwowany limit
+        if reservation:
+            await run_in_threadpool(release_sms_quota, username, reservation["month"], 1)
+        # Błędy trwałe (np. niepoprawny numer) zwracamy jako 400, przejściowe jako 500 -
+        # kolejka SMS ponawia tylko te drugie
+        status_code = 500
+        if isinstance(e, HTTPException):
+            status_code = e.status_code
+        elif isinstance(e, TwilioRestException) and e.status and 400 <= e.status < 500 and e.status != 429:
+            status_code = 400
+        raise HTTPException(status_code=status_code, detail=f"Błąd wysyłania SMS: {str(e)}")
+
+# Limit wiadomości na sekundę na nadawcę Twilio (stosowany przez workery kolejki SMS)
+TWILIO_MESSAGES_PER_SECOND = float(os.getenv("TWILIO_MESSAGES_PER_SECOND", "10"))
+
+class SmsRateLimiter:
+    """Token bucket - ogranicza liczbę wiadomości na sekundę dla jednego nadawcy Twilio"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def reserve(self) -> float:
+        """Pobierz token i zwróć czas oczekiwania (w sekundach) na jego dostępność"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    async def acquire(self):
+        """Poczekaj (bez blokowania pętli zdarzeń), aż token będzie dostępny"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+_sms_rate_limiters = {}
+_sms_rate_limiters_lock = threading.Lock()
+
+def get_sms_rate_limiter(twilio_config: dict) -> SmsRateLimiter:
+    """Pobierz limiter dla nadawcy (Messaging Service SID lub numer telefonu)"""
+    sender = twilio_config.get("messaging_service_sid") or twilio_config.get("phone_number") or ""
+    with _sms_rate_limiters_lock:
+        limiter = _sms_rate_limiters.get(sender)
+        if limiter is None:
+            limiter = SmsRateLimiter(TWILIO_MESSAGES_PER_SECOND)
+            _sms_rate_limiters[sender] = limiter
+        return limiter
+
+# Grodzie (bulkheady) per użytkownik - jeden duży użytkownik nie może zająć całej
+# przepustowości (workerów kolejki SMS, puli wątków Firestore, schedulera)
+TENANT_SMS_MAX_IN_FLIGHT = int(os.getenv("TENANT_SMS_MAX_IN_FLIGHT", "2"))
+TENANT_READS_MAX_IN_FLIGHT = int(os.getenv("TENANT_READS_MAX_IN_FLIGHT", "4"))
+TENANT_BULKHEAD_WAIT_SECONDS = float(os.getenv("TENANT_BULKHEAD_WAIT_SECONDS", "10"))
+
+class TenantBulkhead:
+    """Limit równoczesnych operacji na użytkownika z kolejką oczekujących (FIFO)
+    
+    Działa z dowolnej pętli zdarzeń (również pętli schedulera w osobnym wątku) -
+    zwolnione miejsce jest przekazywane pierwszemu oczekującemu przez call_soon_threadsafe.
+    """
+    
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.peak = {}
+        self.waiters = {}
+    
+    def _take(self, username: str):
+        count = self.in_flight.get(username, 0) + 1
+        self.in_flight[username] = count
+        self.peak[username] = max(self.peak.get(username, 0), count)
+    
+    def try_acquire(self, username: str) -> bool:
+        """Zajmij miejsce bez czekania; False gdy użytkownik wykorzystał swój limit"""
+        with self.lock:
+            if self.in_flight.get(username, 0) >= self.limit:
+                return False
+            self._take(username)
+            return True
+    
+    def saturated(self) -> set:
+        """Użytkownicy, którzy wykorzystali swój limit"""
+        with self.lock:
+            return {username for username, count in self.in_flight.items() if count >= self.limit}
+    
+    async def acquire(self, username: str, timeout: float = None):
+        """Poczekaj na miejsce; po przekroczeniu czasu zgłasza HTTPException 429"""
+        with self.lock:
+            if self.in_flight.get(username, 0) < self.limit and not self.waiters.get(username):
+                self._take(username)
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.waiters.setdefault(username, deque()).append((loop, future))
+        
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self.lock:
+                waiting = self.waiters.get(username, deque())
+                if (loop, future) in waiting:
+                    waiting.remove((loop, future))
+                    granted = False
+                else:
+                    granted = True
+            if granted:
+                # Miejsce zostało przekazane w ostatniej chwili - oddaj je dalej
+                self.release(username)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise HTTPException(status_code=429, detail="Zbyt wiele równoczesnych operacji dla tego użytkownika, spróbuj ponownie")
+    
+    def release(self, username: str):
+        """Zwolnij miejsce lub przekaż je pierwszemu oczekującemu"""
+        with self.lock:
+            waiting = self.waiters.get(username)
+            if waiting:
+                loop, future = waiting.popleft()
+                if not waiting:
+                    del self.waiters[username]
+                # Miejsce przechodzi na oczekującego - licznik in_flight bez zmian
+                loop.call_soon_threadsafe(self._grant, future)
+                return
+            count = self.in_flight.get(username, 0) - 1
+            if count > 0:
+                self.in_flight[username] = count
+            else:
+                self.in_flight.pop(username, None)
+    
+    @staticmethod
+    def _grant(future):
+        if not future.done():
+            future.set_result(True)
+    
+    @asynccontextmanager
+    async def slot(self, username: str, timeout: float = TENANT_BULKHEAD_WAIT_SECONDS):
+        """Kontekst zajmujący miejsce użytkownika na czas operacji"""
+        await self.acquire(username, timeout)
+        try:
+            yield
+        finally:
+            self.release(username)
+    
+    def gauges(self) -> dict:
+        """Bieżące i szczytowe obciążenie każdego użytkownika"""
+        with self.lock:
+            usernames = set(self.in_flight) | set(self.waiters) | set(self.peak)
+            return {
+                "limit": self.limit,
+                "tenants": {
+                    username: {
+                        "in_flight": self.in_flight.get(username, 0),
+                        "waiting": len(self.waiters.get(username, ())),
+                        "peak": self.peak.get(username, 0)
+                    }
+                    for username in sorted(usernames)
+                }
+            }
+
+tenant_reads_bulkhead = TenantBulkhead("reads", TENANT_READS_MAX_IN_FLIGHT)
+tenant_scheduler_bulkhead = TenantBulkhead("scheduler", 1)
+
+# Rejestr zadań w tle - stan w SQLite obok kolejki SMS (wspólny dla wszystkich workerów na hoście),
+# kopia w Firestore (bulk_jobs) dla innych instancji
+BULK_JOB_FINISHED_STATUSES = ["completed", "failed"]
+BULK_JOB_PROGRESS_FLUSH_EVERY = int(os.getenv("BULK_JOB_PROGRESS_FLUSH_EVERY", "25"))
+BULK_JOB_RETENTION_SECONDS = int(os.getenv("BULK_JOB_RETENTION_SECONDS", "3600"))
+BULK_JOB_MIRROR_MAX_FAILURES = int(os.getenv("BULK_JOB_MIRROR_MAX_FAILURES", "100"))
+BULK_JOB_FIELDS = ["status", "total", "queued", "sent", "failed", "skipped", "dispatched", "message", "finished_at"]
+_bulk_job_tasks = set()
+
+class BulkJobStore:
+    """Liczniki i wyniki zadań w tle w SQLite (ta sama baza co kolejka SMS)
+    
+    Wiadomości zadania wysyła dowolny worker korzystający z kolejki, a proces, który utworzył
+    zadanie, mógł zostać zrestartowany - dlatego postęp nie może żyć w pamięci jednego procesu.
+    Każda zmiana podbija wersję zadania (kopia w Firestore nie jest nadpisywana starszym stanem).
+    """
+    
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS bulk_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    total INTEGER NOT NULL DEFAULT 0,
+                    queued INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    skipped INTEGER NOT NULL DEFAULT 0,
+                    dispatched INTEGER NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    version INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS bulk_job_results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    error TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_bulk_job_results_job ON bulk_job_results (job_id, status)")
+    
+    def _job_to_dict(self, row) -> dict:
+        job = dict(row)
+        job["dispatched"] = bool(job["dispatched"])
+        for field in ["created_at", "updated_at", "finished_at"]:
+            if job[field] is not None:
+                job[field] = datetime.fromtimestamp(job[field])
+        return job
+    
+    def _write(self, job_id: str, apply) -> Optional[tuple]:
+        """Zmień zadanie w transakcji (apply(conn)) i zakończ je, gdy wszystkie wiadomości obsłużono
+        
+        Zwraca (stan zadania, czy zadanie właśnie się zakończyło) lub None, gdy zadania nie ma.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT * FROM bulk_jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None:
+                    self.conn.execute("ROLLBACK")
+                    return None
+                apply(self.conn)
+                self.conn.execute(
+                    "UPDATE bulk_jobs SET version = version + 1, updated_at = ? WHERE job_id = ?", (now, job_id)
+                )
+                job = dict(self.conn.execute("SELECT * FROM bulk_jobs WHERE job_id = ?", (job_id,)).fetchone())
+                finished = job["status"] == "running" and job["dispatched"] and job["queued"] == 0
+                if finished:
+                    message = f"Proces wysyłania zakończony. Wysłano {job['sent']} z {job['total']} klientów"
+                    self.conn.execute("""
+                        UPDATE bulk_jobs SET status = 'completed', finished_at = ?, message = ? WHERE job_id = ?
+                    """, (now, message, job_id))
+                    job = dict(self.conn.execute("SELECT * FROM bulk_jobs WHERE job_id = ?", (job_id,)).fetchone())
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self._job_to_dict(job), finished
+    
+    def create(self, job_id: str, username: str, job_type: str) -> dict:
+        """Utwórz zadanie w stanie 'queued' i usuń zadania zakończone dawniej niż BULK_JOB_RETENTION_SECONDS"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale = "SELECT job_id FROM bulk_jobs WHERE finished_at IS NOT NULL AND finished_at < ?"
+                self.conn.execute(f"DELETE FROM bulk_job_results WHERE job_id IN ({stale})", (now - BULK_JOB_RETENTION_SECONDS,))
+                self.conn.execute(f"DELETE FROM bulk_jobs WHERE job_id IN ({stale})", (now - BULK_JOB_RETENTION_SECONDS,))
+                self.conn.execute("""
+                    INSERT INTO bulk_jobs (job_id, username, type, created_at, updated_at) VALUES (?, ?, ?, ?, ?)
+                """, (job_id, username, job_type, now, now))
+                row = self.conn.execute("SELECT * FROM bulk_jobs WHERE job_id = ?", (job_id,)).fetchone()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self._job_to_dict(row)
+    
+    def update(self, job_id: str, changes: dict) -> Optional[tuple]:
+        """Ustaw pola zadania (BULK_JOB_FIELDS)"""
+        changes = {
+            field: value.timestamp() if isinstance(value, datetime) else value
+            for field, value in changes.items() if field in BULK_JOB_FIELDS
+        }
+        
+        def apply(conn):
+            if changes:
+                assignments = ", ".join(f"{field} = ?" for field in changes)
+                conn.execute(f"UPDATE bulk_jobs SET {assignments} WHERE job_id = ?", (*changes.values(), job_id))
+        return self._write(job_id, apply)
+    
+    def record_results(self, job_id: str, results: list, dispatched: bool = False, message: str = None) -> Optional[tuple]:
+        """Zapisz wyniki (pary: wynik, komunikat błędu) i zaktualizuj liczniki
+        
+        Wyniki wysyłki z kolejki (dispatched=False) zmniejszają liczbę oczekujących wiadomości;
+        wyniki etapu kolejkowania (pominięci klienci) są już uwzględnione w licznikach.
+        """
+        def apply(conn):
+            for result, error in results:
+                status = result.get("status")
+                conn.execute(
+                    "INSERT INTO bulk_job_results (job_id, status, result, error) VALUES (?, ?, ?, ?)",
+                    (job_id, status, json.dumps(result), error)
+                )
+                if not dispatched and status in ["sent", "failed", "skipped"]:
+                    conn.execute(
+                        f"UPDATE bulk_jobs SET {status} = {status} + 1, queued = MAX(0, queued - 1) WHERE job_id = ?",
+                        (job_id,)
+                    )
+            if dispatched:
+                conn.execute(
+                    "UPDATE bulk_jobs SET dispatched = 1, message = ? WHERE job_id = ?", (message or "", job_id)
+                )
+        return self._write(job_id, apply)
+    
+    def get(self, job_id: str, max_failures: Optional[int] = None) -> Optional[dict]:
+        """Stan zadania z błędami i wynikami (max_failures - tylko tyle niepowodzeń, bez pełnych wyników)"""
+        limit = -1 if max_failures is None else max_failures
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM bulk_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = self._job_to_dict(row)
+            job["errors"] = [result_row["error"] for result_row in self.conn.execute(
+                "SELECT error FROM bulk_job_results WHERE job_id = ? AND error IS NOT NULL ORDER BY id LIMIT ?",
+                (job_id, limit)
+            )]
+            if max_failures is None:
+                job["results"] = [json.loads(result_row["result"]) for result_row in self.conn.execute(
+                    "SELECT result FROM bulk_job_results WHERE job_id = ? ORDER BY id", (job_id,)
+                )]
+                return job
+            job["failures"] = [json.loads(result_row["result"]) for result_row in self.conn.execute(
+                "SELECT result FROM bulk_job_results WHERE job_id = ? AND status = 'failed' ORDER BY id LIMIT ?",
+                (job_id, limit)
+            )]
+            error_count = self.conn.execute(
+                "SELECT COUNT(*) FROM bulk_job_results WHERE job_id = ? AND error IS NOT NULL", (job_id,)
+            ).fetchone()[0]
+        job["failures_truncated"] = max(0, job["failed"] - max_failures, error_count - max_failures)
+        return job
+
+@firestore.transactional
+def _persist_bulk_job_in_transaction(transaction, job_ref, data: dict) -> bool:
+    """Zapisz kopię zadania, jeśli jest nowsza niż zapisana (workery różnych procesów zapisują równolegle)"""
+    job_doc = job_ref.get(transaction=transaction)
+    if job_doc.exists and job_doc.to_dict().get("version", -1) >= data["version"]:
+        return False
+    transaction.set(job_ref, data, merge=True)
+    return True
+
+def _persist_bulk_job(job_id: str):
+    """Zapisz stan zadania w kolekcji bulk_jobs - liczniki i ograniczona lista niepowodzeń
+    
+    Pełna lista wyników zostaje w SQLite: przy dużej bazie klientów przekroczyłaby limit 1 MiB
+    dokumentu Firestore.
+    """
+    try:
+        data = bulk_job_store.get(job_id, max_failures=BULK_JOB_MIRROR_MAX_FAILURES)
+        if data is None:
+            return
+        job_ref = db.collection(BULK_JOBS_COLLECTION).document(job_id)
+        _persist_bulk_job_in_transaction(db.transaction(), job_ref, data)
+    except Exception as e:
+        print(f"⚠️ Błąd zapisywania stanu zadania {job_id}: {str(e)}")
+
+def create_bulk_job(username: str, job_type: str) -> dict:
+    """Utwórz nowe zadanie w tle w stanie 'queued'"""
+    job = bulk_job_store.create(secrets.token_hex(8), username, job_type)
+    _persist_bulk_job(job["job_id"])
+    return job
+
+def update_bulk_job(job_id: str, **changes):
+    """Zaktualizuj pola zadania i jego kopię w Firestore"""
+    if bulk_job_store.update(job_id, changes) is not None:
+        _persist_bulk_job(job_id)
+
+async def record_bulk_job_result(job_id: str, result: dict):
+    """Zapisz wynik wysyłki do jednego klienta i zaktualizuj liczniki postępu"""
+    error = None
+    if result.get("status") == "failed":
+        error = f"Błąd wysyłania SMS do {result.get('name', '')}: {result.get('error', '')}"
+    written = await run_in_threadpool(bulk_job_store.record_results, job_id, [(result, error)])
+    if written is None:
+        return
+    job, finished = written
+    # Postęp zapisujemy w Firestore co BULK_JOB_PROGRESS_FLUSH_EVERY wysyłek
+    if finished or (job["sent"] + job["failed"]) % BULK_JOB_PROGRESS_FLUSH_EVERY == 0:
+        await run_in_threadpool(_persist_bulk_job, job_id)
+
+def complete_bulk_job_dispatch(job_id: str, summary: dict):
+    """Zapisz wynik etapu kolejkowania zadania (pominięci klienci, komunikat)"""
+    errors = summary.get("errors", [])
+    # Błędy etapu kolejkowania odpowiadają kolejnym pominiętym klientom
+    pairs = [
+        (result, errors[index] if index < len(errors) else None)
+        for index, result in enumerate(summary.get("results", []))
+    ]
+    if bulk_job_store.record_results(job_id, pairs, dispatched=True, message=summary.get("message", "")) is not None:
+        _persist_bulk_job(job_id)
+
+def get_bulk_job(job_id: str) -> Optional[dict]:
+    """Pobierz stan zadania z bazy kolejki tego hosta lub (z innego hosta) z Firestore"""
+    job = bulk_job_store.get(job_id)
+    if job is not None:
+        return job
+    
+    job_doc = db.collection(BULK_JOBS_COLLECTION).document(job_id).get()
+    return job_doc.to_dict() if job_doc.exists else None
+
+def start_bulk_job(job_id: str, coroutine):
+    """Uruchom zadanie w tle na bieżącej pętli zdarzeń (kolejkowanie wiadomości)"""
+    async def run():
+        await run_in_threadpool(update_bulk_job, job_id, status="running")
+        try:
+            # Zadanie kończy się, gdy workery kolejki SMS obsłużą wszystkie jego wiadomości
+            summary = await coroutine
+            await run_in_threadpool(complete_bulk_job_dispatch, job_id, summary)
+        except Exception as e:
+            print(f"❌ Błąd zadania {job_id}: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            await run_in_threadpool(update_bulk_job, job_id, status="failed", message=str(e), finished_at=datetime.now())
+    
+    # Trzymamy referencję do zadania, żeby nie zostało usunięte przez garbage collector
+    task = asyncio.get_running_loop().create_task(run())
+    _bulk_job_tasks.add(task)
+    task.add_done_callback(_bulk_job_tasks.discard)
+
+# Trwała kolejka wychodzących SMS (SQLite) - wysyłka przez pulę workerów z ponawianiem
+SMS_QUEUE_DB = os.getenv("SMS_QUEUE_DB", "sms_outbox.db")
+# Osobne pule workerów (budżety współbieżności) dla każdego pasa kolejki:
+# interactive - ręczna wysyłka do jednego klienta, bulk - /send-sms-all, scheduled - przypomnienia
+SMS_QUEUE_LANES = {
+    "interactive": int(os.getenv("SMS_QUEUE_WORKERS_INTERACTIVE", "2")),
+    "bulk": int(os.getenv("SMS_QUEUE_WORKERS_BULK", "4")),
+    "scheduled": int(os.getenv("SMS_QUEUE_WORKERS_SCHEDULED", "2"))
+}
+SMS_QUEUE_LATENCY_SAMPLES = 200
+SMS_QUEUE_MAX_ATTEMPTS = int(os.getenv("SMS_QUEUE_MAX_ATTEMPTS", "5"))
+SMS_QUEUE_BACKOFF_BASE_SECONDS = float(os.getenv("SMS_QUEUE_BACKOFF_BASE_SECONDS", "5"))
+SMS_QUEUE_BACKOFF_MAX_SECONDS = float(os.getenv("SMS_QUEUE_BACKOFF_MAX_SECONDS", "600"))
+SMS_QUEUE_LEASE_SECONDS = float(os.getenv("SMS_QUEUE_LEASE_SECONDS", "120"))
+SMS_QUEUE_POLL_SECONDS = float(os.getenv("SMS_QUEUE_POLL_SECONDS", "1"))
+# Wysłane wiadomości trzymamy tylko przez okno idempotencji (ponowne dodanie z tym samym kluczem)
+SMS_QUEUE_SENT_RETENTION_SECONDS = float(os.getenv("SMS_QUEUE_SENT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+SMS_QUEUE_PURGE_INTERVAL_SECONDS = float(os.getenv("SMS_QUEUE_PURGE_INTERVAL_SECONDS", "3600"))
+
+class SmsOutbox:
+    """Kolejka SMS w SQLite: idempotentne klucze, ponawianie z backoffem i tabela dead-letter
+    
+    Statusy wiadomości: pending -> sending -> sent. Wiadomość, która wyczerpała próby
+    (lub zakończyła się błędem trwałym), trafia do tabeli sms_dead_letters.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sms_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    username TEXT NOT NULL,
+                    to_phone TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    payload TEXT NOT NULL DEFAULT '{}',
+                    lane TEXT NOT NULL DEFAULT 'interactive',
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    locked_until REAL,
+                    last_error TEXT,
+                    sid TEXT,
+                    scheduled_at REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sms_dead_letters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    outbox_id INTEGER NOT NULL,
+                    idempotency_key TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    to_phone TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    lane TEXT NOT NULL DEFAULT 'interactive',
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    failed_at REAL NOT NULL
+                )
+            """)
+            # Migracja kolejek utworzonych przed wprowadzeniem pasów
+            for table in ["sms_outbox", "sms_dead_letters"]:
+                columns = [row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+                if "lane" not in columns:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN lane TEXT NOT NULL DEFAULT 'interactive'")
+            # Migracja kolejki utworzonej przed planowaniem wysyłek w czasie
+            columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(sms_outbox)")]
+            if "scheduled_at" not in columns:
+                self.conn.execute("ALTER TABLE sms_outbox ADD COLUMN scheduled_at REAL")
+            self.conn.execute("DROP INDEX IF EXISTS idx_sms_outbox_due")
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sms_outbox_lane_due
+                ON sms_outbox (lane, status, next_attempt_at)
+            """)
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sms_outbox_lane_user
+                ON sms_outbox (lane, username, status, next_attempt_at)
+            """)
+    
+    def _row_to_dict(self, row) -> dict:
+        data = dict(row)
+        data["payload"] = json.loads(data.get("payload") or "{}")
+        return data
+    
+    def enqueue(self, idempotency_key: str, username: str, to_phone: str, message: str, payload: dict = None,
+                lane: str = "interactive", send_at: Optional[float] = None) -> dict:
+        """Dodaj SMS do kolejki w danym pasie; ponowne dodanie z tym samym kluczem nie tworzy duplikatu
+        
+        send_at (epoch) opóźnia pierwszą próbę wysyłki - używane do rozkładania przypomnień w czasie.
+        """
+        now = time.time()
+        scheduled_at = max(now, send_at or now)
+        with self.lock:
+            cursor = self.conn.execute("""
+                INSERT OR IGNORE INTO sms_outbox
+                    (idempotency_key, username, to_phone, message, payload, lane, next_attempt_at, scheduled_at,
+                     created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (idempotency_key, username, to_phone, message, json.dumps(payload or {}), lane, scheduled_at,
+                  scheduled_at, now, now))
+            created = cursor.rowcount == 1
+            row = self.conn.execute(
+                "SELECT * FROM sms_outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        result = self._row_to_dict(row)
+        result["created"] = created
+        return result
+    
+    def claim(self, lane: str, after_username: str = "", exclude_usernames=()) -> Optional[dict]:
+        """Pobierz następną wiadomość z pasa i zablokuj ją na czas SMS_QUEUE_LEASE_SECONDS
+        
+        Użytkownicy obsługiwani są po kolei (round-robin - pierwszy po after_username), więc duża
+        wysyłka jednego użytkownika nie wstrzymuje wiadomości pozostałych. Użytkownicy
+        z exclude_usernames (wykorzystany limit równoczesnych wysyłek) są pomijani.
+        Wiadomości w stanie 'sending' z wygasłą blokadą (np. po restarcie procesu) są pobierane ponownie.
+        """
+        now = time.time()
+        due = """
+            lane = ? AND ((status = 'pending' AND next_attempt_at <= ?)
+                          OR (status = 'sending' AND locked_until < ?))
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                usernames = [row["username"] for row in self.conn.execute(
+                    f"SELECT DISTINCT username FROM sms_outbox WHERE {due} ORDER BY username", (lane, now, now)
+                ) if row["username"] not in exclude_usernames]
+                row = None
+                if usernames:
+                    username = next((u for u in usernames if u > after_username), usernames[0])
+                    row = self.conn.execute(f"""
+                        SELECT * FROM sms_outbox
+                        WHERE {due} AND username = ?
+                        ORDER BY next_attempt_at, id
+                        LIMIT 1
+                    """, (lane, now, now, username)).fetchone()
+                    self.conn.execute("""
+                        UPDATE sms_outbox
+                        SET status = 'sending', attempts = attempts + 1, locked_until = ?, updated_at = ?
+                        WHERE id = ?
+                    """, (now + SMS_QUEUE_LEASE_SECONDS, now, row["id"]))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        claimed = self._row_to_dict(row)
+        claimed["attempts"] += 1
+        return claimed
+    
+    def mark_sent(self, message_id: int, sid: str):
+        """Oznacz wiadomość jako wysłaną"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("""
+                UPDATE sms_outbox
+                SET status = 'sent', sid = ?, locked_until = NULL, last_error = NULL, updated_at = ?
+                WHERE id = ?
+            """, (sid, now, message_id))
+    
+    def mark_retry(self, message_id: int, error: str, delay: float):
+        """Przywróć wiadomość do kolejki z opóźnieniem (backoff)"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("""
+                UPDATE sms_outbox
+                SET status = 'pending', next_attempt_at = ?, locked_until = NULL, last_error = ?, updated_at = ?
+                WHERE id = ?
+            """, (now + delay, error, now, message_id))
+    
+    def mark_dead(self, message_id: int, error: str):
+        """Przenieś wiadomość do tabeli dead-letter"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("""
+                    INSERT INTO sms_dead_letters
+                        (outbox_id, idempotency_key, username, to_phone, message, payload, lane, attempts, last_error, failed_at)
+                    SELECT id, idempotency_key, username, to_phone, message, payload, lane, attempts, ?, ?
+                    FROM sms_outbox WHERE id = ?
+                """, (error, now, message_id))
+                self.conn.execute("DELETE FROM sms_outbox WHERE id = ?", (message_id,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def purge_sent(self, older_than: float) -> int:
+        """Usuń wysłane wiadomości, których ostatnia zmiana jest starsza niż older_than (epoch)"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "DELETE FROM sms_outbox WHERE status = 'sent' AND updated_at < ?", (older_than,)
+            )
+        return cursor.rowcount
+    
+    def requeue_dead_letter(self, dead_letter_id: int) -> Optional[dict]:
+        """Przywróć wiadomość z tabeli dead-letter do kolejki (z wyzerowanymi próbami)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM sms_dead_letters WHERE id = ?", (dead_letter_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("DELETE FROM sms_dead_letters WHERE id = ?", (dead_letter_id,))
+        # Limit zwolniono przy przeniesieniu do dead-letter, a zadanie zbiorcze i przebieg przypomnień są już zakończone
+        payload = json.loads(row["payload"])
+        for key in ["quota_reserved", "quota_month", "job_id", "reminder_run_id"]:
+            payload.pop(key, None)
+        return self.enqueue(row["idempotency_key"], row["username"], row["to_phone"], row["message"], payload, row["lane"])
+    
+    def stats(self) -> dict:
+        """Liczba wiadomości w kolejce według statusu oraz liczba wiadomości w dead-letter"""
+        with self.lock:
+            counts = {row["status"]: row["count"] for row in self.conn.execute(
+                "SELECT status, COUNT(*) AS count FROM sms_outbox GROUP BY status"
+            )}
+            dead_count = self.conn.execute("SELECT COUNT(*) FROM sms_dead_letters").fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "sending": counts.get("sending", 0),
+            "sent": counts.get("sent", 0),
+            "dead": dead_count
+        }
+    
+    def lane_depths(self) -> dict:
+        """Głębokość kolejki w każdym pasie: oczekujące, w trakcie wysyłki i wiek najstarszej wiadomości"""
+        now = time.time()
+        depths = {lane: {"pending": 0, "sending": 0, "oldest_pending_seconds": 0.0} for lane in SMS_QUEUE_LANES}
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT lane, status, COUNT(*) AS count, MIN(COALESCE(scheduled_at, created_at)) AS oldest
+                FROM sms_outbox WHERE status IN ('pending', 'sending')
+                GROUP BY lane, status
+            """).fetchall()
+        for row in rows:
+            depth = depths.setdefault(row["lane"], {"pending": 0, "sending": 0, "oldest_pending_seconds": 0.0})
+            depth[row["status"]] = row["count"]
+            if row["status"] == "pending":
+                # Wiadomości zaplanowane na później jeszcze nie czekają
+                depth["oldest_pending_seconds"] = round(max(0.0, now - row["oldest"]), 1)
+        return depths
+    
+    def pending_timeline(self, lane: str, bucket_seconds: int = 60) -> list:
+        """Oczekujące wiadomości pasa pogrupowane według minuty planowanej wysyłki"""
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT CAST(next_attempt_at / ? AS INTEGER) AS bucket, COUNT(*) AS count
+                FROM sms_outbox WHERE lane = ? AND status = 'pending'
+                GROUP BY bucket ORDER BY bucket
+            """, (bucket_seconds, lane)).fetchall()
+        return [
+            {"at": datetime.fromtimestamp(row["bucket"] * bucket_seconds).isoformat(), "messages": row["count"]}
+            for row in rows
+        ]
+    
+    def dead_letters(self, limit: int = 50) -> list:
+        """Ostatnie wiadomości z tabeli dead-letter"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM sms_dead_letters ORDER BY failed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+sms_outbox = SmsOutbox(SMS_QUEUE_DB)
+bulk_job_store = BulkJobStore(SMS_QUEUE_DB)
+_sms_worker_tasks = []
+_sms_queue_wakeup = {"loop": None, "events": {}}
+# Pobieranie z pasa: blokada (pobranie + zajęcie miejsca użytkownika) i ostatnio obsłużony użytkownik
+_sms_lane_claims = {lane: {"lock": None, "after_username": ""} for lane in SMS_QUEUE_LANES}
+# Limit równoczesnych wysyłek jednego użytkownika w każdym pasie
+sms_lane_bulkheads = {lane: TenantBulkhead(f"sms_{lane}", TENANT_SMS_MAX_IN_FLIGHT) for lane in SMS_QUEUE_LANES}
+# Metryki pasów w pamięci: wiadomości w trakcie wysyłki i czasy od dodania do kolejki do wysłania
+_sms_lane_metrics = {
+    lane: {"in_flight": 0, "sent": 0, "failed": 0, "latencies": deque(maxlen=SMS_QUEUE_LATENCY_SAMPLES)}
+    for lane in SMS_QUEUE_LANES
+}
+
+def sms_retry_delay(attempts: int) -> float:
+    """Opóźnienie kolejnej próby: wykładniczy backoff z losowym rozrzutem (jitter)"""
+    delay = min(SMS_QUEUE_BACKOFF_MAX_SECONDS, SMS_QUEUE_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def wake_sms_workers(lane: str = None):
+    """Obudź workery pasa kolejki SMS (lub wszystkich pasów); można wywołać z dowolnego wątku"""
+    loop = _sms_queue_wakeup["loop"]
+    if loop is None or loop.is_closed():
+        return
+    for event_lane, event in _sms_queue_wakeup["events"].items():
+        if lane is None or event_lane == lane:
+            loop.call_soon_threadsafe(event.set)
+
+def enqueue_sms(idempotency_key: str, username: str, to_phone: str, message: str, payload: dict = None,
+                lane: str = "interactive", send_at: Optional[float] = None) -> dict:
+    """Dodaj SMS do trwałej kolejki w danym pasie i obudź jego workery"""
+    if lane not in SMS_QUEUE_LANES:
+        raise ValueError(f"Nieznany pas kolejki SMS: {lane}")
+    queued = sms_outbox.enqueue(idempotency_key, username, to_phone, message, payload, lane, send_at)
+    if queued["created"]:
+        print(f"📥 SMS dodany do kolejki ({lane}): {idempotency_key}")
+    else:
+        print(f"♻️ SMS już jest w kolejce: {idempotency_key}")
+    wake_sms_workers(lane)
+    return queued
+
+def get_sms_lane_metrics() -> dict:
+    """Metryki pasów kolejki SMS: budżet workerów, głębokość kolejki i czasy oczekiwania (p50/p95)"""
+    depths = sms_outbox.lane_depths()
+    metrics = {}
+    for lane, workers in SMS_QUEUE_LANES.items():
+        lane_metrics = _sms_lane_metrics[lane]
+        latencies = sorted(lane_metrics["latencies"])
+        metrics[lane] = {
+            "workers": workers,
+            "in_flight": lane_metrics["in_flight"],
+            "sent": lane_metrics["sent"],
+            "failed": lane_metrics["failed"],
+            **depths.get(lane, {}),
+            "queue_latency_p50_seconds": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "queue_latency_p95_seconds": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None
+        }
+    return metrics
+
+def client_sms_idempotency_key(username: str, client_id: str, sms_count: int) -> str:
+    """Klucz idempotencji SMS do klienta - n-ty SMS do klienta może trafić do kolejki tylko raz"""
+    return f"{username}:{client_id}:{sms_count + 1}"
+
+async def process_outbox_message(queued: dict):
+    """Wyślij jedną wiadomość z kolejki i zapisz wynik (wysłana / ponowienie / dead-letter)"""
+    username = queued["username"]
+    payload = queued["payload"]
+    quota_reserved = payload.get("quota_reserved", False)
+    result = {
+        "client_id": payload.get("client_id"),
+        "name": payload.get("name", ""),
+        "phone": queued["to_phone"]
+    }
+    
+    try:
+        twilio_config = await run_in_threadpool(get_twilio_client_for_user, username)
+        if not twilio_config:
+            raise HTTPException(status_code=400, detail="Twilio nie jest skonfigurowany dla tego użytkownika")
+        
+        await get_sms_rate_limiter(twilio_config).acquire()
+        sms_result = await send_sms(queued["to_phone"], queued["message"], twilio_config, username,
+                                    quota_reserved=quota_reserved, record_sms=False)
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        status_code = e.status_code if isinstance(e, HTTPException) else 500
+        
+        # Błędy przejściowe (5xx, sieć) ponawiamy; błędy trwałe (4xx, limit) od razu do dead-letter
+        if status_code >= 500 and queued["attempts"] < SMS_QUEUE_MAX_ATTEMPTS:
+            delay = sms_retry_delay(queued["attempts"])
+            await run_in_threadpool(sms_outbox.mark_retry, queued["id"], error, delay)
+            print(f"🔁 Ponowienie SMS {queued['idempotency_key']} za {delay:.1f}s (próba {queued['attempts']})")
+            return
+        
+        await run_in_threadpool(sms_outbox.mark_dead, queued["id"], error)
+        _sms_lane_metrics[queued["lane"]]["failed"] += 1
+        print(f"☠️ SMS {queued['idempotency_key']} przeniesiony do dead-letter: {error}")
+        if quota_reserved:
+            await run_in_threadpool(release_sms_quota, username, payload.get("quota_month"), 1)
+        if payload.get("reminder_run_id"):
+            reminder_telemetry.record_sms_result(payload["reminder_run_id"], sent=False)
+        if payload.get("job_id"):
+            result.update({"status": "failed", "error": error})
+            await record_bulk_job_result(payload["job_id"], result)
+        return
+    
+    await run_in_threadpool(sms_outbox.mark_sent, queued["id"], sms_result["sid"])
+    _sms_lane_metrics[queued["lane"]]["sent"] += 1
+    waiting_since = max(queued["created_at"], queued.get("scheduled_at") or queued["created_at"])
+    _sms_lane_metrics[queued["lane"]]["latencies"].append(time.time() - waiting_since)
+    if payload.get("reminder_run_id"):
+        reminder_telemetry.record_sms_result(payload["reminder_run_id"], sent=True)
+    
+    # Zapisz SMS i status klienta w Firestore
+    try:
+        await run_in_threadpool(record_sent_sms_batch, username, [{
+            "to_phone": queued["to_phone"],
+            "message": queued["message"],
+            "sid": sms_result["sid"],
+            "client_id": payload.get("client_id"),
+            "review_status": payload.get("review_status"),
+            "sms_count": payload.get("sms_count")
+        }])
+    except Exception as e:
+        print(f"⚠️ Błąd zapisywania SMS do bazy danych: {str(e)}")
+    
+    if payload.get("job_id"):
+        result.update({"status": "sent", "sid": sms_result["sid"]})
+        await record_bulk_job_result(payload["job_id"], result)
+
+async def sms_queue_worker(lane: str, worker_id: int):
+    """Worker pasa kolejki SMS - pobiera i wysyła wiadomości, czeka na nowe gdy pas jest pusty"""
+    event = _sms_queue_wakeup["events"][lane]
+    lane_metrics = _sms_lane_metrics[lane]
+    lane_claims = _sms_lane_claims[lane]
+    bulkhead = sms_lane_bulkheads[lane]
+    while True:
+        try:
+            async with lane_claims["lock"]:
+                queued = await run_in_threadpool(
+                    sms_outbox.claim, lane, lane_claims["after_username"], bulkhead.saturated()
+                )
+                if queued:
+                    lane_claims["after_username"] = queued["username"]
+                    bulkhead.try_acquire(queued["username"])
+            if not queued:
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=SMS_QUEUE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            lane_metrics["in_flight"] += 1
+            try:
+                await process_outbox_message(queued)
+            finally:
+                lane_metrics["in_flight"] -= 1
+                bulkhead.release(queued["username"])
+                # Zwolnione miejsce użytkownika - inne workery mogą pobrać jego kolejną wiadomość
+                event.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Błąd workera kolejki SMS {lane}#{worker_id}: {str(e)}")
+            await asyncio.sleep(SMS_QUEUE_POLL_SECONDS)
+
+async def sms_outbox_purge_loop():
+    """Okresowo usuwaj z kolejki wiadomości wysłane dawniej niż SMS_QUEUE_SENT_RETENTION_SECONDS"""
+    while True:
+        try:
+            purged = await run_in_threadpool(sms_outbox.purge_sent, time.time() - SMS_QUEUE_SENT_RETENTION_SECONDS)
+            if purged:
+                print(f"🧹 Usunięto z kolejki SMS {purged} wysłanych wiadomości")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Błąd czyszczenia kolejki SMS: {str(e)}")
+        await asyncio.sleep(SMS_QUEUE_PURGE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_sms_queue_workers():
+    """Uruchom pulę workerów kolejki SMS na pętli zdarzeń aplikacji"""
+    _sms_queue_wakeup["loop"] = asyncio.get_running_loop()
+    for lane, workers in SMS_QUEUE_LANES.items():
+        _sms_queue_wakeup["events"][lane] = asyncio.Event()
+        _sms_lane_claims[lane]["lock"] = asyncio.Lock()
+        for worker_id in range(workers):
+            _sms_worker_tasks.append(asyncio.create_task(sms_queue_worker(lane, worker_id)))
+    _sms_worker_tasks.append(asyncio.create_task(sms_outbox_purge_loop()))
+    print(f"✅ Kolejka SMS: {SMS_QUEUE_DB}, workery: {SMS_QUEUE_LANES}")
+
+@app.on_event("shutdown")
+async def stop_sms_queue_workers():
+    """Zatrzymaj workery kolejki SMS (niewysłane wiadomości zostają w kolejce)"""
+    for task in _sms_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_sms_worker_tasks, return_exceptions=True)
+    _sms_worker_tasks.clear()
+    _sms_queue_wakeup["loop"] = None
+    _sms_queue_wakeup["events"] = {}
 
 # Funkcja do generowania unikalnego kodu recenzji
 def generate_review_code():
@@ -620,6 +1813,221 @@ def generate_review_code():
     alphabet = string.ascii_lowercase + string.digits
     return ''.join(secrets.choice(alphabet) for _ in range(10))
 
+# Indeks kodów recenzji: review_code -> (właściciel, id klienta)
+REVIEW_CODES_COLLECTION = "review_codes"
+
+# Katalog emaili: email -> (username, uprawnienia)
+USER_EMAILS_COLLECTION = "user_emails"
+
+# Rejestr użytkowników (tenantów) - zwięzły rekord na użytkownika dla zadań wsadowych
+TENANTS_COLLECTION = "tenants"
+
+# Zadania w tle (np. wysyłka SMS do wszystkich klientów) - kopia stanu dla odpytywania postępu
+BULK_JOBS_COLLECTION = "bulk_jobs"
+SCHEDULER_LEASES_COLLECTION = "scheduler_leases"
+
+# Kolekcje systemowe - nie są kolekcjami użytkowników
+SYSTEM_COLLECTIONS = ["Dane", "temp_clients", "notifications", REVIEW_CODES_COLLECTION, USER_EMAILS_COLLECTION, TENANTS_COLLECTION, BULK_JOBS_COLLECTION, SCHEDULER_LEASES_COLLECTION]
+
+def register_review_code(review_code: str, owner_username: str, client_id: str, is_temp_client: bool = False):
+    """Zapisz kod recenzji w indeksie review_codes (jeden dokument na kod)"""
+    db.collection(REVIEW_CODES_COLLECTION).document(review_code).set({
+        "owner_username": owner_username,
+        "client_id": client_id,
+        "is_temp_client": is_temp_client,
+        "created_at": datetime.now()
+    })
+
+def unregister_review_code(review_code: str):
+    """Usuń kod recenzji z indeksu review_codes"""
+    db.collection(REVIEW_CODES_COLLECTION).document(review_code).delete()
+
+def find_review_code(review_code: str) -> Optional[dict]:
+    """Znajdź właściciela i klienta dla kodu recenzji jednym odczytem z indeksu"""
+    index_doc = db.collection(REVIEW_CODES_COLLECTION).document(review_code).get()
+    if not index_doc.exists:
+        return None
+
+    entry = index_doc.to_dict()
+    is_temp_client = entry.get("is_temp_client", False)
+    return {
+        "owner_username": entry.get("owner_username"),
+        "client_id": entry.get("client_id"),
+        "is_temp_client": is_temp_client,
+        "collection": "temp_clients" if is_temp_client else entry.get("owner_username")
+    }
+
+def normalize_email(email: str) -> str:
+    """Znormalizuj email do postaci używanej jako id dokumentu w katalogu emaili"""
+    return (email or "").strip().lower()
+
+def register_user_email(email: str, username: str, permission=UserPermission.DEMO):
+    """Zapisz email użytkownika w katalogu user_emails"""
+    email_key = normalize_email(email)
+    if not email_key or "/" in email_key:
+        return
+
+    db.collection(USER_EMAILS_COLLECTION).document(email_key).set({
+        "username": username,
+        "permission": UserPermission(permission).value,
+        "updated_at": datetime.now()
+    })
+
+def update_user_email_permission(username: str, settings_data: dict, permission):
+    """Zaktualizuj uprawnienia w katalogu emaili po zmianie uprawnień użytkownika
+    
+    Zapisuje pełny wpis (razem z username), żeby email, który nie był jeszcze w katalogu,
+    nie dostał wpisu bez użytkownika.
+    """
+    register_user_email(settings_data.get("userData", {}).get("email", ""), username, permission)
+
+def unregister_user_email(email: str, username: str):
+    """Usuń email z katalogu emaili, jeśli wskazuje na tego użytkownika (np. po zmianie emaila)"""
+    email_key = normalize_email(email)
+    if not email_key or "/" in email_key:
+        return
+
+    email_ref = db.collection(USER_EMAILS_COLLECTION).document(email_key)
+    email_doc = email_ref.get()
+    if email_doc.exists and email_doc.to_dict().get("username") == username:
+        email_ref.delete()
+
+def sync_tenant_registry(username: str, settings_data: dict):
+    """Zaktualizuj wpis użytkownika w rejestrze tenants na podstawie dokumentu Dane"""
+    messaging = settings_data.get("messaging", {}) or {}
+    send_time = messaging.get("sendTime") or {"hour": 10, "minute": 0}
+    permission = settings_data.get("permission", "Demo")
+
+    db.collection(TENANTS_COLLECTION).document(username).set({
+        "username": username,
+        "email": settings_data.get("userData", {}).get("email", ""),
+        "permission": getattr(permission, "value", permission),
+        "autoSendEnabled": messaging.get("autoSendEnabled", False),
+        "sendHour": send_time.get("hour", 10),
+        "sendMinute": send_time.get("minute", 0),
+        "reminderFrequency": messaging.get("reminderFrequency", 7),
+        "smsLimit": messaging.get("smsLimit", 10),
+        "updated_at": datetime.now()
+    }, merge=True)
+    reminder_scheduler.update_from_settings(username, settings_data)
+
+def increment_tenant_counter(username: str, counter: str, amount: int = 1):
+    """Atomowo zmień licznik (clientsCount, smsSent) w rejestrze tenants
+    
+    Brakującego wpisu nie tworzymy (powstałby dokument z samym licznikiem) - liczniki
+    użytkowników spoza rejestru inicjalizuje backfill_tenants, licząc klientów i SMS-y.
+    """
+    try:
+        db.collection(TENANTS_COLLECTION).document(username).update({counter: firestore.Increment(amount)})
+    except NotFound:
+        print(f"⚠️ Brak wpisu {username} w rejestrze tenants - pominięto licznik {counter}")
+
+# Miesięczne liczniki SMS: {username}/SMS/counters/{YYYY-MM} z polem "count"
+SMS_COUNTERS_COLLECTION = "counters"
+
+def get_sms_counter_ref(username: str, month: str):
+    """Referencja do dokumentu licznika SMS użytkownika dla danego miesiąca"""
+    return db.collection(username).document("SMS").collection(SMS_COUNTERS_COLLECTION).document(month)
+
+def count_documents(query) -> int:
+    """Policz dokumenty zapytania agregacją count() (bez pobierania dokumentów)"""
+    result = query.count().get()
+    return int(result[0][0].value)
+
+def get_monthly_sms_count(username: str, month: str) -> int:
+    """Pobierz liczbę SMS wysłanych w danym miesiącu z licznika (jeden odczyt)"""
+    counter_ref = get_sms_counter_ref(username, month)
+    counter_doc = counter_ref.get()
+    if counter_doc.exists:
+        return counter_doc.to_dict().get("count", 0)
+
+    # Brak licznika (miesiąc sprzed wprowadzenia liczników) - policz agregacją i zapisz
+    sent_count = count_documents(db.collection(username).document("SMS").collection(month))
+    try:
+        counter_ref.create({"count": sent_count, "month": month, "updated_at": datetime.now()})
+    except Exception:
+        # Licznik utworzony w międzyczasie przez zapis SMS - użyj aktualnej wartości
+        counter_doc = counter_ref.get()
+        if counter_doc.exists:
+            return counter_doc.to_dict().get("count", 0)
+    return sent_count
+
+def find_user_by_email(email: str) -> Optional[dict]:
+    """Znajdź username i uprawnienia użytkownika jednym odczytem z katalogu emaili"""
+    email_key = normalize_email(email)
+    if not email_key or "/" in email_key:
+        return None
+
+    email_doc = db.collection(USER_EMAILS_COLLECTION).document(email_key).get()
+    if not email_doc.exists:
+        return None
+
+    return email_doc.to_dict()
+
+# Cache ustawień użytkowników (dokument "Dane") - TTL + LRU, unieważniany przy zapisie
+# Telemetria przebiegów przypomnień - liczniki odczytów/zapisów Firestore bieżącego użytkownika
+# są trzymane w zmiennej kontekstowej (przechodzi też do wątków run_in_threadpool)
+_reminder_tenant_stats = contextvars.ContextVar("reminder_tenant_stats", default=None)
+
+def count_firestore_ops(reads: int = 0, writes: int = 0):
+    """Dolicz operacje Firestore do statystyk przetwarzanego użytkownika (poza przebiegiem - nic)"""
+    stats = _reminder_tenant_stats.get()
+    if stats is not None:
+        stats["firestore_reads"] += reads
+        stats["firestore_writes"] += writes
+
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "60"))
+SETTINGS_CACHE_MAX_SIZE = int(os.getenv("SETTINGS_CACHE_MAX_SIZE", "1000"))
+_settings_cache = OrderedDict()
+# Trwające odczyty Dane: username -> [generacja, liczba odczytów]. Unieważnienie podbija generację,
+# żeby odczyt, który trwał w tym czasie, nie zapisał do cache nieaktualnych danych. Wpis istnieje
+# tylko w trakcie odczytu, więc słownik nie rośnie z liczbą użytkowników
+_settings_loads = {}
+_settings_cache_lock = threading.Lock()
+
+def get_tenant_settings(username: str) -> Optional[dict]:
+    """Pobierz dokument Dane użytkownika z cache lub z Firestore (None jeśli nie istnieje)"""
+    now = time.monotonic()
+    with _settings_cache_lock:
+        entry = _settings_cache.get(username)
+        if entry and entry[0] > now:
+            _settings_cache.move_to_end(username)
+            return copy.deepcopy(entry[1])
+        load = _settings_loads.setdefault(username, [0, 0])
+        load[1] += 1
+        generation = load[0]
+
+    settings_data = None
+    try:
+        settings_doc = db.collection(username).document("Dane").get()
+        count_firestore_ops(reads=1)
+        if settings_doc.exists:
+            settings_data = settings_doc.to_dict()
+    finally:
+        with _settings_cache_lock:
+            load = _settings_loads[username]
+            load[1] -= 1
+            if not load[1]:
+                del _settings_loads[username]
+            if settings_data is not None and load[0] == generation:
+                _settings_cache[username] = (now + SETTINGS_CACHE_TTL_SECONDS, settings_data)
+                _settings_cache.move_to_end(username)
+                while len(_settings_cache) > SETTINGS_CACHE_MAX_SIZE:
+                    _settings_cache.popitem(last=False)
+
+    if settings_data is None:
+        invalidate_tenant_settings(username)
+        return None
+    return copy.deepcopy(settings_data)
+
+def invalidate_tenant_settings(username: str):
+    """Usuń ustawienia użytkownika z cache po zapisie dokumentu Dane"""
+    with _settings_cache_lock:
+        _settings_cache.pop(username, None)
+        load = _settings_loads.get(username)
+        if load:
+            load[0] += 1
+
 # Funkcja do wysyłania emaili kontaktowych
 async def send_contact_email(contact_data: ContactFormRequest) -> dict:
     """Wysyła email kontaktowy na adres kontakt@next-reviews-booster.com"""
@@ -892,112 +2300,419 @@ Zespół NEXT reviews BOOSTER
         }
 
 
-# Funkcja do generowania kodu QR
-def generate_qr_code(data: str, size: int = 200) -> bytes:
-    """Generuje kod QR jako bytes z lepszą konfiguracją zgodnie z dokumentacją"""
-    # Oblicz box_size na podstawie żądanego rozmiaru
-    # Dla wersji 1 (21x21) z border=4, całkowity rozmiar to (21 + 2*4) * box_size
-    # Dla rozmiaru 200px: box_size = 200 / (21 + 8) = ~6.9, zaokrąglamy do 7
-    box_size = max(4, size // 30)  # Minimum 4px na box
+# Cache wygenerowanych kodów QR (renderowanie w qr_rendering.py; LRU ograniczone sumarycznym rozmiarem
+# w bajtach) - obraz zależy tylko od (dane, rozmiar, format), więc ponowne wyświetlenia plakatów i stron do druku nie kosztują CPU
+QR_CACHE_MAX_BYTES = int(os.getenv("QR_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+_qr_code_cache = OrderedDict()
+_qr_code_cache_bytes = [0]
+_qr_code_cache_lock = threading.Lock()
+
+def get_qr_code_bytes(data: str, size: int = 200, fmt: str = "png") -> tuple:
+    """Kod QR jako (bytes PNG/SVG, silny ETag) - z cache lub wygenerowany i zapisany w cache"""
+    key = (data, size, fmt)
+    with _qr_code_cache_lock:
+        entry = _qr_code_cache.get(key)
+        if entry is not None:
+            _qr_code_cache.move_to_end(key)
+            return entry
     
-    qr = qrcode.QRCode(
-        version=None,  # Automatyczny wybór wersji zgodnie z dokumentacją
-        error_correction=qrcode.constants.ERROR_CORRECT_M,  # 15% korekta błędów (domyślne)
-        box_size=box_size,
-        border=4,  # Minimalny border zgodnie ze specyfikacją
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
+    renderer, _ = QR_RENDERERS[fmt]
+    image_bytes = renderer(data, size)
+    entry = (image_bytes, f'"{hashlib.sha256(image_bytes).hexdigest()[:32]}"')
+    if len(image_bytes) > QR_CACHE_MAX_BYTES:
+        return entry
+    with _qr_code_cache_lock:
+        previous = _qr_code_cache.pop(key, None)
+        if previous is not None:
+            _qr_code_cache_bytes[0] -= len(previous[0])
+        _qr_code_cache[key] = entry
+        _qr_code_cache_bytes[0] += len(image_bytes)
+        while _qr_code_cache_bytes[0] > QR_CACHE_MAX_BYTES:
+            _, (evicted, _) = _qr_code_cache.popitem(last=False)
+            _qr_code_cache_bytes[0] -= len(evicted)
+    return entry
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Czy nagłówek If-None-Match pasuje do ETag (porównanie słabe, jak wymaga RFC 9110 dla GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+# Eksport kodów QR wszystkich klientów (ZIP z PNG lub arkusz PDF) - renderowanie w puli procesów,
+# wynik wysyłany strumieniowo; w locie jest najwyżej QR_EXPORT_WINDOW kodów, więc pamięć nie rośnie
+# z liczbą klientów
+QR_EXPORT_WORKERS = int(os.getenv("QR_EXPORT_WORKERS", str(os.cpu_count() or 2)))
+QR_EXPORT_WINDOW = QR_EXPORT_WORKERS * 4
+_qr_export_pool = {"executor": None}
+_qr_export_pool_lock = threading.Lock()
+
+def _qr_export_mp_context():
+    """Sposób uruchamiania procesów puli - forkserver (lub spawn), nigdy fork
     
-    # Generuj obraz z lepszymi kolorami
-    img = qr.make_image(
-        fill_color="black", 
-        back_color="white"
-    )
+    Fork wielowątkowego procesu (kanały gRPC Firestore, wątki serwera) może zakleszczyć proces
+    potomny na blokadzie zajętej przez inny wątek w chwili forka.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Serwer procesów ma już zaimportowany moduł renderowania - szybszy start workerów
+        context.set_forkserver_preload(["qr_rendering"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+def get_qr_export_pool() -> ProcessPoolExecutor:
+    """Pula procesów do renderowania eksportu (tworzona przy starcie aplikacji)"""
+    with _qr_export_pool_lock:
+        if _qr_export_pool["executor"] is None:
+            _qr_export_pool["executor"] = ProcessPoolExecutor(
+                max_workers=QR_EXPORT_WORKERS, mp_context=_qr_export_mp_context()
+            )
+        return _qr_export_pool["executor"]
+
+@app.on_event("startup")
+async def start_qr_export_pool():
+    """Uruchom procesy puli eksportu kodów QR przy starcie, a nie w trakcie obsługi żądania
+
+    ProcessPoolExecutor startuje procesy dopiero przy zleceniu zadań, więc każdy worker
+    dostaje puste zadanie.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_qr_export_pool()
+    try:
+        await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(QR_EXPORT_WORKERS)))
+        print(f"🖨️ Pula eksportu QR gotowa ({QR_EXPORT_WORKERS} procesów)")
+    except Exception as e:
+        print(f"⚠️ Nie udało się uruchomić puli eksportu QR: {str(e)}")
+
+@app.on_event("shutdown")
+async def stop_qr_export_pool():
+    """Zamknij pulę procesów eksportu kodów QR"""
+    with _qr_export_pool_lock:
+        executor, _qr_export_pool["executor"] = _qr_export_pool["executor"], None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Niewyszukiwalny bufor dla zipfile - zapisane bajty są odbierane kawałkami przez drain()"""
     
-    # Jeśli obraz jest za duży, przeskaluj go
-    if img.size[0] > size:
-        # Użyj LANCZOS zamiast ANTIALIAS (nowsze wersje Pillow)
-        from PIL import Image
-        img = img.resize((size, size), Image.Resampling.LANCZOS)
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
     
-    # Konwertuj do bytes z optymalizacją
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format='PNG', optimize=True)
-    img_bytes.seek(0)
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
     
-    return img_bytes.getvalue()
+    def tell(self) -> int:
+        return self.position
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+async def render_qr_export(items: list, renderer, size: int):
+    """Renderuj kody w puli procesów (okno QR_EXPORT_WINDOW) i zwracaj wyniki w kolejności klientów"""
+    loop = asyncio.get_running_loop()
+    pool = get_qr_export_pool()
+    pending = deque()
+    items = iter(items)
+    try:
+        while True:
+            while len(pending) < QR_EXPORT_WINDOW:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending.append((item, loop.run_in_executor(pool, renderer, item["url"], size)))
+            if not pending:
+                return
+            item, future = pending.popleft()
+            yield item, await future
+    finally:
+        # Klient przerwał pobieranie - nie renderuj pozostałych kodów
+        for _, future in pending:
+            future.cancel()
+
+async def stream_qr_export_zip(items: list, size: int):
+    """ZIP z plikami PNG (bez kompresji - PNG jest już skompresowany)"""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for item, png in render_qr_export(items, render_qr_png, size):
+            archive.writestr(item["filename"], png)
+            yield buffer.drain()
+    yield buffer.drain()
+
+async def stream_qr_export_pdf(items: list, size: int):
+    """Arkusz PDF z kodami QR i nazwami klientów"""
+    writer = QrPdfSheetWriter()
+    yield writer.begin()
+    async for item, (side, bitmap) in render_qr_export(items, render_qr_bitmap, size):
+        page = writer.add_card(side, bitmap, item["name"])
+        if page:
+            yield page
+    yield writer.finish()
+
+def list_qr_export_items(username: str) -> list:
+    """Klienci użytkownika z kodem recenzji: nazwa pliku, podpis i adres kodu QR"""
+    base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
+    items = []
+    for doc in db.collection(username).stream():
+        if doc.id == "Dane":
+            continue
+        client_data = doc.to_dict()
+        review_code = client_data.get("review_code")
+        if not review_code:
+            continue
+        name = client_data.get("name", "") or review_code
+        safe_name = "".join(char if char.isalnum() else "_" for char in name).strip("_")[:40]
+        items.append({
+            "filename": f"qr_{safe_name}_{review_code}.png" if safe_name else f"qr_{review_code}.png",
+            "name": name,
+            "url": f"{base_url}/review/{review_code}"
+        })
+    items.sort(key=lambda item: item["name"].lower())
+    return items
 
 # Funkcja do sprawdzania i wysyłania cyklicznych przypomnień SMS
-async def check_and_send_reminders():
-    """Sprawdź wszystkich klientów i wyślij przypomnienia SMS jeśli potrzebne"""
-    print("🔄 Rozpoczęcie sprawdzania przypomnień SMS...")
+def get_reminder_frequency(username: str) -> int:
+    """Częstotliwość przypomnień SMS użytkownika w dniach (z ustawień w cache)"""
+    settings_data = get_tenant_settings(username) or {}
+    return (settings_data.get("messaging") or {}).get("reminderFrequency", 7)
+
+def compute_next_reminder_at(client_data: dict, reminder_frequency: int) -> Optional[datetime]:
+    """Termin następnego przypomnienia SMS dla klienta (None - klient nie dostanie już przypomnienia)
     
-    if not db:
-        print("❌ Firebase nie jest skonfigurowany")
-        return
+    Warunki odpowiadają sprawdzeniom w check_and_send_reminders: pierwszy SMS od razu po dodaniu
+    klienta, kolejny po reminder_frequency dniach od ostatniego SMS, maksymalnie 2 SMS.
+    """
+    if not client_data.get("phone") or not client_data.get("review_code"):
+        return None
     
-    try:
-        # Pobierz wszystkie kolekcje użytkowników
-        collections = db.collections()
-        total_reminders_sent = 0
-        
-        for collection in collections:
-            collection_name = collection.id
-            
-            # Pomiń kolekcje systemowe
-            if collection_name in ["temp_clients"]:
-                continue
-            
-            print(f"🔍 Sprawdzanie kolekcji: {collection_name}")
-            
-            # Sprawdź czy użytkownik ma włączone automatyczne przypomnienia
-            try:
-                settings_doc = db.collection(collection_name).document("Dane").get()
-                if not settings_doc.exists:
-                    print(f"⚠️ Brak ustawień dla użytkownika: {collection_name}")
-                    continue
-                
-                settings_data = settings_doc.to_dict()
-                
-                # Sprawdź czy autoSendEnabled jest włączone
-                auto_send_enabled = False
-                reminder_frequency = 7  # domyślnie 7 dni
-                
-                if "messaging" in settings_data:
-                    messaging = settings_data["messaging"]
-                    auto_send_enabled = messaging.get("autoSendEnabled", False)
-                    reminder_frequency = messaging.get("reminderFrequency", 7)
-                
-                if not auto_send_enabled:
-                    print(f"⏭️ Automatyczne przypomnienia wyłączone dla: {collection_name}")
-                    continue
-                
-                # Sprawdź czy to odpowiednia godzina dla wysyłki SMS
-                send_time = messaging.get("sendTime", {"hour": 10, "minute": 0}) if "messaging" in settings_data else {"hour": 10, "minute": 0}
-                current_time = datetime.now()
-                current_hour = current_time.hour
-                current_minute = current_time.minute
-                
-                target_hour = send_time.get("hour", 10)
-                target_minute = send_time.get("minute", 0)
-                
-                # Sprawdź czy jesteśmy w oknie 1 godziny od ustalonej godziny wysyłki
-                # (np. jeśli ustawiono 10:00, to wysyłaj między 10:00 a 10:59)
-                if current_hour != target_hour:
-                    print(f"⏰ Nie pora na wysyłkę dla {collection_name}. Aktualna: {current_hour:02d}:{current_minute:02d}, Ustawiona: {target_hour:02d}:{target_minute:02d}")
-                    continue
-                
-                print(f"✅ Automatyczne przypomnienia włączone (częstotliwość: {reminder_frequency} dni, godzina: {target_hour:02d}:{target_minute:02d})")
-                
-                # Pobierz konfigurację Twilio
-                twilio_config = get_twilio_client_for_user(collection_name)
-                if not twilio_config:
-                    print(f"⚠️ Brak konfiguracji Twilio dla użytkownika: {collection_name}")
-                    continue
-                
-                # Pobierz szablon wiadomości i nazwę firmy
-                message_template = """Dzień dobry!
+    review_status = client_data.get("review_status", "not_sent")
+    if review_status == "completed" or client_data.get("sms_count", 0) >= 2:
+        return None
+    
+    last_sms_sent = convert_firebase_timestamp_to_naive(client_data.get("last_sms_sent"))
+    if review_status == "not_sent":
+        if last_sms_sent:
+            return None
+        return convert_firebase_timestamp_to_naive(client_data.get("created_at")) or datetime.now()
+    if review_status in ["sent", "opened"] and last_sms_sent:
+        return last_sms_sent + timedelta(days=reminder_frequency)
+    return None
+
+def update_next_reminders(updates: list):
+    """Zapisz zbiorczo terminy next_reminder_at (pary: referencja klienta, termin)"""
+    batch = db.batch()
+    batch_size = 0
+    
+    count_firestore_ops(writes=len(updates))
+    for client_ref, next_reminder_at in updates:
+        batch.update(client_ref, {"next_reminder_at": next_reminder_at})
+        batch_size += 1
+        if batch_size >= 400:
+            batch.commit()
+            batch = db.batch()
+            batch_size = 0
+    
+    if batch_size:
+        batch.commit()
+
+def refresh_next_reminders(username: str) -> int:
+    """Przelicz next_reminder_at wszystkich klientów użytkownika (np. po zmianie częstotliwości)"""
+    reminder_frequency = get_reminder_frequency(username)
+    updates = [
+        (doc.reference, compute_next_reminder_at(doc.to_dict(), reminder_frequency))
+        for doc in db.collection(username).stream()
+        if doc.id not in ["Dane", "SMS"]
+    ]
+    update_next_reminders(updates)
+    return len(updates)
+
+# Rozkładanie przypomnień w czasie - zamiast wysyłać całą paczkę o pełnej godzinie, kolejne SMS-y
+# są rozłożone równomiernie (z losowym przesunięciem) w oknie REMINDER_SPREAD_MINUTES, a odstęp
+# między SMS-ami z jednego nadawcy (numer / Messaging Service) nie jest mniejszy niż 1 / REMINDER_SENDER_MPS
+REMINDER_SPREAD_MINUTES = float(os.getenv("REMINDER_SPREAD_MINUTES", "15"))
+REMINDER_SENDER_MPS = float(os.getenv("REMINDER_SENDER_MPS", "1"))
+REMINDER_PLAN_HISTORY = 50
+# Stała tolerancja terminu przypomnienia (w minutach) - domyślnie liczona z okna i limitu SMS/s
+REMINDER_DUE_TOLERANCE_MINUTES = os.getenv("REMINDER_DUE_TOLERANCE_MINUTES")
+
+def reminder_due_tolerance(sms_limit: int) -> timedelta:
+    """Jak długo po starcie przebiegu mogą wychodzić jego SMS-y
+    
+    Okno REMINDER_SPREAD_MINUTES plus czas wysłania sms_limit wiadomości przy REMINDER_SENDER_MPS -
+    przebieg nie wyśle więcej SMS-ów niż miesięczny limit użytkownika.
+    """
+    if REMINDER_DUE_TOLERANCE_MINUTES:
+        return timedelta(minutes=float(REMINDER_DUE_TOLERANCE_MINUTES))
+    drain_seconds = sms_limit / REMINDER_SENDER_MPS if REMINDER_SENDER_MPS > 0 else 0.0
+    return timedelta(seconds=REMINDER_SPREAD_MINUTES * 60 + drain_seconds)
+
+def reminder_due_cutoff(run_at: datetime, tolerance: timedelta) -> datetime:
+    """Granica terminów next_reminder_at należnych w przebiegu przypomnień zaplanowanym na run_at
+    
+    SMS-y przebiegu wychodzą do `tolerance` po jego starcie, więc kolejny termin klienta (ostatni
+    SMS + częstotliwość) wypada tyle samo po godzinie przebiegu. Bez tolerancji przypomnienie
+    przesuwałoby się o dodatkowy dzień.
+    """
+    return run_at + tolerance
+
+class ReminderSpreader:
+    """Planowanie terminów wysyłki przypomnień z zachowaniem limitu SMS/s na nadawcę"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sender_next_free = {}
+        self.plans = deque(maxlen=REMINDER_PLAN_HISTORY)
+    
+    def plan(self, username: str, sender: str, count: int) -> list:
+        """Terminy wysyłki (epoch) dla count SMS-ów użytkownika - po jednym w każdym odcinku okna"""
+        now = time.time()
+        slot = REMINDER_SPREAD_MINUTES * 60 / count if count else 0.0
+        interval = 1.0 / REMINDER_SENDER_MPS if REMINDER_SENDER_MPS > 0 else 0.0
+        send_times = []
+        with self.lock:
+            # Zapomnij nadawców, których plan już się zakończył
+            for stale_sender in [key for key, free_at in self.sender_next_free.items() if free_at < now]:
+                del self.sender_next_free[stale_sender]
+            next_free = self.sender_next_free.get(sender, now)
+            for index in range(count):
+                send_at = max(now + index * slot + random.uniform(0, slot), next_free)
+                send_times.append(send_at)
+                next_free = send_at + interval
+            if count:
+                self.sender_next_free[sender] = next_free
+                self.plans.append({
+                    "username": username,
+                    "sender": sender,
+                    "messages": count,
+                    "planned_at": datetime.fromtimestamp(now).isoformat(),
+                    "first_send_at": datetime.fromtimestamp(send_times[0]).isoformat(),
+                    "last_send_at": datetime.fromtimestamp(send_times[-1]).isoformat()
+                })
+        return send_times
+    
+    def recent_plans(self) -> list:
+        """Ostatnie plany wysyłki (najnowsze pierwsze)"""
+        with self.lock:
+            return list(reversed(self.plans))
+
+reminder_spreader = ReminderSpreader()
+
+# Telemetria przebiegów przypomnień - ostatnie REMINDER_TELEMETRY_RUNS przebiegów w buforze
+# cyklicznym (czas całkowity i per użytkownik, odczyty/zapisy Firestore, SMS-y, najwolniejsi użytkownicy)
+REMINDER_TELEMETRY_RUNS = int(os.getenv("REMINDER_TELEMETRY_RUNS", "20"))
+REMINDER_TELEMETRY_SLOWEST = 5
+
+class ReminderTelemetry:
+    """Statystyki przebiegów check_and_send_reminders i partii schedulera
+    
+    Wysłane/nieudane SMS-y są doliczane do przebiegu przez workery kolejki (reminder_run_id w payloadzie),
+    o ile przebieg jest jeszcze w buforze tego procesu.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = deque(maxlen=REMINDER_TELEMETRY_RUNS)
+        self.runs_by_id = {}
+    
+    def start_run(self, trigger: str) -> dict:
+        """Rozpocznij przebieg i dodaj go do bufora"""
+        run = {
+            "id": secrets.token_hex(6),
+            "trigger": trigger,
+            "status": "running",
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "duration_seconds": None,
+            "tenants": 0,
+            "firestore_reads": 0,
+            "firestore_writes": 0,
+            "sms_queued": 0,
+            "sms_sent": 0,
+            "sms_failed": 0,
+            "tenant_p50_seconds": None,
+            "tenant_p95_seconds": None,
+            "slowest_tenants": [],
+            "_started": time.perf_counter(),
+            "_tenant_stats": []
+        }
+        with self.lock:
+            if len(self.runs) == self.runs.maxlen:
+                self.runs_by_id.pop(self.runs[0]["id"], None)
+            self.runs.append(run)
+            self.runs_by_id[run["id"]] = run
+        return run
+    
+    @asynccontextmanager
+    async def track_tenant(self, run: dict, username: str):
+        """Zmierz przetwarzanie użytkownika; operacje Firestore są liczone w zmiennej kontekstowej"""
+        stats = {
+            "username": username,
+            "run_id": run["id"],
+            "firestore_reads": 0,
+            "firestore_writes": 0,
+            "sms_queued": 0
+        }
+        token = _reminder_tenant_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats["duration_seconds"] = round(time.perf_counter() - started, 3)
+            _reminder_tenant_stats.reset(token)
+            with self.lock:
+                run["_tenant_stats"].append(stats)
+                run["tenants"] += 1
+                run["firestore_reads"] += stats["firestore_reads"]
+                run["firestore_writes"] += stats["firestore_writes"]
+                run["sms_queued"] += stats["sms_queued"]
+    
+    def finish_run(self, run: dict):
+        """Zakończ przebieg: czas całkowity, percentyle czasu użytkowników i najwolniejsi użytkownicy"""
+        with self.lock:
+            tenant_stats = sorted(run["_tenant_stats"], key=lambda stats: stats["duration_seconds"], reverse=True)
+            durations = [stats["duration_seconds"] for stats in reversed(tenant_stats)]
+            run.update({
+                "status": "finished",
+                "finished_at": datetime.now().isoformat(),
+                "duration_seconds": round(time.perf_counter() - run["_started"], 3),
+                "tenant_p50_seconds": durations[len(durations) // 2] if durations else None,
+                "tenant_p95_seconds": durations[int(len(durations) * 0.95)] if durations else None,
+                "slowest_tenants": [
+                    {key: value for key, value in stats.items() if key != "run_id"}
+                    for stats in tenant_stats[:REMINDER_TELEMETRY_SLOWEST]
+                ],
+                "_tenant_stats": []
+            })
+        if run["duration_seconds"] > 3600:
+            print(f"⚠️ Przebieg przypomnień {run['id']} trwał {run['duration_seconds']:.0f}s (ponad godzinę)")
+    
+    def record_sms_result(self, run_id: str, sent: bool):
+        """Dolicz wynik wysyłki SMS do przebiegu, który go zakolejkował"""
+        with self.lock:
+            run = self.runs_by_id.get(run_id)
+            if run is not None:
+                run["sms_sent" if sent else "sms_failed"] += 1
+    
+    def recent(self) -> list:
+        """Ostatnie przebiegi (najnowsze pierwsze)"""
+        with self.lock:
+            return [
+                {key: value for key, value in run.items() if not key.startswith("_")}
+                for run in reversed(self.runs)
+            ]
+
+reminder_telemetry = ReminderTelemetry()
+
+# Domyślny szablon przypomnienia (gdy użytkownik nie ustawił własnego)
+DEFAULT_REMINDER_TEMPLATE = """Dzień dobry!
 
 Chciałbym przypomnieć o możliwości wystawienia opinii o naszych usługach. 
 Wasza opinia jest dla nas bardzo ważna i pomoże innym klientom w podjęciu decyzji.
@@ -1008,163 +2723,961 @@ Z góry dziękuję za poświęcony czas!
 
 Z poważaniem,
 [NAZWA_FIRMY]"""
-                company_name = "Twoja Firma"
-                
-                if "messaging" in settings_data and "messageTemplate" in settings_data["messaging"]:
-                    message_template = settings_data["messaging"]["messageTemplate"]
-                if "userData" in settings_data and "companyName" in settings_data["userData"]:
-                    company_name = settings_data["userData"]["companyName"]
+
+async def send_tenant_reminders(username: str, run_at: Optional[datetime] = None) -> int:
+    """Dodaj do kolejki należne przypomnienia SMS klientów jednego użytkownika; zwraca ich liczbę
+    
+    run_at - termin przebiegu ze schedulera (granica należności liczona od niego, nie od chwili startu).
+    """
+    reminders_queued = 0
+    # Nieaktualne terminy w indeksie przypomnień - zapisywane jednym batchem po przejrzeniu klientów
+    stale_reminders = []
+    # Przypomnienia do wysłania - kolejkowane po przejrzeniu klientów, rozłożone w czasie
+    planned_reminders = []
+    collection = db.collection(username)
+    
+    print(f"🔍 Sprawdzanie kolekcji: {username}")
+    
+    # Pomiń użytkownika, którego przypomnienia są właśnie sprawdzane (np. ręczne uruchomienie w trakcie schedulera)
+    if not tenant_scheduler_bulkhead.try_acquire(username):
+        print(f"⏭️ Przypomnienia dla {username} są już sprawdzane")
+        return reminders_queued
+    
+    # Sprawdź czy użytkownik ma włączone automatyczne przypomnienia
+    try:
+        settings_data = await run_in_threadpool(get_tenant_settings, username)
+        if settings_data is None:
+            print(f"⚠️ Brak ustawień dla użytkownika: {username}")
+            return reminders_queued
+        
+        # Sprawdź czy autoSendEnabled jest włączone
+        auto_send_enabled = False
+        reminder_frequency = 7  # domyślnie 7 dni
+        
+        if "messaging" in settings_data:
+            messaging = settings_data["messaging"]
+            auto_send_enabled = messaging.get("autoSendEnabled", False)
+            reminder_frequency = messaging.get("reminderFrequency", 7)
+        
+        if not auto_send_enabled:
+            print(f"⏭️ Automatyczne przypomnienia wyłączone dla: {username}")
+            return reminders_queued
+        
+        send_time = messaging.get("sendTime") or {"hour": 10, "minute": 0}
+        target_hour = send_time.get("hour", 10)
+        target_minute = send_time.get("minute", 0)
+        
+        print(f"✅ Automatyczne przypomnienia włączone (częstotliwość: {reminder_frequency} dni, godzina: {target_hour:02d}:{target_minute:02d})")
+        
+        # Pobierz konfigurację Twilio
+        twilio_config = await run_in_threadpool(get_twilio_client_for_user, username)
+        if not twilio_config:
+            print(f"⚠️ Brak konfiguracji Twilio dla użytkownika: {username}")
+            return reminders_queued
+        
+        # Pobierz szablon wiadomości i nazwę firmy
+        message_template = DEFAULT_REMINDER_TEMPLATE
+        company_name = "Twoja Firma"
+        
+        if "messaging" in settings_data and "messageTemplate" in settings_data["messaging"]:
+            message_template = settings_data["messaging"]["messageTemplate"]
+        if "userData" in settings_data and "companyName" in settings_data["userData"]:
+            company_name = settings_data["userData"]["companyName"]
+        
+        # Pobierz tylko klientów, którym należy się przypomnienie (indeks next_reminder_at).
+        # Przebieg spóźniony (np. nadrabiany po restarcie) nie dokłada tolerancji do opóźnienia
+        sms_limit = await run_in_threadpool(get_user_sms_limit, username) or 0
+        now = datetime.now()
+        due_cutoff = max(now, reminder_due_cutoff(run_at or now, reminder_due_tolerance(sms_limit)))
+        due_query = collection.where("next_reminder_at", "<=", due_cutoff)
+        docs = await run_in_threadpool(lambda: list(due_query.stream()))
+        count_firestore_ops(reads=len(docs))
+        print(f"📋 Klienci z należnym przypomnieniem: {len(docs)}")
+        
+        for doc in docs:
+            client_data = doc.to_dict()
+            client_id = doc.id
+            
+            # Sprawdź czy klient spełnia warunki do wysłania przypomnienia
+            review_status = client_data.get("review_status", "not_sent")
+            phone = client_data.get("phone", "")
+            review_code = client_data.get("review_code", "")
+            client_name = client_data.get("name", "")
+            sms_count = client_data.get("sms_count", 0)
+            
+            # Pomiń klientów bez numeru telefonu lub kodu recenzji, z ukończoną recenzją
+            # lub z osiągniętym limitem SMS - i usuń ich z indeksu przypomnień
+            if not phone or not review_code or review_status == "completed" or sms_count >= 2:
+                stale_reminders.append((doc.reference, None))
+                continue
+            
+            # Sprawdź czy minął odpowiedni czas od ostatniego SMS
+            last_sms_sent = client_data.get("last_sms_sent")
+            created_at = client_data.get("created_at")
+            
+            should_send = False
+            
+            # Konwertuj Firebase Timestamp na datetime jeśli potrzeba
+            last_sms_sent = convert_firebase_timestamp_to_naive(last_sms_sent)
+            created_at = convert_firebase_timestamp_to_naive(created_at)
+            
+            print(f"🔍 Sprawdzanie klienta: {client_name}")
+            print(f"   - Status: {review_status}")
+            print(f"   - Ostatni SMS: {last_sms_sent}")
+            print(f"   - Częstotliwość: {reminder_frequency} dni")
+            
+            if review_status == "not_sent":
+                # Jeśli nigdy nie wysłano SMS, wyślij pierwszy raz
+                if not last_sms_sent:
+                    should_send = True
+                    print(f"📤 Pierwszy SMS dla: {client_name}")
+            elif review_status in ["sent", "opened"]:
+                # Jeśli SMS był wysłany lub link był otwarty, sprawdź czy minął czas na przypomnienie
+                if last_sms_sent:
+                    # Termin przypomnienia porównujemy z granicą przebiegu - poprzedni SMS mógł wyjść
+                    # kilka minut po godzinie wysyłki, a klient nie powinien czekać przez to dodatkowy dzień
+                    reminder_at = last_sms_sent + timedelta(days=reminder_frequency)
+                    print(f"   - Termin przypomnienia: {reminder_at}")
+                    
+                    if reminder_at <= due_cutoff:
+                        should_send = True
+                        print(f"🔔 Przypomnienie dla: {client_name} (ostatni SMS: {last_sms_sent.strftime('%Y-%m-%d %H:%M')})")
+            
+            if not should_send:
+                # Termin w indeksie jest nieaktualny - przelicz go, żeby klient nie był pobierany co godzinę
+                stale_reminders.append((doc.reference, compute_next_reminder_at(client_data, reminder_frequency)))
+                continue
+            
+            if should_send:
+                # Przygotuj URL do recenzji
+                base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
+                review_url = f"{base_url}/review/{review_code}"
                 
-                # Pobierz wszystkich klientów tej kolekcji (pomijamy dokument "Dane")
-                docs = collection.stream()
+                # Przygotuj wiadomość
+                message = message_template.replace("[LINK]", review_url).replace("[NAZWA_FIRMY]", company_name)
+                planned_reminders.append({
+                    "idempotency_key": client_sms_idempotency_key(username, client_id, sms_count),
+                    "phone": phone,
+                    "message": message,
+                    "payload": {
+                        "client_id": client_id,
+                        "name": client_name,
+                        "review_status": review_status,
+                        "sms_count": sms_count
+                    }
+                })
+        
+        # Rozłóż wysyłkę w oknie REMINDER_SPREAD_MINUTES z limitem SMS/s nadawcy
+        sender = twilio_config.get("messaging_service_sid") or twilio_config.get("phone_number") or username
+        send_times = reminder_spreader.plan(username, sender, len(planned_reminders))
+        run_stats = _reminder_tenant_stats.get()
+        
+        for reminder, send_at in zip(planned_reminders, send_times):
+            client_name = reminder["payload"]["name"]
+            try:
+                # Dodaj SMS do kolejki - worker wyśle go o zaplanowanej porze i zaktualizuje status klienta
+                print(f"📥 Kolejkowanie przypomnienia SMS do: {client_name} ({reminder['phone']}) na {datetime.fromtimestamp(send_at).strftime('%H:%M:%S')}")
+                queued = await run_in_threadpool(
+                    enqueue_sms,
+                    reminder["idempotency_key"],
+                    username,
+                    reminder["phone"],
+                    reminder["message"],
+                    {**reminder["payload"], "reminder_run_id": run_stats["run_id"]} if run_stats else reminder["payload"],
+                    "scheduled",
+                    send_at
+                )
                 
-                for doc in docs:
-                    # Pomiń dokument "Dane"
-                    if doc.id == "Dane":
-                        continue
-                    
-                    client_data = doc.to_dict()
-                    client_id = doc.id
-                    
-                    # Sprawdź czy klient spełnia warunki do wysłania przypomnienia
-                    review_status = client_data.get("review_status", "not_sent")
-                    phone = client_data.get("phone", "")
-                    review_code = client_data.get("review_code", "")
-                    client_name = client_data.get("name", "")
-                    sms_count = client_data.get("sms_count", 0)
-                    
-                    # Pomiń klientów bez numeru telefonu lub kodu recenzji
-                    if not phone or not review_code:
-                        continue
-                    
-                    # Pomiń klientów którzy już ukończyli recenzję
-                    if review_status == "completed":
-                        continue
-                    
-                    # Pomiń klientów którzy osiągnęli limit SMS
-                    if sms_count >= 2:
-                        continue
-                    
-                    # Sprawdź czy minął odpowiedni czas od ostatniego SMS
-                    last_sms_sent = client_data.get("last_sms_sent")
-                    created_at = client_data.get("created_at")
-                    
-                    now = datetime.now()
-                    should_send = False
-                    
-                    # Konwertuj Firebase Timestamp na datetime jeśli potrzeba
-                    last_sms_sent = convert_firebase_timestamp_to_naive(last_sms_sent)
-                    created_at = convert_firebase_timestamp_to_naive(created_at)
-                    
-                    print(f"🔍 Sprawdzanie klienta: {client_name}")
-                    print(f"   - Status: {review_status}")
-                    print(f"   - Ostatni SMS: {last_sms_sent}")
-                    print(f"   - Częstotliwość: {reminder_frequency} dni")
-                    
-                    if review_status == "not_sent":
-                        # Jeśli nigdy nie wysłano SMS, wyślij pierwszy raz
-                        if not last_sms_sent:
-                            should_send = True
-                            print(f"📤 Pierwszy SMS dla: {client_name}")
-                    elif review_status in ["sent", "opened"]:
-                        # Jeśli SMS był wysłany lub link był otwarty, sprawdź czy minął czas na przypomnienie
-                        if last_sms_sent:
-                            # Użyj total_seconds() zamiast days dla dokładniejszego porównania
-                            time_diff = now - last_sms_sent
-                            hours_since_last_sms = time_diff.total_seconds() / 3600
-                            days_since_last_sms = time_diff.days
-                            
-                            print(f"   - Godziny od ostatniego SMS: {hours_since_last_sms:.2f}")
-                            print(f"   - Dni od ostatniego SMS: {days_since_last_sms}")
-                            
-                            # Dla częstotliwości 1 dzień - sprawdź czy minęło co najmniej 24 godziny
-                            if reminder_frequency == 1:
-                                if hours_since_last_sms >= 24:
-                                    should_send = True
-                                    print(f"🔔 Przypomnienie dla: {client_name} (ostatni SMS: {hours_since_last_sms:.1f} godzin temu)")
-                            else:
-                                # Dla innych częstotliwości używaj dni
-                                if days_since_last_sms >= reminder_frequency:
-                                    should_send = True
-                                    print(f"🔔 Przypomnienie dla: {client_name} (ostatni SMS: {days_since_last_sms} dni temu)")
-                    
-                    if should_send:
-                        try:
-                            # Przygotuj URL do recenzji
-                            base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
-                            review_url = f"{base_url}/review/{review_code}"
-                            
-                            # Przygotuj wiadomość
-                            message = message_template.replace("[LINK]", review_url).replace("[NAZWA_FIRMY]", company_name)
-                            
-                            # Wyślij SMS
-                            print(f"📱 Wysyłanie przypomnienia SMS do: {client_name} ({phone})")
-                            result = await send_sms(phone, message, twilio_config, collection_name)
-                            
-                            # Zaktualizuj status klienta
-                            doc_ref = db.collection(collection_name).document(client_id)
-                            update_data = {
-                                "last_sms_sent": now,
-                                "updated_at": now,
-                                "sms_count": sms_count + 1
-                            }
-                            
-                            # Jeśli to pierwszy SMS, zmień status na "sent"
-                            if review_status == "not_sent":
-                                update_data["review_status"] = "sent"
-                            
-                            doc_ref.update(update_data)
-                            
-                            total_reminders_sent += 1
-                            print(f"✅ Przypomnienie wysłane do: {client_name}")
-                            
-                        except Exception as sms_error:
-                            print(f"❌ Błąd wysyłania SMS do {client_name}: {str(sms_error)}")
-                            continue
+                if queued["created"]:
+                    reminders_queued += 1
+                    if run_stats:
+                        run_stats["sms_queued"] += 1
+                    print(f"✅ Przypomnienie dodane do kolejki: {client_name}")
                 
-            except Exception as user_error:
-                print(f"❌ Błąd przetwarzania użytkownika {collection_name}: {str(user_error)}")
+            except Exception as sms_error:
+                print(f"❌ Błąd kolejkowania SMS do {client_name}: {str(sms_error)}")
                 continue
         
-        print(f"✅ Sprawdzanie zakończone. Wysłano {total_reminders_sent} przypomnień")
-        return {"reminders_sent": total_reminders_sent}
+        if stale_reminders:
+            await run_in_threadpool(update_next_reminders, stale_reminders)
         
-    except Exception as e:
-        print(f"❌ Błąd podczas sprawdzania przypomnień: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {"error": str(e)}
+    except Exception as user_error:
+        print(f"❌ Błąd przetwarzania użytkownika {username}: {str(user_error)}")
+        return reminders_queued
+    finally:
+        tenant_scheduler_bulkhead.release(username)
+    
+    return reminders_queued
 
-# Inicjalizacja schedulera
-scheduler = BackgroundScheduler()
+# Podział użytkowników na shardy (crc32 z nazwy użytkownika) - każdy proces obsługuje
+# przypomnienia tylko dla swoich shardów, więc wysyłka skaluje się z liczbą procesów
+REMINDER_SHARDS = max(1, int(os.getenv("REMINDER_SHARDS", "1")))
 
-def run_async_check_and_send_reminders():
-    """Wrapper do uruchamiania async funkcji w scheduler"""
+def reminder_shard(username: str) -> int:
+    """Numer sharda użytkownika (stabilny między procesami i restartami)"""
+    return zlib.crc32(username.encode("utf-8")) % REMINDER_SHARDS
+
+async def check_and_send_reminders(shards: Optional[set] = None):
+    """Sprawdź wszystkich klientów i wyślij przypomnienia SMS jeśli potrzebne
+    
+    Args:
+        shards: Przetwarzaj tylko użytkowników z tych shardów (None = wszyscy)
+    """
+    print("🔄 Rozpoczęcie sprawdzania przypomnień SMS...")
+    
+    if not db:
+        print("❌ Firebase nie jest skonfigurowany")
+        return
+    
+    run = reminder_telemetry.start_run("manual")
     try:
-        print(f"🕐 [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Uruchamianie schedulera przypomnień SMS...")
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(check_and_send_reminders())
-        loop.close()
-        print(f"✅ [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Scheduler zakończony: {result}")
+        # Pobierz z rejestru tylko użytkowników z włączoną wysyłką o bieżącej godzinie
+        tenants_query = (
+            db.collection(TENANTS_COLLECTION)
+            .where("autoSendEnabled", "==", True)
+            .where("sendHour", "==", datetime.now().hour)
+        )
+        tenants = await run_in_threadpool(lambda: list(tenants_query.stream()))
+        run["firestore_reads"] += len(tenants)
+        if shards is not None:
+            tenants = [tenant_doc for tenant_doc in tenants if reminder_shard(tenant_doc.id) in shards]
+        
+        # Użytkownicy przetwarzani równolegle (maks. REMINDER_TENANT_CONCURRENCY naraz)
+        semaphore = asyncio.Semaphore(REMINDER_TENANT_CONCURRENCY)
+        
+        async def run_tenant(username: str) -> int:
+            async with semaphore:
+                async with reminder_telemetry.track_tenant(run, username):
+                    return await send_tenant_reminders(username)
+        
+        results = await asyncio.gather(*[run_tenant(tenant_doc.id) for tenant_doc in tenants])
+        total_reminders_queued = sum(results)
+        
+        print(f"✅ Sprawdzanie zakończone. Dodano do kolejki {total_reminders_queued} przypomnień")
+        return {"reminders_queued": total_reminders_queued}
+        
     except Exception as e:
-        print(f"❌ [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Błąd w schedulerze: {str(e)}")
+        print(f"❌ Błąd podczas sprawdzania przypomnień: {str(e)}")
         import traceback
         traceback.print_exc()
+        return {"error": str(e)}
+    finally:
+        reminder_telemetry.finish_run(run)
+
+# Planer przypomnień (dry-run) - przewiduje, kto i kiedy dostanie przypomnienie w najbliższych
+# godzinach, bez wysyłania SMS. Wynik jest cache'owany na REMINDER_PLAN_CACHE_SECONDS.
+REMINDER_PLAN_CACHE_SECONDS = float(os.getenv("REMINDER_PLAN_CACHE_SECONDS", "300"))
+REMINDER_PLAN_MAX_HOURS = 168
+_reminder_plan_cache = {}
+_reminder_plan_cache_lock = threading.Lock()
+
+def plan_tenant_reminders(username: str, now: datetime, horizon: datetime) -> Optional[dict]:
+    """Plan wysyłek jednego użytkownika do horizon (None - brak automatycznej wysyłki w tym okresie)
+    
+    Klienci są pobierani jednym zapytaniem po next_reminder_at; kolejne przypomnienia tego samego
+    klienta w horyzoncie są symulowane przez compute_next_reminder_at z tą samą regułą należności
+    (reminder_due_cutoff) i najpóźniejszą porą wysyłki w przebiegu (reminder_due_tolerance).
+    """
+    settings_data = get_tenant_settings(username)
+    if settings_data is None:
+        return None
+    messaging = settings_data.get("messaging", {}) or {}
+    if not messaging.get("autoSendEnabled", False):
+        return None
+    
+    reminder_frequency = messaging.get("reminderFrequency", 7)
+    send_time = messaging.get("sendTime") or {"hour": 10, "minute": 0}
+    run_at = next_send_instant(send_time.get("hour", 10), send_time.get("minute", 0), now)
+    runs = []
+    while run_at <= horizon:
+        runs.append(run_at)
+        run_at += timedelta(days=1)
+    if not runs:
+        return None
+    
+    twilio_config = settings_data.get("twilio", {}) or {}
+    sender = twilio_config.get("messaging_service_sid") or twilio_config.get("phone_number") or username
+    planned_runs = {run: [] for run in runs}
+    limit_info = check_sms_limit(username)
+    tolerance = reminder_due_tolerance(limit_info.get("limit", 0))
+    
+    due_query = db.collection(username).where("next_reminder_at", "<=", reminder_due_cutoff(runs[-1], tolerance))
+    for doc in due_query.stream():
+        client_data = doc.to_dict()
+        next_reminder_at = convert_firebase_timestamp_to_naive(client_data.get("next_reminder_at"))
+        for run in runs:
+            if next_reminder_at is None:
+                break
+            if next_reminder_at > reminder_due_cutoff(run, tolerance):
+                continue
+            review_status = client_data.get("review_status", "not_sent")
+            planned_runs[run].append({
+                "client_id": doc.id,
+                "name": client_data.get("name", ""),
+                "phone": client_data.get("phone", ""),
+                "kind": "first" if review_status == "not_sent" else "reminder"
+            })
+            # Stan klienta po tej wysyłce - jak w record_sent_sms_batch (SMS wysłany najpóźniej w przebiegu)
+            client_data = {
+                **client_data,
+                "review_status": "sent" if review_status == "not_sent" else review_status,
+                "sms_count": client_data.get("sms_count", 0) + 1,
+                "last_sms_sent": run + tolerance
+            }
+            next_reminder_at = compute_next_reminder_at(client_data, reminder_frequency)
+    
+    total = sum(len(clients) for clients in planned_runs.values())
+    remaining = limit_info.get("remaining", 0)
+    spread_seconds = REMINDER_SPREAD_MINUTES * 60
+    
+    return {
+        "username": username,
+        "sender": sender,
+        "template": "custom" if "messageTemplate" in messaging else "default",
+        "message_template": messaging.get("messageTemplate", DEFAULT_REMINDER_TEMPLATE),
+        "reminder_frequency": reminder_frequency,
+        "messages": total,
+        "quota_remaining": remaining,
+        "over_quota": max(0, total - remaining),
+        "runs": [
+            {
+                "at": run.isoformat(),
+                # Wysyłka rozłożona w oknie, wydłużonym jeśli limit SMS/s nadawcy na to nie pozwala
+                "estimated_end": (run + timedelta(seconds=max(
+                    spread_seconds,
+                    len(clients) / REMINDER_SENDER_MPS if REMINDER_SENDER_MPS > 0 else 0
+                ))).isoformat(),
+                "messages": len(clients),
+                "clients": clients
+            }
+            for run, clients in planned_runs.items() if clients
+        ]
+    }
 
-# Dodaj zadanie do schedulera - sprawdzaj co godzinę
-scheduler.add_job(
-    run_async_check_and_send_reminders,
-    'interval',
-    hours=1,
-    id='check_reminders',
-    name='Sprawdzanie i wysyłanie przypomnień SMS',
-    replace_existing=True
-)
+def build_reminder_plan(hours: int, username: Optional[str] = None) -> dict:
+    """Plan wysyłek przypomnień wszystkich użytkowników (lub jednego) na najbliższe `hours` godzin"""
+    now = datetime.now()
+    horizon = now + timedelta(hours=hours)
+    if username:
+        usernames = [username]
+    else:
+        tenants_query = db.collection(TENANTS_COLLECTION).where("autoSendEnabled", "==", True)
+        usernames = [tenant_doc.id for tenant_doc in tenants_query.stream()]
+    
+    tenants = []
+    by_hour = {}
+    for tenant_username in usernames:
+        try:
+            tenant_plan = plan_tenant_reminders(tenant_username, now, horizon)
+        except Exception as e:
+            print(f"❌ Błąd planowania przypomnień dla {tenant_username}: {str(e)}")
+            continue
+        if not tenant_plan or not tenant_plan["messages"]:
+            continue
+        tenants.append(tenant_plan)
+        for run in tenant_plan["runs"]:
+            hour = datetime.fromisoformat(run["at"]).replace(minute=0, second=0, microsecond=0).isoformat()
+            by_hour[hour] = by_hour.get(hour, 0) + run["messages"]
+    
+    tenants.sort(key=lambda tenant_plan: tenant_plan["messages"], reverse=True)
+    return {
+        "generated_at": now.isoformat(),
+        "hours": hours,
+        "horizon": horizon.isoformat(),
+        "total_messages": sum(tenant_plan["messages"] for tenant_plan in tenants),
+        "over_quota": sum(tenant_plan["over_quota"] for tenant_plan in tenants),
+        "by_hour": [{"hour": hour, "messages": count} for hour, count in sorted(by_hour.items())],
+        "tenants": tenants
+    }
+
+def get_reminder_plan(hours: int, username: Optional[str] = None, refresh: bool = False) -> dict:
+    """Plan wysyłek z cache (przeliczany po REMINDER_PLAN_CACHE_SECONDS lub na żądanie)"""
+    key = (hours, username)
+    now = time.monotonic()
+    with _reminder_plan_cache_lock:
+        entry = _reminder_plan_cache.get(key)
+        if entry and entry[0] > now and not refresh:
+            return {**entry[1], "cached": True}
+    
+    plan = build_reminder_plan(hours, username)
+    with _reminder_plan_cache_lock:
+        # Usuń wygasłe plany, żeby cache nie rósł z kolejnymi kombinacjami parametrów
+        for stale_key in [cache_key for cache_key, (expires, _) in _reminder_plan_cache.items() if expires <= now]:
+            del _reminder_plan_cache[stale_key]
+        _reminder_plan_cache[key] = (now + REMINDER_PLAN_CACHE_SECONDS, plan)
+    return {**plan, "cached": False}
+
+# Harmonogram przypomnień - kopiec (heap) najbliższych terminów wysyłki każdego użytkownika.
+# Zadanie schedulera działa na pętli zdarzeń aplikacji i budzi się dokładnie na najbliższy termin,
+# więc godziny bez wysyłek nie kosztują odczytów.
+REMINDER_SCHEDULE_RESYNC_SECONDS = int(os.getenv("REMINDER_SCHEDULE_RESYNC_SECONDS", "21600"))
+# Co tyle sekund pobierane są wpisy rejestru tenants zmienione od ostatniej synchronizacji
+REMINDER_SCHEDULE_POLL_SECONDS = int(os.getenv("REMINDER_SCHEDULE_POLL_SECONDS", "60"))
+REMINDER_STARTUP_GRACE_MINUTES = int(os.getenv("REMINDER_STARTUP_GRACE_MINUTES", "60"))
+REMINDER_TENANT_CONCURRENCY = int(os.getenv("REMINDER_TENANT_CONCURRENCY", "8"))
+
+def next_send_instant(send_hour: int, send_minute: int, after: datetime) -> datetime:
+    """Najbliższy termin wysyłki o godzinie send_hour:send_minute późniejszy niż after"""
+    candidate = after.replace(hour=send_hour, minute=send_minute, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    return candidate
+
+def reminder_slot_key(when: datetime) -> str:
+    """Identyfikator terminu przebiegu przypomnień (z dokładnością do minuty, porządek jak dat)"""
+    return when.strftime("%Y-%m-%dT%H:%M")
+
+@firestore.transactional
+def _claim_reminder_slot_in_transaction(transaction, tenant_ref, when: datetime) -> tuple:
+    """Sprawdź termin z kopca z rejestrem tenants i zajmij go; zwraca (wynik, wpis rejestru)
+    
+    Wynik: "claimed" - termin zajęty przez ten proces, "claimed_before" - przebieg tego (lub
+    późniejszego) terminu już się odbył, "changed" - wysyłka wyłączona lub godzina zmieniona.
+    """
+    tenant_doc = tenant_ref.get(transaction=transaction)
+    tenant = tenant_doc.to_dict() if tenant_doc.exists else {}
+    send_time = (tenant.get("sendHour", 10), tenant.get("sendMinute", 0))
+    if not tenant.get("autoSendEnabled", False) or send_time != (when.hour, when.minute):
+        return "changed", tenant
+    slot = reminder_slot_key(when)
+    if tenant.get("lastReminderSlot", "") >= slot:
+        return "claimed_before", tenant
+    transaction.set(tenant_ref, {"lastReminderSlot": slot}, merge=True)
+    return "claimed", tenant
+
+class ReminderScheduler:
+    """Scheduler przypomnień SMS z dokładnością do minuty
+    
+    Wpisy w kopcu to (termin, wersja, username). Zmiana ustawień użytkownika podbija wersję,
+    a nieaktualne wpisy są pomijane przy zdejmowaniu z kopca. Kopiec jest budowany z rejestru
+    tenants przy starcie, co REMINDER_SCHEDULE_POLL_SECONDS uzupełniany o wpisy zmienione przez
+    inne procesy (updated_at), a przed wysyłką termin jest sprawdzany z rejestrem.
+    Użytkownicy z tym samym terminem są obsługiwani równolegle (maks. REMINDER_TENANT_CONCURRENCY).
+    """
+    
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.send_times = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.loop = None
+        self.wakeup = None
+        self.semaphore = None
+        self.task = None
+        self.tenant_tasks = set()
+        self.running = False
+        self.last_resync = None
+        self.resynced_once = False
+        self.last_poll = None
+        self.synced_until = None
+        self.last_runs = {}
+        self.shards = set()
+    
+    def _notify(self):
+        """Obudź zadanie schedulera (można wywołać z dowolnego wątku)"""
+        loop, wakeup = self.loop, self.wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+    
+    def _push(self, username: str, when: datetime):
+        self.version += 1
+        self.entries[username] = (when, self.version)
+        heapq.heappush(self.heap, (when, self.version, username))
+    
+    def _apply(self, username: str, auto_send_enabled: bool, send_hour: int, send_minute: int, after: datetime):
+        """Dodaj, przesuń lub usuń termin użytkownika (wywoływać z założoną blokadą)"""
+        if not auto_send_enabled:
+            self.entries.pop(username, None)
+            self.send_times.pop(username, None)
+            return
+        if self.send_times.get(username) == (send_hour, send_minute) and username in self.entries:
+            return
+        self.send_times[username] = (send_hour, send_minute)
+        self._push(username, next_send_instant(send_hour, send_minute, after))
+    
+    def update_from_settings(self, username: str, settings_data: dict):
+        """Zaktualizuj termin użytkownika po zmianie ustawień (sendTime, autoSendEnabled)"""
+        messaging = settings_data.get("messaging", {}) or {}
+        send_time = messaging.get("sendTime") or {"hour": 10, "minute": 0}
+        with self.lock:
+            self._apply(
+                username,
+                messaging.get("autoSendEnabled", False),
+                send_time.get("hour", 10),
+                send_time.get("minute", 0),
+                datetime.now()
+            )
+        self._notify()
+    
+    def resync(self):
+        """Zbuduj terminy z rejestru tenants (przy pierwszym uruchomieniu z tolerancją na restart)"""
+        started_at = datetime.now()
+        tenants_query = db.collection(TENANTS_COLLECTION).where("autoSendEnabled", "==", True)
+        tenants = {doc.id: doc.to_dict() for doc in tenants_query.stream()}
+        now = datetime.now()
+        with self.lock:
+            # Po restarcie procesu uruchom wysyłki, których termin minął przed chwilą
+            after = now if self.resynced_once else now - timedelta(minutes=REMINDER_STARTUP_GRACE_MINUTES)
+            for username in list(self.entries):
+                if username not in tenants:
+                    self.entries.pop(username, None)
+                    self.send_times.pop(username, None)
+            for username, tenant in tenants.items():
+                self._apply(username, True, tenant.get("sendHour", 10), tenant.get("sendMinute", 0), after)
+            self.last_resync = time.monotonic()
+            self.last_poll = self.last_resync
+            self.synced_until = started_at
+            self.resynced_once = True
+        print(f"✅ Harmonogram przypomnień: {len(self.entries)} użytkowników z automatyczną wysyłką")
+    
+    def poll_changes(self) -> int:
+        """Zastosuj wpisy rejestru tenants zmienione od ostatniej synchronizacji; zwraca ich liczbę
+        
+        Ustawienia zapisane w innym procesie zmieniają kopiec tylko tam - tak dociera do nas
+        włączenie wysyłki i zmiana godziny. Okno zapytania zachodzi na poprzednie o
+        REMINDER_SCHEDULE_POLL_SECONDS (różnice zegarów, zapisy w trakcie zapytania).
+        """
+        started_at = datetime.now()
+        since = self.synced_until - timedelta(seconds=REMINDER_SCHEDULE_POLL_SECONDS)
+        tenants_query = db.collection(TENANTS_COLLECTION).where("updated_at", ">", since)
+        tenants = {doc.id: doc.to_dict() for doc in tenants_query.stream()}
+        with self.lock:
+            for username, tenant in tenants.items():
+                self._apply(
+                    username,
+                    tenant.get("autoSendEnabled", False),
+                    tenant.get("sendHour", 10),
+                    tenant.get("sendMinute", 0),
+                    started_at
+                )
+            self.last_poll = time.monotonic()
+            self.synced_until = started_at
+        return len(tenants)
+    
+    def set_shards(self, shards: set):
+        """Ustaw shardy obsługiwane przez ten proces
+        
+        Dla przejętych shardów terminy są przeliczane z tolerancją REMINDER_STARTUP_GRACE_MINUTES,
+        żeby wysyłki pominięte przez poprzedniego właściciela (np. po awarii) zostały nadrobione.
+        Terminy, których przebieg poprzedni właściciel już rozpoczął, są pomijane (lastReminderSlot
+        w rejestrze tenants) - jego SMS-y mogą jeszcze czekać w kolejce innego hosta.
+        """
+        with self.lock:
+            adopted = set(shards) - self.shards
+            self.shards = set(shards)
+            if adopted and self.resynced_once:
+                after = datetime.now() - timedelta(minutes=REMINDER_STARTUP_GRACE_MINUTES)
+                for username in list(self.entries):
+                    if reminder_shard(username) in adopted:
+                        self._push(username, next_send_instant(*self.send_times[username], after))
+        if adopted:
+            self._notify()
+    
+    def _pop_due(self) -> tuple:
+        """Zdejmij z kopca należne wysyłki; zwraca (lista (username, termin), sekundy do kolejnego terminu)
+        
+        Terminy użytkowników z shardów innych procesów są tylko przesuwane na kolejny dzień.
+        """
+        due = []
+        with self.lock:
+            now = datetime.now()
+            while self.heap:
+                when, version, username = self.heap[0]
+                # Pomiń wpisy unieważnione zmianą ustawień
+                if self.entries.get(username) != (when, version):
+                    heapq.heappop(self.heap)
+                    continue
+                if when > now:
+                    return due, (when - now).total_seconds()
+                heapq.heappop(self.heap)
+                # Kolejny termin tego użytkownika - następnego dnia o tej samej godzinie
+                send_hour, send_minute = self.send_times[username]
+                self._push(username, next_send_instant(send_hour, send_minute, max(when, now)))
+                if reminder_shard(username) in self.shards:
+                    due.append((username, when))
+        return due, None
+    
+    def _confirm_due(self, username: str, when: datetime) -> bool:
+        """Zajmij termin z kopca w rejestrze tenants (transakcyjnie) - tylko wtedy wysyłamy
+        
+        Ustawienia mogła zapisać inna instancja (kopiec dowiaduje się o tym przy pobieraniu zmian).
+        Przy wyłączonej automatycznej wysyłce lub innej godzinie termin jest przeliczany zamiast wysyłki;
+        termin obsłużony już przez inny proces (np. przed przejęciem shardu) jest pomijany.
+        """
+        tenant_ref = db.collection(TENANTS_COLLECTION).document(username)
+        outcome, tenant = _claim_reminder_slot_in_transaction(db.transaction(), tenant_ref, when)
+        if outcome == "claimed":
+            return True
+        if outcome == "claimed_before":
+            print(f"⏭️ Przebieg przypomnień {username} ({reminder_slot_key(when)}) już się odbył")
+            return False
+        with self.lock:
+            self._apply(
+                username,
+                tenant.get("autoSendEnabled", False),
+                tenant.get("sendHour", 10),
+                tenant.get("sendMinute", 0),
+                datetime.now()
+            )
+        self._notify()
+        print(f"🔄 Zmienione ustawienia wysyłki {username} - termin {when.strftime('%H:%M')} przeliczony bez wysyłki")
+        return False
+    
+    async def _run_tenant(self, username: str, when: datetime, run: dict):
+        async with self.semaphore:
+            try:
+                if not await run_in_threadpool(self._confirm_due, username, when):
+                    return
+            except Exception as e:
+                # Bez zajęcia terminu nie wysyłamy (mógł go obsłużyć inny proces) - należni klienci
+                # zostają w indeksie next_reminder_at i trafią do kolejnego przebiegu
+                print(f"❌ Błąd zajmowania terminu przypomnień ({username}): {str(e)}")
+                return
+            started_at = datetime.now()
+            print(f"🕐 [{started_at.strftime('%Y-%m-%d %H:%M:%S')}] Przypomnienia SMS dla: {username}")
+            try:
+                async with reminder_telemetry.track_tenant(run, username):
+                    queued = await send_tenant_reminders(username, when)
+                self.last_runs[username] = {"at": started_at.isoformat(), "queued": queued}
+            except Exception as e:
+                print(f"❌ Błąd w schedulerze przypomnień ({username}): {str(e)}")
+                import traceback
+                traceback.print_exc()
+    
+    async def _run_batch(self, due: list):
+        """Przetwórz użytkowników z tym samym terminem jako jeden przebieg (telemetria)"""
+        run = reminder_telemetry.start_run("scheduler")
+        try:
+            await asyncio.gather(*[self._run_tenant(username, when, run) for username, when in due])
+        finally:
+            reminder_telemetry.finish_run(run)
+    
+    async def _run(self):
+        while self.running:
+            try:
+                if self.last_resync is None or time.monotonic() - self.last_resync >= REMINDER_SCHEDULE_RESYNC_SECONDS:
+                    try:
+                        await run_in_threadpool(self.resync)
+                    except Exception as e:
+                        print(f"❌ Błąd synchronizacji harmonogramu przypomnień: {str(e)}")
+                        # Ponów synchronizację za minutę
+                        self.last_resync = time.monotonic() - REMINDER_SCHEDULE_RESYNC_SECONDS + 60
+                elif self.resynced_once and time.monotonic() - self.last_poll >= REMINDER_SCHEDULE_POLL_SECONDS:
+                    try:
+                        await run_in_threadpool(self.poll_changes)
+                    except Exception as e:
+                        print(f"❌ Błąd pobierania zmian harmonogramu przypomnień: {str(e)}")
+                        self.last_poll = time.monotonic()
+                
+                self.wakeup.clear()
+                due, next_in = self._pop_due()
+                if due:
+                    # Trzymamy referencję do zadania, żeby nie zostało usunięte przez garbage collector
+                    task = asyncio.create_task(self._run_batch(due))
+                    self.tenant_tasks.add(task)
+                    task.add_done_callback(self.tenant_tasks.discard)
+                
+                resync_in = REMINDER_SCHEDULE_RESYNC_SECONDS - (time.monotonic() - self.last_resync)
+                # Do pierwszej udanej synchronizacji nie ma od czego pobierać zmian
+                poll_in = REMINDER_SCHEDULE_POLL_SECONDS - (time.monotonic() - self.last_poll) if self.resynced_once else resync_in
+                timeout = max(0.0, min(resync_in, poll_in) if next_in is None else min(next_in, resync_in, poll_in))
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Błąd schedulera przypomnień: {str(e)}")
+                await asyncio.sleep(60)
+    
+    def start(self):
+        """Uruchom zadanie schedulera na bieżącej pętli zdarzeń"""
+        if self.running or not db:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(REMINDER_TENANT_CONCURRENCY)
+        self.running = True
+        self.task = self.loop.create_task(self._run())
+        print("✅ Scheduler przypomnień SMS uruchomiony")
+    
+    async def stop(self):
+        """Zatrzymaj zadanie schedulera i przerwij trwające przetwarzanie użytkowników"""
+        self.running = False
+        tasks = [task for task in [self.task, *self.tenant_tasks] if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+        self.loop = None
+        self.wakeup = None
+        self.last_resync = None
+        self.resynced_once = False
+        self.last_poll = None
+        self.synced_until = None
+    
+    def status(self) -> list:
+        """Najbliższe terminy wysyłki wszystkich użytkowników"""
+        with self.lock:
+            entries = sorted((when, username) for username, (when, _) in self.entries.items())
+            return [
+                {
+                    "id": f"reminders:{username}",
+                    "name": f"Przypomnienia SMS: {username}",
+                    "next_run": when.isoformat(),
+                    "trigger": "daily {:02d}:{:02d}".format(*self.send_times[username]),
+                    "shard": reminder_shard(username),
+                    "owned": reminder_shard(username) in self.shards,
+                    "last_run": self.last_runs.get(username)
+                }
+                for when, username in entries
+            ]
+
+reminder_scheduler = ReminderScheduler()
+
+# Wybór lidera schedulera - przy wielu procesach (workery uvicorn/gunicorn, kilka instancji)
+# przypomnienia wysyła tylko proces trzymający dzierżawę (lease). Gdy lider przestaje odnawiać
+# dzierżawę, po SCHEDULER_LEASE_TTL_SECONDS przejmuje ją inny proces.
+SCHEDULER_LEASE_BACKEND = os.getenv("SCHEDULER_LEASE_BACKEND", "firestore")
+SCHEDULER_LEASE_FILE = os.getenv("SCHEDULER_LEASE_FILE", "scheduler.lock")
+SCHEDULER_LEASE_TTL_SECONDS = float(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", "30"))
+SCHEDULER_LEASE_NAME = "reminders"
+SCHEDULER_MEMBER_SLOTS = 64
+
+@firestore.transactional
+def _acquire_scheduler_lease_in_transaction(transaction, lease_ref, holder: str, ttl: float) -> bool:
+    """Przejmij lub odnów dzierżawę w transakcji; False gdy trzyma ją inny, aktywny proces"""
+    lease_doc = lease_ref.get(transaction=transaction)
+    lease = lease_doc.to_dict() if lease_doc.exists else {}
+    now = time.time()
+    if lease.get("holder") not in [None, holder] and lease.get("expires_at", 0) > now:
+        return False
+    transaction.set(lease_ref, {
+        "holder": holder,
+        "expires_at": now + ttl,
+        "renewed_at": datetime.now()
+    })
+    return True
+
+class FirestoreLease:
+    """Dzierżawa w dokumencie scheduler_leases/{name} - działa dla wielu hostów"""
+    
+    def __init__(self, name: str, holder: str, ttl: float):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+    
+    def acquire(self) -> bool:
+        """Przejmij lub odnów dzierżawę"""
+        lease_ref = db.collection(SCHEDULER_LEASES_COLLECTION).document(self.name)
+        return _acquire_scheduler_lease_in_transaction(db.transaction(), lease_ref, self.holder, self.ttl)
+    
+    def release(self):
+        """Zwolnij dzierżawę (jeśli należy do tego procesu), żeby inny proces przejął ją od razu"""
+        lease_ref = db.collection(SCHEDULER_LEASES_COLLECTION).document(self.name)
+        lease_doc = lease_ref.get()
+        if lease_doc.exists and lease_doc.to_dict().get("holder") == self.holder:
+            lease_ref.delete()
+    
+    def current_holder(self) -> Optional[str]:
+        """Proces trzymający aktywną dzierżawę"""
+        lease_doc = db.collection(SCHEDULER_LEASES_COLLECTION).document(self.name).get()
+        lease = lease_doc.to_dict() if lease_doc.exists else {}
+        return lease.get("holder") if lease.get("expires_at", 0) > time.time() else None
+
+class FileLease:
+    """Dzierżawa jako blokada pliku (flock) - dla wielu procesów na jednym hoście
+    
+    System zwalnia blokadę automatycznie, gdy proces lidera się zakończy.
+    """
+    
+    def __init__(self, path: str, holder: str):
+        self.path = path
+        self.holder = holder
+        self.file = None
+    
+    def acquire(self) -> bool:
+        """Przejmij blokadę (bez czekania) lub potwierdź, że ten proces już ją trzyma"""
+        import fcntl
+        if self.file is not None:
+            return True
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(self.holder)
+        lock_file.flush()
+        self.file = lock_file
+        return True
+    
+    def release(self):
+        """Zwolnij blokadę"""
+        import fcntl
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+    
+    def current_holder(self) -> Optional[str]:
+        """Proces trzymający blokadę (zapisany w pliku)"""
+        try:
+            with open(self.path) as lock_file:
+                return lock_file.read().strip() or None
+        except OSError:
+            return None
 
-# Uruchom scheduler
-scheduler.start()
-print("✅ Scheduler przypomnień SMS uruchomiony (sprawdzanie co godzinę)")
+scheduler_holder_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+def make_scheduler_lease(name: str):
+    """Dzierżawa o podanej nazwie w skonfigurowanym backendzie (Firestore lub plik)"""
+    if SCHEDULER_LEASE_BACKEND == "file":
+        return FileLease(f"{SCHEDULER_LEASE_FILE}.{name}", scheduler_holder_id)
+    return FirestoreLease(name, scheduler_holder_id, SCHEDULER_LEASE_TTL_SECONDS)
+
+# Każdy shard użytkowników ma własną dzierżawę; członkostwo (heartbeat procesu) pozwala
+# policzyć żywe procesy i podzielić shardy między nie po równo
+scheduler_shard_leases = [make_scheduler_lease(f"{SCHEDULER_LEASE_NAME}-{shard}") for shard in range(REMINDER_SHARDS)]
+scheduler_member_lease = None
+_scheduler_leadership = {"task": None, "shards": set()}
+
+def register_scheduler_member() -> bool:
+    """Odnów członkostwo procesu (w trybie plikowym - zajmij wolny slot)"""
+    global scheduler_member_lease
+    if SCHEDULER_LEASE_BACKEND != "file":
+        if scheduler_member_lease is None:
+            scheduler_member_lease = make_scheduler_lease(f"member-{scheduler_holder_id}")
+        return scheduler_member_lease.acquire()
+    if scheduler_member_lease is not None:
+        return True
+    for slot in range(SCHEDULER_MEMBER_SLOTS):
+        lease = make_scheduler_lease(f"member{slot}")
+        if lease.acquire():
+            scheduler_member_lease = lease
+            return True
+    return False
+
+def count_scheduler_members() -> int:
+    """Liczba żywych procesów uczestniczących w podziale shardów"""
+    if SCHEDULER_LEASE_BACKEND != "file":
+        now = time.time()
+        members = 0
+        for doc in db.collection(SCHEDULER_LEASES_COLLECTION).stream():
+            if not doc.id.startswith("member-"):
+                continue
+            if doc.to_dict().get("expires_at", 0) > now:
+                members += 1
+            else:
+                # Członkostwo procesu, który zakończył się bez wyrejestrowania
+                doc.reference.delete()
+        return members
+    members = 0
+    for slot in range(SCHEDULER_MEMBER_SLOTS):
+        lease = make_scheduler_lease(f"member{slot}")
+        if scheduler_member_lease is not None and lease.path == scheduler_member_lease.path:
+            members += 1
+        elif os.path.exists(lease.path):
+            # Slot jest zajęty, jeśli nie da się założyć blokady
+            if lease.acquire():
+                lease.release()
+            else:
+                members += 1
+    return members
+
+def release_scheduler_member():
+    """Wyrejestruj proces z podziału shardów"""
+    global scheduler_member_lease
+    if scheduler_member_lease is not None:
+        scheduler_member_lease.release()
+        scheduler_member_lease = None
+
+def rebalance_scheduler_shards(owned: set) -> set:
+    """Odnów dzierżawy posiadanych shardów i wyrównaj ich liczbę do ceil(shardy / procesy)"""
+    register_scheduler_member()
+    target = math.ceil(REMINDER_SHARDS / max(1, count_scheduler_members()))
+    
+    owned = {shard for shard in owned if scheduler_shard_leases[shard].acquire()}
+    
+    # Oddaj nadmiarowe shardy, żeby nowe procesy mogły je przejąć
+    for shard in sorted(owned, reverse=True)[:max(0, len(owned) - target)]:
+        scheduler_shard_leases[shard].release()
+        owned.discard(shard)
+    
+    # Przejmij wolne shardy (od przesunięcia zależnego od procesu, żeby procesy nie konkurowały o te same)
+    offset = zlib.crc32(scheduler_holder_id.encode()) % REMINDER_SHARDS
+    for step in range(REMINDER_SHARDS):
+        if len(owned) >= target:
+            break
+        shard = (offset + step) % REMINDER_SHARDS
+        if shard not in owned and scheduler_shard_leases[shard].acquire():
+            owned.add(shard)
+    return owned
+
+def release_scheduler_shards(owned: set):
+    """Zwolnij dzierżawy shardów i członkostwo, żeby inne procesy przejęły je od razu"""
+    for shard in owned:
+        scheduler_shard_leases[shard].release()
+    release_scheduler_member()
+
+def scheduler_shard_holders() -> dict:
+    """Aktualni właściciele wszystkich shardów"""
+    return {shard: lease.current_holder() for shard, lease in enumerate(scheduler_shard_leases)}
+
+async def run_scheduler_leadership():
+    """Cyklicznie odnawiaj dzierżawy shardów i uruchamiaj scheduler dla posiadanych shardów"""
+    last_renewed = None
+    while True:
+        owned = _scheduler_leadership["shards"]
+        try:
+            owned = await run_in_threadpool(rebalance_scheduler_shards, set(owned))
+            last_renewed = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ Błąd odnawiania dzierżaw schedulera: {str(e)}")
+            # Bez udanego odnowienia przez połowę TTL inny proces mógł już przejąć shardy
+            if last_renewed is None or time.monotonic() - last_renewed >= SCHEDULER_LEASE_TTL_SECONDS / 2:
+                owned = set()
+        
+        previous = _scheduler_leadership["shards"]
+        if owned != previous:
+            print(f"👑 Proces {scheduler_holder_id} obsługuje shardy przypomnień: {sorted(owned) or 'brak'}")
+        reminder_scheduler.set_shards(owned)
+        _scheduler_leadership["shards"] = owned
+        if owned and not reminder_scheduler.running:
+            reminder_scheduler.start()
+        elif not owned and reminder_scheduler.running:
+            await reminder_scheduler.stop()
+        
+        await asyncio.sleep(SCHEDULER_LEASE_TTL_SECONDS / 3)
+
+@app.on_event("startup")
+async def start_reminder_scheduler():
+    """Uruchom podział shardów - scheduler przypomnień obsługuje tylko shardy tego procesu"""
+    if not db:
+        return
+    _scheduler_leadership["task"] = asyncio.create_task(run_scheduler_leadership())
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    """Zatrzymaj scheduler przypomnień i zwolnij dzierżawy"""
+    task = _scheduler_leadership["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        _scheduler_leadership["task"] = None
+    if reminder_scheduler.running:
+        await reminder_scheduler.stop()
+    if _scheduler_leadership["shards"] or scheduler_member_lease:
+        try:
+            await run_in_threadpool(release_scheduler_shards, _scheduler_leadership["shards"])
+        except Exception as e:
+            print(f"⚠️ Błąd zwalniania dzierżaw schedulera: {str(e)}")
+        _scheduler_leadership["shards"] = set()
+        reminder_scheduler.set_shards(set())
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -1186,7 +3699,7 @@ async def root():
 
 # Endpointy dla klientów
 @app.post("/clients/{username}", response_model=ClientResponse)
-async def create_client(username: str, client_data: ClientCreate):
+def create_client(username: str, client_data: ClientCreate):
     """Dodaj nowego klienta do kolekcji użytkownika"""
     print(f"➕ Dodawanie klienta dla użytkownika: {username}")
     print(f"📊 Dane klienta: {client_data.dict()}")
@@ -1220,6 +3733,7 @@ async def create_client(username: str, client_data: ClientCreate):
             "sms_count": 0,
             "source": "CRM"
         })
+        client_dict["next_reminder_at"] = compute_next_reminder_at(client_dict, get_reminder_frequency(username))
         print(f"📝 Dane do zapisu: {client_dict}")
         print(f"🔑 Wygenerowany kod recenzji: {review_code}")
         
@@ -1227,6 +3741,10 @@ async def create_client(username: str, client_data: ClientCreate):
         doc_ref = clients_ref.add(client_dict)[1]
         print(f"✅ Klient dodany z ID: {doc_ref.id}")
         
+        # Zapisz kod recenzji w indeksie i zwiększ licznik klientów w rejestrze
+        register_review_code(review_code, username, doc_ref.id)
+        increment_tenant_counter(username, "clientsCount")
+        
         # Pobierz dodanego klienta
         doc = doc_ref.get()
         client_data_dict = doc.to_dict()
@@ -1255,6 +3773,11 @@ async def create_client(username: str, client_data: ClientCreate):
 
 @app.get("/clients/{username}", response_model=ClientListResponse)
 async def get_clients(username: str):
+    """Pobierz wszystkich klientów użytkownika (w ramach limitu równoczesnych odczytów użytkownika)"""
+    async with tenant_reads_bulkhead.slot(username):
+        return await run_in_threadpool(load_clients, username)
+
+def load_clients(username: str) -> ClientListResponse:
     """Pobierz wszystkich klientów użytkownika"""
     print(f"🔍 Pobieranie klientów dla użytkownika: {username}")
     
@@ -1331,7 +3854,7 @@ async def get_clients(username: str):
         raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania klientów: {str(e)}")
 
 @app.get("/clients/{username}/{client_id}", response_model=ClientResponse)
-async def get_client(username: str, client_id: str):
+def get_client(username: str, client_id: str):
     """Pobierz konkretnego klienta"""
     if not db:
         raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
@@ -1366,7 +3889,7 @@ async def get_client(username: str, client_id: str):
         raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania klienta: {str(e)}")
 
 @app.put("/clients/{username}/{client_id}", response_model=ClientResponse)
-async def update_client(username: str, client_id: str, client_data: ClientUpdate):
+def update_client(username: str, client_id: str, client_data: ClientUpdate):
     """Zaktualizuj klienta"""
     if not db:
         raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
@@ -1382,9 +3905,22 @@ async def update_client(username: str, client_id: str, client_data: ClientUpdate
         update_data = {k: v for k, v in client_data.dict().items() if v is not None}
         update_data["updated_at"] = datetime.now()
         
+        # Przelicz termin następnego przypomnienia (zmiana statusu, liczby SMS lub numeru)
+        update_data["next_reminder_at"] = compute_next_reminder_at(
+            {**doc.to_dict(), **update_data}, get_reminder_frequency(username)
+        )
+        
         # Zaktualizuj dokument
         doc_ref.update(update_data)
         
+        # Jeśli zmienił się kod recenzji, zaktualizuj indeks
+        old_review_code = doc.to_dict().get("review_code", "")
+        new_review_code = update_data.get("review_code")
+        if new_review_code and new_review_code != old_review_code:
+            register_review_code(new_review_code, username, client_id)
+            if old_review_code:
+                unregister_review_code(old_review_code)
+        
         # Pobierz zaktualizowany dokument
         updated_doc = doc_ref.get()
         client_data_dict = updated_doc.to_dict()
@@ -1410,7 +3946,7 @@ async def update_client(username: str, client_id: str, client_data: ClientUpdate
         raise HTTPException(status_code=500, detail=f"Błąd podczas aktualizacji klienta: {str(e)}")
 
 @app.delete("/clients/{username}/{client_id}")
-async def delete_client(username: str, client_id: str):
+def delete_client(username: str, client_id: str):
     """Usuń klienta"""
     if not db:
         raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
@@ -1425,6 +3961,12 @@ async def delete_client(username: str, client_id: str):
         # Usuń dokument
         doc_ref.delete()
         
+        # Usuń kod recenzji z indeksu i zmniejsz licznik klientów w rejestrze
+        review_code = doc.to_dict().get("review_code", "")
+        if review_code:
+            unregister_review_code(review_code)
+        increment_tenant_counter(username, "clientsCount", -1)
+        
         return {"message": "Klient został usunięty pomyślnie"}
         
     except HTTPException:
@@ -1434,7 +3976,7 @@ async def delete_client(username: str, client_id: str):
 
 # Endpointy dla ustawień użytkownika
 @app.get("/settings/{username}", response_model=UserSettingsResponse)
-async def get_user_settings(username: str):
+def get_user_settings(username: str):
     """Pobierz ustawienia użytkownika"""
     print(f"⚙️ Pobieranie ustawień dla użytkownika: {username}")
     
@@ -1493,7 +4035,7 @@ Dziękujemy!""",
         raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania ustawień: {str(e)}")
 
 @app.put("/settings/{username}")
-async def save_user_settings(username: str, settings: UserSettings):
+def save_user_settings(username: str, settings: UserSettings):
     """Zapisz ustawienia użytkownika"""
     print(f"💾 Zapisywanie ustawień dla użytkownika: {username}")
     print(f"📊 Dane ustawień: {settings.dict()}")
@@ -1504,6 +4046,8 @@ async def save_user_settings(username: str, settings: UserSettings):
     
     try:
         doc_ref = db.collection(username).document("Dane")
+        previous_frequency = get_reminder_frequency(username)
+        previous_email = ((get_tenant_settings(username) or {}).get("userData") or {}).get("email", "")
         
         # Dodaj timestamp
         settings_dict = settings.dict()
@@ -1513,6 +4057,20 @@ async def save_user_settings(username: str, settings: UserSettings):
         
         # Zapisz do Firestore
         doc_ref.set(settings_dict)
+        invalidate_tenant_settings(username)
+        evict_twilio_client_for_user(username, settings_dict.get("twilio"))
+        sync_tenant_registry(username, settings_dict)
+        
+        # Zmiana częstotliwości przypomnień przesuwa terminy wszystkich klientów
+        if settings.messaging.reminderFrequency != previous_frequency:
+            updated = refresh_next_reminders(username)
+            print(f"🔄 Przeliczono terminy przypomnień dla {updated} klientów")
+        
+        # Zaktualizuj katalog emaili (stary email po zmianie nie może dalej wskazywać na użytkownika)
+        if normalize_email(previous_email) != normalize_email(settings.userData.email):
+            unregister_user_email(previous_email, username)
+        register_user_email(settings.userData.email, username, settings.permission)
+        
         print(f"✅ Ustawienia zapisane pomyślnie")
         
         return {"message": "Ustawienia zostały zapisane pomyślnie"}
@@ -1533,7 +4091,7 @@ class PermissionResponse(BaseModel):
     message: str
 
 @app.put("/admin/permissions/{username}", response_model=PermissionResponse)
-async def update_user_permission(username: str, permission_data: PermissionUpdateRequest, admin_username: str = None):
+def update_user_permission(username: str, permission_data: PermissionUpdateRequest, admin_username: str = None):
     """Zaktualizuj uprawnienia użytkownika (tylko dla adminów)"""
     print(f"🔐 Aktualizacja uprawnień dla użytkownika: {username}")
     print(f"🔐 Nowe uprawnienia: {permission_data.permission}")
@@ -1576,6 +4134,9 @@ async def update_user_permission(username: str, permission_data: PermissionUpdat
         })
         
         doc_ref.set(settings_dict)
+        invalidate_tenant_settings(username)
+        sync_tenant_registry(username, settings_dict)
+        update_user_email_permission(username, settings_dict, permission_data.permission)
         print(f"✅ Uprawnienia zaktualizowane pomyślnie dla {username}: {permission_data.permission}")
         
         return PermissionResponse(
@@ -1593,7 +4154,7 @@ async def update_user_permission(username: str, permission_data: PermissionUpdat
         raise HTTPException(status_code=500, detail=f"Błąd podczas aktualizacji uprawnień: {str(e)}")
 
 @app.get("/admin/permissions/{username}", response_model=PermissionResponse)
-async def get_user_permission(username: str):
+def get_user_permission(username: str):
     """Pobierz uprawnienia użytkownika"""
     print(f"🔍 Sprawdzanie uprawnień dla użytkownika: {username}")
     
@@ -1638,7 +4199,7 @@ class UserPermissionInfo(BaseModel):
     limits: dict
 
 @app.get("/user-permission-info/{username}", response_model=UserPermissionInfo)
-async def get_user_permission_info(username: str):
+def get_user_permission_info(username: str):
     """Pobierz szczegółowe informacje o uprawnieniach użytkownika"""
     print(f"🔍 Sprawdzanie szczegółowych uprawnień dla użytkownika: {username}")
     
@@ -1710,7 +4271,7 @@ async def get_user_permission_info(username: str):
         raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania informacji o uprawnieniach: {str(e)}")
 
 @app.post("/admin/migrate-user-permissions")
-async def migrate_user_permissions():
+def migrate_user_permissions():
     """Migruj istniejących użytkowników - ustaw im uprawnienia Demo jeśli nie mają uprawnień"""
     print(f"🔄 Rozpoczynanie migracji uprawnień użytkowników")
     
@@ -1722,20 +4283,13 @@ async def migrate_user_permissions():
         migrated_count = 0
         skipped_count = 0
         
-        # Pobierz wszystkie kolekcje (użytkowników)
-        collections = db.collections()
-        
-        for collection in collections:
-            collection_name = collection.id
-            print(f"🔍 Sprawdzanie kolekcji: {collection_name}")
-            
-            # Sprawdź czy to jest kolekcja użytkownika (nie systemowa)
-            if collection_name in ["temp_clients", "Dane"]:
-                print(f"⏭️ Pomijanie kolekcji systemowej: {collection_name}")
-                continue
+        # Pobierz użytkowników z rejestru tenants
+        for tenant_doc in db.collection(TENANTS_COLLECTION).stream():
+            collection_name = tenant_doc.id
+            print(f"🔍 Sprawdzanie użytkownika: {collection_name}")
             
             # Sprawdź czy użytkownik ma dokument "Dane"
-            doc_ref = collection.document("Dane")
+            doc_ref = db.collection(collection_name).document("Dane")
             doc = doc_ref.get()
             
             if doc.exists:
@@ -1751,6 +4305,9 @@ async def migrate_user_permissions():
                     
                     # Zapisz zaktualizowane ustawienia
                     doc_ref.set(settings_data)
+                    invalidate_tenant_settings(collection_name)
+                    sync_tenant_registry(collection_name, settings_data)
+                    update_user_email_permission(collection_name, settings_data, UserPermission.DEMO)
                     migrated_count += 1
                     print(f"✅ Użytkownik {collection_name} zmigrowany do uprawnień Demo")
                 else:
@@ -1774,6 +4331,294 @@ async def migrate_user_permissions():
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Błąd podczas migracji uprawnień: {str(e)}")
 
+@app.post("/admin/backfill-review-codes")
+def backfill_review_codes():
+    """Zbuduj indeks review_codes dla istniejących klientów (jednorazowa migracja)"""
+    print(f"🔄 Rozpoczynanie budowy indeksu kodów recenzji")
+
+    if not db:
+        print("❌ Firebase nie jest skonfigurowany")
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+
+    try:
+        indexed_count = 0
+        batch = db.batch()
+        batch_size = 0
+
+        for collection in db.collections():
+            collection_name = collection.id
+
+            # temp_clients indeksujemy z właścicielem zapisanym w dokumencie klienta
+            is_temp_client = collection_name == "temp_clients"
+            if collection_name in SYSTEM_COLLECTIONS and not is_temp_client:
+                continue
+
+            print(f"🔍 Indeksowanie kolekcji: {collection_name}")
+            for doc in collection.stream():
+                if doc.id == "Dane":
+                    continue
+
+                client_data = doc.to_dict()
+                review_code = client_data.get("review_code", "")
+                if not review_code:
+                    continue
+
+                owner_username = client_data.get("owner_username", "") if is_temp_client else collection_name
+                batch.set(db.collection(REVIEW_CODES_COLLECTION).document(review_code), {
+                    "owner_username": owner_username,
+                    "client_id": doc.id,
+                    "is_temp_client": is_temp_client,
+                    "created_at": datetime.now()
+                })
+                batch_size += 1
+                indexed_count += 1
+
+                # Firestore pozwala na maksymalnie 500 operacji w jednym batchu
+                if batch_size >= 400:
+                    batch.commit()
+                    batch = db.batch()
+                    batch_size = 0
+
+        if batch_size > 0:
+            batch.commit()
+
+        print(f"✅ Indeks kodów recenzji zbudowany: {indexed_count} kodów")
+
+        return {
+            "message": "Indeks kodów recenzji zbudowany pomyślnie",
+            "indexed_count": indexed_count
+        }
+
+    except Exception as e:
+        print(f"❌ Błąd podczas budowy indeksu kodów recenzji: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas budowy indeksu kodów recenzji: {str(e)}")
+
+@app.post("/admin/backfill-user-emails")
+def backfill_user_emails():
+    """Zbuduj katalog emaili dla istniejących użytkowników (jednorazowa migracja)"""
+    print(f"🔄 Rozpoczynanie budowy katalogu emaili")
+
+    if not db:
+        print("❌ Firebase nie jest skonfigurowany")
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+
+    try:
+        registered_count = 0
+        skipped_count = 0
+
+        for collection in db.collections():
+            collection_name = collection.id
+            if collection_name in SYSTEM_COLLECTIONS:
+                continue
+
+            settings_doc = collection.document("Dane").get()
+            if not settings_doc.exists:
+                continue
+
+            settings_data = settings_doc.to_dict()
+            email = settings_data.get("userData", {}).get("email", "")
+            if not email:
+                print(f"⏭️ Użytkownik {collection_name} nie ma emaila")
+                skipped_count += 1
+                continue
+
+            register_user_email(email, collection_name, settings_data.get("permission", "Demo"))
+            registered_count += 1
+
+        print(f"✅ Katalog emaili zbudowany: {registered_count} wpisów, {skipped_count} pominiętych")
+
+        return {
+            "message": "Katalog emaili zbudowany pomyślnie",
+            "registered_count": registered_count,
+            "skipped_count": skipped_count
+        }
+
+    except Exception as e:
+        print(f"❌ Błąd podczas budowy katalogu emaili: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas budowy katalogu emaili: {str(e)}")
+
+@app.post("/admin/backfill-tenants")
+def backfill_tenants():
+    """Zbuduj rejestr tenants dla istniejących użytkowników (jednorazowa migracja)"""
+    print(f"🔄 Rozpoczynanie budowy rejestru użytkowników")
+
+    if not db:
+        print("❌ Firebase nie jest skonfigurowany")
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+
+    try:
+        registered_count = 0
+
+        for collection in db.collections():
+            collection_name = collection.id
+            if collection_name in SYSTEM_COLLECTIONS:
+                continue
+
+            settings_doc = collection.document("Dane").get()
+            if not settings_doc.exists:
+                print(f"⚠️ Kolekcja {collection_name} nie ma dokumentu Dane")
+                continue
+
+            # Policz klientów i SMS-y, żeby zainicjalizować liczniki rejestru
+            clients_count = 0
+            sms_sent = 0
+            for doc in collection.stream():
+                if doc.id in ["Dane", "SMS"]:
+                    continue
+                clients_count += 1
+                sms_sent += doc.to_dict().get("sms_count", 0)
+
+            sync_tenant_registry(collection_name, settings_doc.to_dict())
+            db.collection(TENANTS_COLLECTION).document(collection_name).set({
+                "clientsCount": clients_count,
+                "smsSent": sms_sent
+            }, merge=True)
+            registered_count += 1
+            print(f"✅ Zarejestrowano użytkownika {collection_name} (klienci: {clients_count}, SMS: {sms_sent})")
+
+        print(f"✅ Rejestr użytkowników zbudowany: {registered_count} wpisów")
+
+        return {
+            "message": "Rejestr użytkowników zbudowany pomyślnie",
+            "registered_count": registered_count
+        }
+
+    except Exception as e:
+        print(f"❌ Błąd podczas budowy rejestru użytkowników: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas budowy rejestru użytkowników: {str(e)}")
+
+@app.post("/admin/backfill-sms-counters")
+def backfill_sms_counters():
+    """Zbuduj miesięczne liczniki SMS z historycznych logów (jednorazowa migracja)"""
+    print(f"🔄 Rozpoczynanie budowy liczników SMS")
+
+    if not db:
+        print("❌ Firebase nie jest skonfigurowany")
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+
+    try:
+        counters_count = 0
+
+        for tenant_doc in db.collection(TENANTS_COLLECTION).stream():
+            username = tenant_doc.id
+            sms_doc_ref = db.collection(username).document("SMS")
+
+            # Każda podkolekcja dokumentu SMS (poza licznikami) to log jednego miesiąca
+            for month_collection in sms_doc_ref.collections():
+                month = month_collection.id
+                if month == SMS_COUNTERS_COLLECTION:
+                    continue
+
+                sent_count = count_documents(month_collection)
+                get_sms_counter_ref(username, month).set({
+                    "count": sent_count,
+                    "month": month,
+                    "updated_at": datetime.now()
+                })
+                counters_count += 1
+                print(f"✅ Licznik SMS {username}/{month}: {sent_count}")
+
+        print(f"✅ Liczniki SMS zbudowane: {counters_count}")
+
+        return {
+            "message": "Liczniki SMS zbudowane pomyślnie",
+            "counters_count": counters_count
+        }
+
+    except Exception as e:
+        print(f"❌ Błąd podczas budowy liczników SMS: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas budowy liczników SMS: {str(e)}")
+
+@app.get("/admin/sms-queue")
+def get_sms_queue_status():
+    """Stan kolejki SMS: liczba wiadomości według statusu i ostatnie wiadomości w dead-letter"""
+    try:
+        return {
+            "workers": len(_sms_worker_tasks),
+            "counts": sms_outbox.stats(),
+            "lanes": get_sms_lane_metrics(),
+            "dead_letters": sms_outbox.dead_letters()
+        }
+    except Exception as e:
+        print(f"❌ Błąd podczas pobierania stanu kolejki SMS: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania stanu kolejki SMS: {str(e)}")
+
+@app.post("/admin/sms-queue/dead-letters/{dead_letter_id}/requeue")
+def requeue_sms_dead_letter(dead_letter_id: int):
+    """Przywróć wiadomość z dead-letter do kolejki SMS"""
+    print(f"🔁 Przywracanie wiadomości {dead_letter_id} z dead-letter do kolejki")
+    
+    try:
+        queued = sms_outbox.requeue_dead_letter(dead_letter_id)
+        if queued is None:
+            raise HTTPException(status_code=404, detail="Wiadomość nie została znaleziona")
+        wake_sms_workers()
+        
+        return {
+            "success": True,
+            "message": "Wiadomość została przywrócona do kolejki",
+            "queue_id": queued["id"]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Błąd podczas przywracania wiadomości do kolejki: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas przywracania wiadomości do kolejki: {str(e)}")
+
+@app.get("/admin/tenant-load")
+def get_tenant_load():
+    """Obciążenie per użytkownik: bieżące i szczytowe operacje w każdej grodzi (SMS, odczyty, scheduler)"""
+    try:
+        bulkheads = [tenant_reads_bulkhead, tenant_scheduler_bulkhead, *sms_lane_bulkheads.values()]
+        return {bulkhead.name: bulkhead.gauges() for bulkhead in bulkheads}
+    except Exception as e:
+        print(f"❌ Błąd podczas pobierania obciążenia użytkowników: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas pobierania obciążenia użytkowników: {str(e)}")
+
+@app.post("/admin/backfill-next-reminders")
+def backfill_next_reminders():
+    """Wylicz next_reminder_at dla istniejących klientów wszystkich użytkowników (jednorazowa migracja)"""
+    print(f"🔄 Rozpoczynanie wyliczania terminów przypomnień")
+
+    if not db:
+        print("❌ Firebase nie jest skonfigurowany")
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+
+    try:
+        clients_count = 0
+
+        for tenant_doc in db.collection(TENANTS_COLLECTION).stream():
+            updated = refresh_next_reminders(tenant_doc.id)
+            clients_count += updated
+            print(f"✅ Terminy przypomnień {tenant_doc.id}: {updated}")
+
+        print(f"✅ Terminy przypomnień wyliczone: {clients_count}")
+
+        return {
+            "message": "Terminy przypomnień wyliczone pomyślnie",
+            "clients_count": clients_count
+        }
+
+    except Exception as e:
+        print(f"❌ Błąd podczas wyliczania terminów przypomnień: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas wyliczania terminów przypomnień: {str(e)}")
+
 # Endpoint do tworzenia rekordu użytkownika po rejestracji
 class UserRegistrationData(BaseModel):
     username: str
@@ -1788,7 +4633,7 @@ class UserRegistrationResponse(BaseModel):
     permission: UserPermission
 
 @app.post("/register-user", response_model=UserRegistrationResponse)
-async def register_user(user_data: UserRegistrationData):
+def register_user(user_data: UserRegistrationData):
     """Utwórz rekord użytkownika w bazie danych po rejestracji"""
     print(f"👤 Rejestracja nowego użytkownika: {user_data.username}")
     print(f"📧 Email: {user_data.email}")
@@ -1807,6 +4652,10 @@ async def register_user(user_data: UserRegistrationData):
             # Pobierz istniejące uprawnienia
             settings_data = doc.to_dict()
             settings = UserSettings(**settings_data)
+            
+            # Upewnij się, że email jest w katalogu emaili
+            register_user_email(user_data.email, user_data.username, settings.permission)
+            
             return UserRegistrationResponse(
                 success=True,
                 message="Użytkownik już istnieje w bazie danych",
@@ -1846,6 +4695,12 @@ Dziękujemy!""",
         })
         
         doc_ref.set(settings_dict)
+        invalidate_tenant_settings(user_data.username)
+        sync_tenant_registry(user_data.username, settings_dict)
+        
+        # Zapisz email w katalogu emaili
+        register_user_email(user_data.email, user_data.username, UserPermission.DEMO)
+        
         print(f"✅ Użytkownik {user_data.username} zarejestrowany z uprawnieniami Demo")
         
         return UserRegistrationResponse(
@@ -1863,7 +4718,7 @@ Dziękujemy!""",
 
 # Endpointy dla formularza ocen
 @app.get("/review/{review_code}")
-async def get_review_form(review_code: str):
+def get_review_form(review_code: str):
     """Pobierz informacje o kliencie na podstawie kodu recenzji"""
     print(f"🔍 Wyszukiwanie klienta z kodem: {review_code}")
     
@@ -1872,157 +4727,53 @@ async def get_review_form(review_code: str):
         raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
     
     try:
-        # Najpierw sprawdź w kolekcji temp_clients
-        temp_clients_ref = db.collection("temp_clients")
-        temp_docs = temp_clients_ref.where("review_code", "==", review_code).stream()
+        # Znajdź klienta w indeksie kodów recenzji (jeden odczyt zamiast przeszukiwania kolekcji)
+        code_entry = find_review_code(review_code)
         
         found_client = None
-        found_collection = None
-        is_temp_client = False
-        
-        for doc in temp_docs:
-            found_client = doc.to_dict()
-            found_client["id"] = doc.id
-            is_temp_client = True
-            break
-        
-        # Jeśli nie znaleziono w temp_clients, szukaj w kolekcjach użytkowników
-        if not found_client:
-            collections = db.collections()
-            
-            for collection in collections:
-                collection_name = collection.id
-                # Pomiń kolekcje systemowe
-                if collection_name in ["Dane", "temp_clients"]:
-                    continue
-                    
-                docs = collection.where("review_code", "==", review_code).stream()
-                
-                for doc in docs:
-                    found_client = doc.to_dict()
-                    found_client["id"] = doc.id
-                    found_collection = collection_name
-                    break
-                
-                if found_client:
-                    break
+        if code_entry:
+            doc_ref = db.collection(code_entry["collection"]).document(code_entry["client_id"])
+            doc = doc_ref.get()
+            if doc.exists:
+                found_client = doc.to_dict()
+                found_client["id"] = doc.id
         
         if found_client:
             print(f"✅ Znaleziono klienta: {found_client['name']}")
+            is_temp_client = code_entry["is_temp_client"]
+            owner_username = code_entry["owner_username"]
             
             # Zaktualizuj status na "opened" (formularz został otwarty)
             if is_temp_client:
-                doc_ref = db.collection("temp_clients").document(found_client["id"])
                 doc_ref.update({
                     "status": "opened",
                     "updated_at": datetime.now()
                 })
             else:
-                # Znajdź kolekcję użytkownika
-                collections = db.collections()
-                for collection in collections:
-                    collection_name = collection.id
-                    if collection_name in ["Dane", "temp_clients"]:
-                        continue
-                    docs = collection.where("review_code", "==", review_code).stream()
-                    for doc in docs:
-                        doc_ref = db.collection(collection_name).document(doc.id)
-                        doc_ref.update({
-                            "review_status": "opened",
-                            "updated_at": datetime.now()
-                        })
-                        break
-                    if docs:
-                        break
+                doc_ref.update({
+                    "review_status": "opened",
+                    "updated_at": datetime.now()
+                })
             
-            # Pobierz ustawienia firmy (dla wszystkich klientów)
+            # Pobierz ustawienia firmy właściciela klienta
             company_name = "Twoja Firma"
             google_card = ""
             try:
-                print(f"🔍 Szukanie ustawień dla kodu: {review_code}")
-                print(f"🔍 Znaleziony klient: {found_client}")
-                print(f"🔍 Czy to temp_client: {is_temp_client}")
-                print(f"🔍 Kolekcja klienta: {found_collection}")
-                
-                # Jeśli klient jest w temp_clients, musimy znaleźć właściciela
-                if is_temp_client:
-                    print("🔍 Klient jest w temp_clients - szukam właściciela")
-                    # Sprawdź wszystkie kolekcje użytkowników
-                    collections = db.collections()
-                    for collection in collections:
-                        collection_name = collection.id
-                        if collection_name in ["Dane", "temp_clients"]:
-                            continue
-                        print(f"🔍 Sprawdzanie kolekcji użytkownika: {collection_name}")
-                        settings_doc = db.collection(collection_name).document("Dane").get()
-                        if settings_doc.exists:
-                            settings_data = settings_doc.to_dict()
-                            print(f"📋 Dane ustawień z kolekcji {collection_name}: {settings_data}")
-                            if "userData" in settings_data:
-                                user_data = settings_data["userData"]
-                                print(f"👤 Dane użytkownika z kolekcji {collection_name}: {user_data}")
-                                
-                                # Sprawdź czy userData ma zagnieżdżoną strukturę userData
-                                if "userData" in user_data:
-                                    nested_user_data = user_data["userData"]
-                                    print(f"👤 Zagnieżdżone dane użytkownika z kolekcji {collection_name}: {nested_user_data}")
-                                    if "companyName" in nested_user_data:
-                                        company_name = nested_user_data["companyName"]
-                                        print(f"🏢 Nazwa firmy z kolekcji {collection_name}: {company_name}")
-                                    if "googleCard" in nested_user_data:
-                                        google_card = nested_user_data["googleCard"]
-                                        print(f"🔗 Google Card (zagnieżdżone) z kolekcji {collection_name}: {google_card}")
-                                        print(f"🔗 Google Card type: {type(google_card)}")
-                                        print(f"🔗 Google Card length: {len(google_card) if google_card else 0}")
-                                        break  # Znaleziono ustawienia, przerwij pętlę
-                                else:
-                                    # Sprawdź bezpośrednio w userData
-                                    if "companyName" in user_data:
-                                        company_name = user_data["companyName"]
-                                        print(f"🏢 Nazwa firmy z kolekcji {collection_name}: {company_name}")
-                                    if "googleCard" in user_data:
-                                        google_card = user_data["googleCard"]
-                                        print(f"🔗 Google Card (bezpośrednie) z kolekcji {collection_name}: {google_card}")
-                                        print(f"🔗 Google Card type: {type(google_card)}")
-                                        print(f"🔗 Google Card length: {len(google_card) if google_card else 0}")
-                                        break  # Znaleziono ustawienia, przerwij pętlę
+                print(f"🔍 Szukanie ustawień właściciela: {owner_username} (temp_client: {is_temp_client})")
+                settings_data = get_tenant_settings(owner_username) if owner_username else None
+                if settings_data is not None:
+                    user_data = settings_data.get("userData", {})
+                    
+                    # Sprawdź czy userData ma zagnieżdżoną strukturę userData
+                    if "userData" in user_data:
+                        user_data = user_data["userData"]
+                    
+                    company_name = user_data.get("companyName", company_name)
+                    google_card = user_data.get("googleCard", google_card)
+                    print(f"🏢 Nazwa firmy: {company_name}")
+                    print(f"🔗 Google Card: {google_card}")
                 else:
-                    # Klient jest w kolekcji użytkownika
-                    print(f"🔍 Klient jest w kolekcji użytkownika: {found_collection}")
-                    settings_doc = db.collection(found_collection).document("Dane").get()
-                    if settings_doc.exists:
-                        settings_data = settings_doc.to_dict()
-                        print(f"📋 Dane ustawień z kolekcji {found_collection}: {settings_data}")
-                        if "userData" in settings_data:
-                            user_data = settings_data["userData"]
-                            print(f"👤 Dane użytkownika z kolekcji {found_collection}: {user_data}")
-                            
-                            # Sprawdź czy userData ma zagnieżdżoną strukturę userData
-                            if "userData" in user_data:
-                                nested_user_data = user_data["userData"]
-                                print(f"👤 Zagnieżdżone dane użytkownika z kolekcji {found_collection}: {nested_user_data}")
-                                if "companyName" in nested_user_data:
-                                    company_name = nested_user_data["companyName"]
-                                    print(f"🏢 Nazwa firmy z kolekcji {found_collection}: {company_name}")
-                                if "googleCard" in nested_user_data:
-                                    google_card = nested_user_data["googleCard"]
-                                    print(f"🔗 Google Card (zagnieżdżone) z kolekcji {found_collection}: {google_card}")
-                                    print(f"🔗 Google Card type: {type(google_card)}")
-                                    print(f"🔗 Google Card length: {len(google_card) if google_card else 0}")
-                            else:
-                                # Sprawdź bezpośrednio w userData
-                                if "companyName" in user_data:
-                                    company_name = user_data["companyName"]
-                                    print(f"🏢 Nazwa firmy z kolekcji {found_collection}: {company_name}")
-                                if "googleCard" in user_data:
-                                    google_card = user_data["googleCard"]
-                                    print(f"🔗 Google Card (bezpośrednie) z kolekcji {found_collection}: {google_card}")
-                                    print(f"🔗 Google Card type: {type(google_card)}")
-                                    print(f"🔗 Google Card length: {len(google_card) if google_card else 0}")
-                        else:
-                            print("⚠️ Brak userData w ustawieniach")
-                    else:
-                        print(f"⚠️ Dokument 'Dane' nie istnieje w kolekcji {found_collection}")
+                    print(f"⚠️ Dokument 'Dane' nie istnieje dla właściciela {owner_username}")
             except Exception as e:
                 print(f"⚠️ Nie można pobrać ustawień firmy: {e}")
             
@@ -2054,7 +4805,7 @@ async def get_review_form(review_code: str):
         raise HTTPException(status_code=500, detail=f"Błąd podczas wyszukiwania kodu recenzji: {str(e)}")
 
 @app.post("/review/{review_code}", response_model=ReviewResponse)
-async def submit_review(review_code: str, review_data: ReviewSubmission):
+def submit_review(review_code: str, review_data: ReviewSubmission):
     """Zapisz ocenę klienta"""
     start_time = datetime.now()
     print(f"⭐ Otrzymano ocenę dla kodu: {review_code}")
@@ -2071,84 +4822,29 @@ async def submit_review(review_code: str, review_data: ReviewSubmission):
             raise HTTPException(status_code=400, detail="Ocena musi być między 1 a 5 gwiazdkami")
         
         # Znajdź klienta po kodzie recenzji
-        found_client = None
-        found_collection = None
-        is_temp_client = False
-        
-        # Najpierw sprawdź w kolekcji temp_clients
-        print("🔍 Szukanie w temp_clients...")
-        temp_clients_ref = db.collection("temp_clients")
-        temp_docs = temp_clients_ref.where("review_code", "==", review_code).limit(1).stream()
-        
-        for doc in temp_docs:
-            found_client = doc.to_dict()
-            found_client["id"] = doc.id
-            is_temp_client = True
-            break
-        
-        # Jeśli nie znaleziono w temp_clients, szukaj w kolekcjach użytkowników
-        if not found_client:
-            # Zoptymalizowane wyszukiwanie - najpierw spróbuj znaleźć po typowym wzorcu username
-            # Username to email z zamienionymi @ na _at_ i . na _
-            potential_usernames = []
-            
-            # Jeśli review_code zawiera informacje o użytkowniku, spróbuj je wyodrębnić
-            # Na razie przeszukaj tylko kilka najczęściej używanych kolekcji
-            # TODO: W przyszłości można dodać mapowanie review_code -> username
-            common_collections = []  # Pusty na razie, żeby nie marnować czasu
-            
-            for collection_name in common_collections:
-                try:
-                    collection_ref = db.collection(collection_name)
-                    docs = collection_ref.where("review_code", "==", review_code).limit(1).stream()
-                    
-                    for doc in docs:
-                        found_client = doc.to_dict()
-                        found_client["id"] = doc.id
-                        found_collection = collection_name
-                        break
-                    
-                    if found_client:
-                        break
-                except Exception as e:
-                    print(f"⚠️ Błąd przeszukiwania kolekcji {collection_name}: {e}")
-                    continue
-            
-            # Jeśli nadal nie znaleziono, użyj pełnego przeszukiwania (wolne)
-            if not found_client:
-                print("🔍 Uruchamianie pełnego przeszukiwania kolekcji...")
-                collections = db.collections()
-                
-                for collection in collections:
-                    collection_name = collection.id
-                    if collection_name in ["Dane", "temp_clients", "notifications"]:
-                        continue
-                        
-                    try:
-                        docs = collection.where("review_code", "==", review_code).limit(1).stream()
-                        
-                        for doc in docs:
-                            found_client = doc.to_dict()
-                            found_client["id"] = doc.id
-                            found_collection = collection_name
-                            break
-                        
-                        if found_client:
-                            break
-                    except Exception as e:
-                        print(f"⚠️ Błąd przeszukiwania kolekcji {collection_name}: {e}")
-                        continue
+        found_client = None
+        is_temp_client = False
+        
+        # Znajdź klienta w indeksie kodów recenzji (jeden odczyt zamiast przeszukiwania kolekcji)
+        code_entry = find_review_code(review_code)
+        
+        if code_entry:
+            doc_ref = db.collection(code_entry["collection"]).document(code_entry["client_id"])
+            doc = doc_ref.get()
+            if doc.exists:
+                found_client = doc.to_dict()
+                found_client["id"] = doc.id
+                is_temp_client = code_entry["is_temp_client"]
         
         if not found_client:
             print(f"❌ Nie znaleziono klienta z kodem: {review_code}")
             raise HTTPException(status_code=404, detail="Kod recenzji nie został znaleziony")
         
         # Zaktualizuj dane klienta z nową recenzją
-        owner_username = None
+        owner_username = code_entry["owner_username"]
         
         if is_temp_client:
             # Dla tymczasowych klientów
-            doc_ref = db.collection("temp_clients").document(found_client["id"])
             doc_ref.update({
                 "stars": review_data.stars,
                 "review": review_data.review,
@@ -2156,24 +4852,16 @@ async def submit_review(review_code: str, review_data: ReviewSubmission):
                 "updated_at": datetime.now()
             })
             print(f"✅ Zaktualizowano tymczasowego klienta: {found_client['id']}")
-            
-            # Pobierz właściciela z danych klienta tymczasowego
-            owner_username = found_client.get("owner_username")
         else:
-            # Dla stałych klientów - użyj zapisanej nazwy kolekcji
-            if found_collection:
-                doc_ref = db.collection(found_collection).document(found_client["id"])
-                doc_ref.update({
-                    "stars": review_data.stars,
-                    "review": review_data.review,
-                    "review_status": "completed",
-                    "updated_at": datetime.now()
-                })
-                print(f"✅ Zaktualizowano klienta w kolekcji {found_collection}: {found_client['id']}")
-                owner_username = found_collection
-            else:
-                print(f"⚠️ Nie znaleziono kolekcji dla klienta")
-                raise HTTPException(status_code=500, detail="Nie można zaktualizować klienta")
+            # Dla stałych klientów
+            doc_ref.update({
+                "stars": review_data.stars,
+                "review": review_data.review,
+                "review_status": "completed",
+                "next_reminder_at": None,
+                "updated_at": datetime.now()
+            })
+            print(f"✅ Zaktualizowano klienta w kolekcji {owner_username}: {found_client['id']}")
         
         print(f"✅ Ocena zapisana: {review_data.stars} gwiazdek dla {found_client['name']}")
         print(f"💬 Recenzja: {review_data.review}")
@@ -2184,9 +4872,8 @@ async def submit_review(review_code: str, review_data: ReviewSubmission):
             owner_email = None
             if owner_username:
                 # Pobierz email z ustawień użytkownika
-                settings_doc = db.collection(owner_username).document("Dane").get()
-                if settings_doc.exists:
-                    settings_data = settings_doc.to_dict()
+                settings_data = get_tenant_settings(owner_username)
+                if settings_data is not None:
                     owner_email = settings_data.get("userData", {}).get("email", "")
             
             if owner_email:
@@ -2232,9 +4919,8 @@ async def submit_review(review_code: str, review_data: ReviewSubmission):
                     # Pobierz nazwę firmy z ustawień
                     company_name = "Twoja Firma"
                     if owner_username:
-                        settings_doc = db.collection(owner_username).document("Dane").get()
-                        if settings_doc.exists:
-                            settings_data = settings_doc.to_dict()
+                        settings_data = get_tenant_settings(owner_username)
+                        if settings_data is not None:
                             user_data = settings_data.get("userData", {})
                             if "userData" in user_data:
                                 nested_user_data = user_data["userData"]
@@ -2287,7 +4973,7 @@ async def submit_review(review_code: str, review_data: ReviewSubmission):
 
 # Endpointy dla kodów QR
 @app.post("/qrcode/{username}", response_model=QRCodeResponse)
-async def generate_company_qr_code(username: str, request: QRCodeRequest):
+def generate_company_qr_code(username: str, request: QRCodeRequest):
     """Generuj jeden kod QR dla firmy użytkownika"""
     print(f"🔲 Generowanie kodu QR dla firmy: {username}")
     print(f"📏 Żądany rozmiar: {request.size}px")
@@ -2299,13 +4985,14 @@ async def generate_company_qr_code(username: str, request: QRCodeRequest):
         # Walidacja rozmiaru
         if request.size < 50 or request.size > 1000:
             raise HTTPException(status_code=400, detail="Rozmiar kodu QR musi być między 50 a 1000 pikseli")
+        if request.format not in QR_RENDERERS:
+            raise HTTPException(status_code=400, detail="Nieobsługiwany format kodu QR (dostępne: png, svg)")
         
         # Pobierz ustawienia firmy
         company_name = "Twoja Firma"
         try:
-            settings_doc = db.collection(username).document("Dane").get()
-            if settings_doc.exists:
-                settings_data = settings_doc.to_dict()
+            settings_data = get_tenant_settings(username)
+            if settings_data is not None:
                 if "userData" in settings_data and "companyName" in settings_data["userData"]:
                     company_name = settings_data["userData"]["companyName"]
         except Exception as e:
@@ -2315,9 +5002,9 @@ async def generate_company_qr_code(username: str, request: QRCodeRequest):
         base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
         client_login_url = f"{base_url}/client-login/{username}"
         
-        # Generuj kod QR z lepszą konfiguracją
-        qr_data = generate_qr_code(client_login_url, request.size)
-        qr_base64 = f"data:image/png;base64,{base64.b64encode(qr_data).decode()}"
+        # Generuj kod QR (lub pobierz z cache)
+        qr_data, _ = get_qr_code_bytes(client_login_url, request.size, request.format)
+        qr_base64 = f"data:{QR_RENDERERS[request.format][1]};base64,{base64.b64encode(qr_data).decode()}"
         
         print(f"✅ Wygenerowano kod QR dla firmy: {company_name} (rozmiar: {request.size}px)")
         return QRCodeResponse(
@@ -2336,8 +5023,9 @@ async def generate_company_qr_code(username: str, request: QRCodeRequest):
 
 
 @app.get("/qrcode/{review_code}")
-async def get_qr_code_image(review_code: str, size: int = 200):
-    """Pobierz kod QR jako obraz dla konkretnego kodu recenzji"""
+def get_qr_code_image(review_code: str, size: int = 200, format: str = "png",
+                      if_none_match: Optional[str] = Header(None)):
+    """Pobierz kod QR jako obraz dla konkretnego kodu recenzji (304 Not Modified dla pasującego ETag)"""
     print(f"🔲 Generowanie kodu QR dla: {review_code}")
     print(f"📏 Żądany rozmiar: {size}px")
     
@@ -2345,22 +5033,29 @@ async def get_qr_code_image(review_code: str, size: int = 200):
         # Walidacja rozmiaru
         if size < 50 or size > 1000:
             raise HTTPException(status_code=400, detail="Rozmiar kodu QR musi być między 50 a 1000 pikseli")
+        if format not in QR_RENDERERS:
+            raise HTTPException(status_code=400, detail="Nieobsługiwany format kodu QR (dostępne: png, svg)")
         
         # Generuj URL do formularza recenzji
         # Użyj zmiennej środowiskowej lub domyślnego localhost
         base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
         review_url = f"{base_url}/review/{review_code}"
         
-        # Generuj kod QR z lepszą konfiguracją
-        qr_data = generate_qr_code(review_url, size)
+        # Generuj kod QR (lub pobierz z cache)
+        qr_data, etag = get_qr_code_bytes(review_url, size, format)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "public, max-age=3600"  # Cache na 1 godzinę
+        }
         
-        return StreamingResponse(
-            io.BytesIO(qr_data),
-            media_type="image/png",
-            headers={
-                "Content-Disposition": f"inline; filename=qr_{review_code}.png",
-                "Cache-Control": "public, max-age=3600"  # Cache na 1 godzinę
-            }
+        # Przeglądarka ma aktualną wersję - nie wysyłaj obrazu ponownie
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        
+        return Response(
+            content=qr_data,
+            media_type=QR_RENDERERS[format][1],
+            headers={**headers, "Content-Disposition": f"inline; filename=qr_{review_code}.{format}"}
         )
         
     except HTTPException:
@@ -2369,9 +5064,52 @@ async def get_qr_code_image(review_code: str, size: int = 200):
         print(f"❌ Błąd podczas generowania kodu QR: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Błąd podczas generowania kodu QR: {str(e)}")
 
+# Endpoint eksportu kodów QR wszystkich klientów użytkownika
+@app.get("/qrcode-export/{username}")
+async def export_qr_codes(username: str, format: str = "zip", size: int = 300):
+    """Pobierz kody QR wszystkich klientów jako ZIP z plikami PNG lub arkusz PDF do druku"""
+    print(f"🔲 Eksport kodów QR dla użytkownika: {username} (format: {format}, rozmiar: {size}px)")
+    
+    if not db:
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+    
+    try:
+        if size < 50 or size > 1000:
+            raise HTTPException(status_code=400, detail="Rozmiar kodu QR musi być między 50 a 1000 pikseli")
+        if format not in ["zip", "pdf"]:
+            raise HTTPException(status_code=400, detail="Nieobsługiwany format eksportu (dostępne: zip, pdf)")
+        
+        if await run_in_threadpool(get_tenant_settings, username) is None:
+            raise HTTPException(status_code=404, detail="Użytkownik nie został znaleziony")
+        
+        async with tenant_reads_bulkhead.slot(username):
+            items = await run_in_threadpool(list_qr_export_items, username)
+        if not items:
+            raise HTTPException(status_code=404, detail="Brak klientów z kodem recenzji")
+        
+        print(f"📦 Eksport {len(items)} kodów QR ({format})")
+        if format == "zip":
+            content, media_type = stream_qr_export_zip(items, size), "application/zip"
+        else:
+            content, media_type = stream_qr_export_pdf(items, size), "application/pdf"
+        
+        return StreamingResponse(
+            content,
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename=qr_{username}.{format}"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Błąd podczas eksportu kodów QR: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas eksportu kodów QR: {str(e)}")
+
 # Endpoint do logowania klienta
 @app.post("/client-login/{username}", response_model=ClientLoginResponse)
-async def client_login(username: str, client_data: ClientLoginRequest):
+def client_login(username: str, client_data: ClientLoginRequest):
     """Zapisz dane klienta i wygeneruj kod recenzji dla konkretnego użytkownika"""
     print(f"👤 Logowanie klienta: {client_data.name} dla użytkownika: {username}")
     
@@ -2400,11 +5138,16 @@ async def client_login(username: str, client_data: ClientLoginRequest):
             "sms_count": 0,
             "source": "QR"
         }
+        client_data_dict["next_reminder_at"] = compute_next_reminder_at(client_data_dict, get_reminder_frequency(username))
         
         # Dodaj do kolekcji użytkownika
         user_clients_ref = db.collection(username)
         doc_ref = user_clients_ref.add(client_data_dict)[1]
         
+        # Zapisz kod recenzji w indeksie i zwiększ licznik klientów w rejestrze
+        register_review_code(review_code, username, doc_ref.id)
+        increment_tenant_counter(username, "clientsCount")
+        
         print(f"✅ Klient zapisany z kodem: {review_code} dla użytkownika: {username}")
         
         return ClientLoginResponse(
@@ -2429,13 +5172,13 @@ async def send_sms_to_client(username: str, client_id: str):
     
     try:
         # Pobierz konfigurację Twilio dla użytkownika
-        twilio_config = get_twilio_client_for_user(username)
+        twilio_config = await run_in_threadpool(get_twilio_client_for_user, username)
         if not twilio_config:
             raise HTTPException(status_code=400, detail="Twilio nie jest skonfigurowany dla tego użytkownika")
         
         # Pobierz dane klienta
         doc_ref = db.collection(username).document(client_id)
-        doc = doc_ref.get()
+        doc = await run_in_threadpool(doc_ref.get)
         
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Klient nie został znaleziony")
@@ -2456,7 +5199,7 @@ async def send_sms_to_client(username: str, client_id: str):
             raise HTTPException(status_code=400, detail="Klient nie ma kodu recenzji")
         
         # Pobierz ustawienia użytkownika (szablon wiadomości)
-        settings_doc = db.collection(username).document("Dane").get()
+        settings_data = await run_in_threadpool(get_tenant_settings, username)
         message_template = """Dzień dobry!
 
 Chciałbym przypomnieć o możliwości wystawienia opinii o naszych usługach. 
@@ -2471,8 +5214,7 @@ Z poważaniem,
         
         company_name = "Twoja Firma"
         
-        if settings_doc.exists:
-            settings_data = settings_doc.to_dict()
+        if settings_data is not None:
             if "messaging" in settings_data and "messageTemplate" in settings_data["messaging"]:
                 message_template = settings_data["messaging"]["messageTemplate"]
             if "userData" in settings_data and "companyName" in settings_data["userData"]:
@@ -2490,21 +5232,35 @@ Z poważaniem,
             .replace("[KLIENT]", client_name or "")
         )
         
-        # Wyślij SMS
-        result = await send_sms(client_phone, message, twilio_config, username)
+        # Sprawdź limit SMS przed dodaniem do kolejki (ostateczna rezerwacja następuje przy wysyłce)
+        limit_check = await run_in_threadpool(check_sms_limit, username)
+        if not limit_check["allowed"]:
+            raise HTTPException(status_code=429, detail=limit_check["message"])
         
-        # Zaktualizuj status klienta
-        now = datetime.now()
-        doc_ref.update({
-            "review_status": "sent",
-            "last_sms_sent": now,
-            "updated_at": now,
-            "sms_count": sms_count + 1
-        })
+        # Dodaj SMS do kolejki - worker wyśle go i zaktualizuje status klienta
+        queued = await run_in_threadpool(
+            enqueue_sms,
+            client_sms_idempotency_key(username, client_id, sms_count),
+            username,
+            client_phone,
+            message,
+            {
+                "client_id": client_id,
+                "name": client_name,
+                "review_status": client_data.get("review_status", "not_sent"),
+                "sms_count": sms_count
+            },
+            "interactive"
+        )
         
-        print(f"✅ SMS wysłany do {client_name} ({client_phone})")
+        print(f"✅ SMS do {client_name} ({client_phone}) dodany do kolejki")
         
-        return SMSResponse(**result)
+        return SMSResponse(
+            success=True,
+            message="SMS został dodany do kolejki wysyłki",
+            sid=queued.get("sid"),
+            queue_id=queued["id"]
+        )
         
     except HTTPException:
         raise
@@ -2525,7 +5281,7 @@ async def send_sms_direct(username: str, sms_request: SMSRequest):
     
     try:
         # Pobierz konfigurację Twilio dla użytkownika
-        twilio_config = get_twilio_client_for_user(username)
+        twilio_config = await run_in_threadpool(get_twilio_client_for_user, username)
         if not twilio_config:
             raise HTTPException(status_code=400, detail="Twilio nie jest skonfigurowany dla tego użytkownika")
         
@@ -2540,27 +5296,52 @@ async def send_sms_direct(username: str, sms_request: SMSRequest):
 
 # Endpoint do ręcznego uruchomienia procesu wysyłania przypomnień
 @app.post("/reminders/send-now")
-async def send_reminders_now():
-    """Ręcznie uruchom proces wysyłania przypomnień SMS"""
+async def send_reminders_now(shard: Optional[int] = None):
+    """Ręcznie uruchom proces wysyłania przypomnień SMS (opcjonalnie tylko dla jednego sharda)"""
     print("🚀 Ręczne uruchomienie procesu wysyłania przypomnień")
     
     try:
-        result = await check_and_send_reminders()
+        if shard is not None and not 0 <= shard < REMINDER_SHARDS:
+            raise HTTPException(status_code=400, detail=f"Nieprawidłowy shard (dostępne: 0-{REMINDER_SHARDS - 1})")
+        result = await check_and_send_reminders(None if shard is None else {shard})
         return {
             "success": True,
             "message": "Proces wysyłania przypomnień zakończony",
             "timestamp": datetime.now().isoformat(),
             "result": result
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Błąd podczas ręcznego wysyłania przypomnień: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Błąd podczas wysyłania przypomnień: {str(e)}")
 
+# Endpoint planera przypomnień (dry-run - nic nie jest wysyłane)
+@app.get("/reminders/plan")
+def get_reminders_plan(hours: int = 24, username: Optional[str] = None, refresh: bool = False):
+    """Przewidywany plan wysyłki przypomnień: kto, kiedy i jakim szablonem, z obciążeniem i limitami SMS"""
+    print(f"🗓️ Plan przypomnień na {hours} godz.{f' dla {username}' if username else ''}")
+    
+    if not db:
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+    
+    try:
+        if not 1 <= hours <= REMINDER_PLAN_MAX_HOURS:
+            raise HTTPException(status_code=400, detail=f"Horyzont planu musi wynosić od 1 do {REMINDER_PLAN_MAX_HOURS} godzin")
+        return get_reminder_plan(hours, username, refresh)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Błąd podczas planowania przypomnień: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Błąd podczas planowania przypomnień: {str(e)}")
+
 # Endpoint do testowania wysyłania przypomnień dla konkretnego użytkownika
 @app.post("/reminders/test/{username}")
-async def test_reminders_for_user(username: str):
+def test_reminders_for_user(username: str):
     """Test wysyłania przypomnień dla konkretnego użytkownika"""
     print(f"🧪 Test wysyłania przypomnień dla użytkownika: {username}")
     
@@ -2569,11 +5350,10 @@ async def test_reminders_for_user(username: str):
     
     try:
         # Sprawdź ustawienia użytkownika
-        settings_doc = db.collection(username).document("Dane").get()
-        if not settings_doc.exists:
+        settings_data = get_tenant_settings(username)
+        if settings_data is None:
             raise HTTPException(status_code=404, detail="Użytkownik nie został znaleziony")
         
-        settings_data = settings_doc.to_dict()
         auto_send_enabled = False
         reminder_frequency = 7
         
@@ -2621,7 +5401,7 @@ async def test_reminders_for_user(username: str):
 
 # Endpoint do wysyłania wiadomości do wszystkich klientów użytkownika (testowy)
 @app.get("/sms-limit/{username}")
-async def get_sms_limit(username: str):
+def get_sms_limit(username: str):
     """Sprawdź limit SMS dla użytkownika"""
     try:
         limit_info = check_sms_limit(username)
@@ -2637,23 +5417,12 @@ async def get_sms_limit(username: str):
         print(f"❌ Błąd podczas sprawdzania limitu SMS: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Błąd sprawdzania limitu: {str(e)}")
 
-@app.post("/send-sms-all/{username}")
-async def send_sms_to_all_clients(username: str):
-    """Wyślij SMS do wszystkich klientów użytkownika o statusie recenzji różnym od 'completed'"""
-    print(f"📱 Wysyłanie SMS do wszystkich klientów użytkownika: {username}")
-    
-    if not db:
-        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
-    
-    try:
-        # Pobierz konfigurację Twilio dla użytkownika
-        twilio_config = get_twilio_client_for_user(username)
-        if not twilio_config:
-            raise HTTPException(status_code=400, detail="Twilio nie jest skonfigurowany dla tego użytkownika")
-        
-        # Pobierz ustawienia użytkownika (szablon wiadomości)
-        settings_doc = db.collection(username).document("Dane").get()
-        message_template = """Dzień dobry!
+# Wysyłka SMS do wszystkich klientów - wykonywana w tle jako zadanie (job)
+async def run_send_sms_all_job(job_id: str, username: str) -> dict:
+    """Dodaj do kolejki SMS do wszystkich klientów użytkownika; postęp raportują workery w zadaniu job_id"""
+    # Pobierz ustawienia użytkownika (szablon wiadomości)
+    settings_data = await run_in_threadpool(get_tenant_settings, username)
+    message_template = """Dzień dobry!
 
 Chciałbym przypomnieć o możliwości wystawienia opinii o naszych usługach. 
 Wasza opinia jest dla nas bardzo ważna i pomoże innym klientom w podjęciu decyzji.
@@ -2664,115 +5433,193 @@ Z góry dziękuję za poświęcony czas!
 
 Z poważaniem,
 [NAZWA_FIRMY]"""
+    
+    company_name = "Twoja Firma"
+    
+    if settings_data is not None:
+        if "messaging" in settings_data and "messageTemplate" in settings_data["messaging"]:
+            message_template = settings_data["messaging"]["messageTemplate"]
+        if "userData" in settings_data and "companyName" in settings_data["userData"]:
+            company_name = settings_data["userData"]["companyName"]
+    
+    # Pobierz wszystkich klientów użytkownika (pomijamy dokument "Dane")
+    clients_collection = db.collection(username)
+    docs = await run_in_threadpool(lambda: list(clients_collection.stream()))
+    
+    clients_to_send = []
+    errors = []
+    
+    # Przygotuj listę klientów do wysłania
+    for doc in docs:
+        # Pomiń dokument "Dane"
+        if doc.id == "Dane":
+            continue
         
-        company_name = "Twoja Firma"
+        client_data = doc.to_dict()
+        client_id = doc.id
         
-        if settings_doc.exists:
-            settings_data = settings_doc.to_dict()
-            if "messaging" in settings_data and "messageTemplate" in settings_data["messaging"]:
-                message_template = settings_data["messaging"]["messageTemplate"]
-            if "userData" in settings_data and "companyName" in settings_data["userData"]:
-                company_name = settings_data["userData"]["companyName"]
+        # Sprawdź warunki wysyłki
+        review_status = client_data.get("review_status", "not_sent")
+        phone = client_data.get("phone", "")
+        review_code = client_data.get("review_code", "")
+        client_name = client_data.get("name", "")
+        sms_count = client_data.get("sms_count", 0)
         
-        # Pobierz wszystkich klientów użytkownika (pomijamy dokument "Dane")
-        clients_collection = db.collection(username)
-        docs = clients_collection.stream()
+        # Pomiń klientów bez numeru telefonu lub kodu recenzji
+        if not phone or not review_code:
+            continue
         
-        clients_to_send = []
-        total_sent = 0
-        errors = []
+        # Pomiń klientów którzy już ukończyli recenzję
+        if review_status == "completed":
+            continue
         
-        # Przygotuj listę klientów do wysłania
-        for doc in docs:
-            # Pomiń dokument "Dane"
-            if doc.id == "Dane":
-                continue
-            
-            client_data = doc.to_dict()
-            client_id = doc.id
-            
-            # Sprawdź warunki wysyłki
-            review_status = client_data.get("review_status", "not_sent")
-            phone = client_data.get("phone", "")
-            review_code = client_data.get("review_code", "")
-            client_name = client_data.get("name", "")
-            sms_count = client_data.get("sms_count", 0)
-            
-            # Pomiń klientów bez numeru telefonu lub kodu recenzji
-            if not phone or not review_code:
-                continue
-            
-            # Pomiń klientów którzy już ukończyli recenzję
-            if review_status == "completed":
-                continue
-            
-            # Pomiń klientów którzy osiągnęli limit SMS
-            if sms_count >= 2:
-                continue
-            
-            clients_to_send.append({
-                "id": client_id,
-                "name": client_name,
-                "phone": phone,
-                "review_code": review_code,
-                "review_status": review_status
-            })
+        # Pomiń klientów którzy osiągnęli limit SMS
+        if sms_count >= 2:
+            continue
         
-        print(f"📊 Znaleziono {len(clients_to_send)} klientów do wysłania SMS")
+        clients_to_send.append({
+            "id": client_id,
+            "name": client_name,
+            "phone": phone,
+            "review_code": review_code,
+            "review_status": review_status,
+            "sms_count": sms_count
+        })
+    
+    print(f"📊 Znaleziono {len(clients_to_send)} klientów do wysłania SMS")
+    await run_in_threadpool(update_bulk_job, job_id, total=len(clients_to_send), queued=len(clients_to_send))
+    
+    if not clients_to_send:
+        return {
+            "success": True,
+            "message": "Proces wysyłania zakończony. Wysłano 0 z 0 klientów",
+            "total_found": 0,
+            "sent": 0,
+            "errors": errors,
+            "results": []
+        }
+    
+    # Zarezerwuj limit SMS dla całej wysyłki z góry (atomowo)
+    reservation = await run_in_threadpool(reserve_sms_quota, username, len(clients_to_send))
+    granted = reservation["granted"]
+    results = []
+    for client in clients_to_send[granted:]:
+        skip_reason = f"Przekroczono limit SMS ({reservation['limit']})" if "limit" in reservation else reservation["message"]
+        errors.append(f"Pominięto {client['name']}: {skip_reason}")
+        results.append({
+            "client_id": client["id"],
+            "name": client["name"],
+            "phone": client["phone"],
+            "status": "skipped",
+            "error": skip_reason
+        })
+    await run_in_threadpool(update_bulk_job, job_id, queued=granted, skipped=len(clients_to_send) - granted)
+    
+    if not granted:
+        return {
+            "success": False,
+            "message": reservation["message"],
+            "total_found": len(clients_to_send),
+            "sent": 0,
+            "errors": errors,
+            "results": results
+        }
+    
+    # Przygotuj wiadomości dla klientów w ramach zarezerwowanego limitu
+    base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
+    messages = []
+    for client in clients_to_send[:granted]:
+        # Generuj URL do formularza recenzji
+        review_url = f"{base_url}/review/{client['review_code']}"
         
-        # Wyślij SMS do każdego klienta
-        for client in clients_to_send:
-            try:
-                # Generuj URL do formularza recenzji
-                base_url = os.getenv("FRONTEND_URL", "https://next-reviews-booster-app.web.app")
-                review_url = f"{base_url}/review/{client['review_code']}"
-                
-                # Przygotuj wiadomość SMS (podstaw zmienne)
-                message = (
-                    message_template
-                    .replace("[LINK]", review_url)
-                    .replace("[NAZWA_FIRMY]", company_name or "")
-                    .replace("[KLIENT]", client['name'] or "")
-                )
-                
-                # Wyślij SMS
-                print(f"📱 Wysyłanie SMS do: {client['name']} ({client['phone']})")
-                result = await send_sms(client['phone'], message, twilio_config, username)
-                
-                # Zaktualizuj status klienta
-                now = datetime.now()
-                doc_ref = db.collection(username).document(client['id'])
-                current_client = doc_ref.get()
-                current_data = current_client.to_dict()
-                current_sms_count = current_data.get("sms_count", 0)
-                
-                update_data = {
-                    "last_sms_sent": now,
-                    "updated_at": now,
-                    "sms_count": current_sms_count + 1
-                }
-                
-                # Jeśli to pierwszy SMS, zmień status na "sent"
-                if client['review_status'] == "not_sent":
-                    update_data["review_status"] = "sent"
-                
-                doc_ref.update(update_data)
-                
-                total_sent += 1
-                print(f"✅ SMS wysłany do: {client['name']}")
-                
-            except Exception as sms_error:
-                error_msg = f"Błąd wysyłania SMS do {client['name']}: {str(sms_error)}"
-                print(f"❌ {error_msg}")
-                errors.append(error_msg)
-                continue
+        # Przygotuj wiadomość SMS (podstaw zmienne)
+        message = (
+            message_template
+            .replace("[LINK]", review_url)
+            .replace("[NAZWA_FIRMY]", company_name or "")
+            .replace("[KLIENT]", client['name'] or "")
+        )
+        messages.append({
+            "client_id": client["id"],
+            "name": client["name"],
+            "phone": client["phone"],
+            "message": message,
+            "review_status": client["review_status"],
+            "sms_count": client["sms_count"]
+        })
+    
+    # Dodaj wiadomości do kolejki - workery wyślą je i zaktualizują postęp zadania
+    duplicates = 0
+    try:
+        for item in messages:
+            queued = await run_in_threadpool(
+                enqueue_sms,
+                client_sms_idempotency_key(username, item["client_id"], item["sms_count"]),
+                username,
+                item["phone"],
+                item["message"],
+                {
+                    "client_id": item["client_id"],
+                    "name": item["name"],
+                    "review_status": item["review_status"],
+                    "sms_count": item["sms_count"],
+                    "job_id": job_id,
+                    "quota_reserved": True,
+                    "quota_month": reservation["month"]
+                },
+                "bulk"
+            )
+            if not queued["created"]:
+                # Ta wiadomość jest już w kolejce (np. z wcześniejszej wysyłki) - nie wysyłamy jej drugi raz
+                duplicates += 1
+                await record_bulk_job_result(job_id, {
+                    "client_id": item["client_id"],
+                    "name": item["name"],
+                    "phone": item["phone"],
+                    "status": "skipped",
+                    "error": "SMS do tego klienta jest już w kolejce"
+                })
+    finally:
+        # Zwolnij limit zarezerwowany dla wiadomości, które nie trafiły do kolejki
+        await run_in_threadpool(release_sms_quota, username, reservation["month"], duplicates)
+    
+    print(f"📥 Dodano {granted - duplicates} SMS do kolejki dla użytkownika {username}")
+    
+    return {
+        "success": True,
+        "message": f"Dodano do kolejki {granted - duplicates} z {len(clients_to_send)} SMS",
+        "total_found": len(clients_to_send),
+        "queued": granted - duplicates,
+        "errors": errors,
+        "results": results
+    }
+
+@app.post("/send-sms-all/{username}")
+async def send_sms_to_all_clients(username: str):
+    """Zleć wysyłkę SMS do wszystkich klientów o statusie recenzji różnym od 'completed'
+    
+    Wysyłka odbywa się w tle - endpoint zwraca od razu job_id, a postęp
+    można sprawdzać przez GET /jobs/{job_id}.
+    """
+    print(f"📱 Wysyłanie SMS do wszystkich klientów użytkownika: {username}")
+    
+    if not db:
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+    
+    try:
+        # Pobierz konfigurację Twilio dla użytkownika
+        twilio_config = await run_in_threadpool(get_twilio_client_for_user, username)
+        if not twilio_config:
+            raise HTTPException(status_code=400, detail="Twilio nie jest skonfigurowany dla tego użytkownika")
+        
+        job = await run_in_threadpool(create_bulk_job, username, "send_sms_all")
+        start_bulk_job(job["job_id"], run_send_sms_all_job(job["job_id"], username))
         
         return {
             "success": True,
-            "message": f"Proces wysyłania zakończony. Wysłano {total_sent} z {len(clients_to_send)} klientów",
-            "total_found": len(clients_to_send),
-            "sent": total_sent,
-            "errors": errors
+            "message": "Wysyłka SMS została zlecona",
+            "job_id": job["job_id"],
+            "status": job["status"]
         }
         
     except HTTPException:
@@ -2783,6 +5630,22 @@ Z poważaniem,
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Błąd podczas wysyłania SMS: {str(e)}")
 
+# Endpoint do sprawdzania postępu zadania w tle
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    """Pobierz status i postęp zadania (queued, sent, failed, skipped)"""
+    if not db:
+        raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
+    
+    job = get_bulk_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Zadanie nie zostało znalezione")
+    
+    # Szczegółowe wyniki zwracamy dopiero po zakończeniu zadania - odpytywanie w trakcie jest tanie
+    if job["status"] not in BULK_JOB_FINISHED_STATUSES:
+        job.pop("results", None)
+    return job
+
 # Endpoint dla Twilio StatusCallback
 @app.post("/twilio/delivery-status")
 async def twilio_delivery_status(request: dict):
@@ -2795,20 +5658,22 @@ async def twilio_delivery_status(request: dict):
 async def get_reminders_status():
     """Sprawdź status schedulera przypomnień"""
     try:
-        jobs = scheduler.get_jobs()
-        job_info = []
-        
-        for job in jobs:
-            job_info.append({
-                "id": job.id,
-                "name": job.name,
-                "next_run": job.next_run_time.isoformat() if job.next_run_time else None,
-                "trigger": str(job.trigger)
-            })
-        
         return {
-            "scheduler_running": scheduler.running,
-            "jobs": job_info
+            "scheduler_running": reminder_scheduler.running,
+            "instance": scheduler_holder_id,
+            "shards": {
+                "total": REMINDER_SHARDS,
+                "owned": sorted(_scheduler_leadership["shards"]),
+                "holders": await run_in_threadpool(scheduler_shard_holders)
+            },
+            "jobs": reminder_scheduler.status(),
+            "runs": reminder_telemetry.recent(),
+            "send_timeline": {
+                "spread_minutes": REMINDER_SPREAD_MINUTES,
+                "sender_mps": REMINDER_SENDER_MPS,
+                "pending_by_minute": await run_in_threadpool(sms_outbox.pending_timeline, "scheduled"),
+                "recent_plans": reminder_spreader.recent_plans()
+            }
         }
     except Exception as e:
         print(f"❌ Błąd podczas sprawdzania statusu schedulera: {str(e)}")
@@ -2857,6 +5722,11 @@ async def submit_contact_form(contact_data: ContactFormRequest):
 # Endpoint do pobierania statystyk użytkownika
 @app.get("/statistics/{username}")
 async def get_user_statistics(username: str):
+    """Pobierz statystyki użytkownika (w ramach limitu równoczesnych odczytów użytkownika)"""
+    async with tenant_reads_bulkhead.slot(username):
+        return await run_in_threadpool(load_user_statistics, username)
+
+def load_user_statistics(username: str) -> dict:
     """Pobierz statystyki użytkownika"""
     print(f"📊 Pobieranie statystyk dla użytkownika: {username}")
     
@@ -2941,7 +5811,7 @@ async def get_user_statistics(username: str):
 
 # Endpoint do pobierania uprawnień na podstawie email
 @app.get("/user-permission-by-email/{email}")
-async def get_user_permission_by_email(email: str):
+def get_user_permission_by_email(email: str):
     """Pobierz uprawnienia użytkownika na podstawie email"""
     print(f"🔍 Sprawdzanie uprawnień dla email: {email}")
     
@@ -2949,7 +5819,20 @@ async def get_user_permission_by_email(email: str):
         raise HTTPException(status_code=500, detail="Firebase nie jest skonfigurowany")
     
     try:
-        # Najpierw spróbuj wygenerować username z emaila (szybsze)
+        # Najpierw sprawdź katalog emaili (jeden odczyt niezależnie od liczby użytkowników)
+        directory_entry = find_user_by_email(email)
+        # Wpis bez username (zapisany wcześniej przez samą zmianę uprawnień) traktuj jak brak wpisu
+        if directory_entry and directory_entry.get("username"):
+            username = directory_entry.get("username")
+            permission = directory_entry.get("permission", "Demo")
+            print(f"✅ Znaleziono użytkownika w katalogu emaili: {username}, uprawnienia: {permission}")
+            return {
+                "username": username,
+                "permission": permission,
+                "message": f"Uprawnienia użytkownika {username}: {permission}"
+            }
+        
+        # Jeśli brak wpisu w katalogu, spróbuj wygenerować username z emaila
         username = email.replace('@', '_at_').replace('.', '_')
         
         # Sprawdź czy taki username istnieje
@@ -2959,9 +5842,13 @@ async def get_user_permission_by_email(email: str):
                 settings_data = settings_doc.to_dict()
                 stored_email = settings_data.get("userData", {}).get("email", "")
                 
-                if stored_email == email:
+                if normalize_email(stored_email) == normalize_email(email):
                     permission = settings_data.get("permission", "Demo")
                     print(f"✅ Znaleziono użytkownika bezpośrednio: {username}, uprawnienia: {permission}")
+                    
+                    # Uzupełnij katalog emaili, żeby kolejne logowania kosztowały jeden odczyt
+                    register_user_email(email, username, permission)
+                    
                     return {
                         "username": username,
                         "permission": permission,
@@ -2970,48 +5857,11 @@ async def get_user_permission_by_email(email: str):
         except Exception as e:
             print(f"⚠️ Nie znaleziono bezpośrednio username: {username}")
         
-        # Jeśli nie znaleziono bezpośrednio, iteruj przez kolekcje (wolniejsze)
-        print(f"🔍 Szukam w kolekcjach...")
-        collections = db.collections()
-        found_username = None
-        
-        for collection in collections:
-            collection_name = collection.id
-            
-            # Pomiń kolekcje systemowe
-            if collection_name in ["temp_clients", "notifications"]:
-                continue
-            
-            try:
-                settings_doc = db.collection(collection_name).document("Dane").get()
-                if settings_doc.exists:
-                    settings_data = settings_doc.to_dict()
-                    user_email = settings_data.get("userData", {}).get("email", "")
-                    if user_email == email:
-                        found_username = collection_name
-                        permission = settings_data.get("permission", "Demo")
-                        print(f"✅ Znaleziono użytkownika: {found_username}, uprawnienia: {permission}")
-                        break
-            except Exception as e:
-                print(f"⚠️ Błąd sprawdzania kolekcji {collection_name}: {str(e)}")
-                continue
-        
-        if not found_username:
-            print(f"❌ Nie znaleziono użytkownika z emailem: {email}")
-            return {
-                "username": None,
-                "permission": "Demo",
-                "message": f"Nie znaleziono użytkownika z emailem: {email}"
-            }
-        
-        # Pobierz uprawnienia znalezionego użytkownika
-        permission = get_user_permission_from_db(found_username)
-        print(f"✅ Uprawnienia użytkownika {found_username} (email: {email}): {permission}")
-        
+        print(f"❌ Nie znaleziono użytkownika z emailem: {email}")
         return {
-            "username": found_username,
-            "permission": permission,
-            "message": f"Uprawnienia użytkownika {found_username}: {permission}"
+            "username": None,
+            "permission": "Demo",
+            "message": f"Nie znaleziono użytkownika z emailem: {email}"
         }
         
     except Exception as e:
@@ -3022,7 +5872,7 @@ async def get_user_permission_by_email(email: str):
 
 # Endpoint do pobierania wszystkich użytkowników (tylko dla adminów)
 @app.get("/admin/users")
-async def get_all_users():
+def get_all_users():
     """Pobierz wszystkich zarejestrowanych użytkowników"""
     print(f"👥 Pobieranie wszystkich użytkowników")
     
@@ -3031,14 +5881,11 @@ async def get_all_users():
     
     try:
         users = []
-        collections = db.collections()
         
-        for collection in collections:
-            collection_name = collection.id
-            
-            # Pomiń kolekcje systemowe
-            if collection_name in ["temp_clients"]:
-                continue
+        # Pobierz użytkowników z rejestru tenants
+        for tenant_doc in db.collection(TENANTS_COLLECTION).stream():
+            collection_name = tenant_doc.id
+            tenant_data = tenant_doc.to_dict()
             
             try:
                 # Pobierz dane użytkownika
@@ -3052,26 +5899,9 @@ async def get_all_users():
                     twilio_settings = settings_data.get("twilio", {})
                     messaging_settings = settings_data.get("messaging", {})
                     
-                    # Policz klientów użytkownika i rzeczywiste SMS-y
-                    clients_count = 0
-                    actual_sms_sent = 0
-                    try:
-                        # Pobierz wszystkie dokumenty w kolekcji użytkownika (pomijając "Dane" i "SMS")
-                        user_collection = db.collection(collection_name)
-                        docs = user_collection.stream()
-                        for doc in docs:
-                            doc_id = doc.id
-                            # Pomiń dokumenty systemowe
-                            if doc_id not in ["Dane", "SMS"]:
-                                clients_count += 1
-                                # Zsumuj rzeczywistą liczbę SMS wysłanych do tego klienta
-                                client_data = doc.to_dict()
-                                client_sms_count = client_data.get("sms_count", 0)
-                                actual_sms_sent += client_sms_count
-                    except Exception as e:
-                        print(f"⚠️ Błąd liczenia klientów dla {collection_name}: {str(e)}")
-                        clients_count = 0
-                        actual_sms_sent = 0
+                    # Liczniki klientów i wysłanych SMS-ów z rejestru (bez przeglądania klientów)
+                    clients_count = tenant_data.get("clientsCount", 0)
+                    actual_sms_sent = tenant_data.get("smsSent", 0)
                     
                     user_info = {
                         "username": collection_name,
@@ -3114,7 +5944,7 @@ async def get_all_users():
 
 # Endpoint do aktualizacji uprawnień użytkownika
 @app.put("/admin/users/{username}/permission")
-async def update_user_permission_admin(username: str, permission_data: dict):
+def update_user_permission_admin(username: str, permission_data: dict):
     """Aktualizuj uprawnienia użytkownika"""
     print(f"🔐 Aktualizacja uprawnień dla {username}: {permission_data}")
     
@@ -3145,6 +5975,9 @@ async def update_user_permission_admin(username: str, permission_data: dict):
         
         # Zapisz zmiany
         doc_ref.set(settings_data)
+        invalidate_tenant_settings(username)
+        sync_tenant_registry(username, settings_data)
+        update_user_email_permission(username, settings_data, new_permission)
         
         print(f"✅ Uprawnienia zaktualizowane: {username} -> {new_permission} (SMS limit: {sms_limit})")
         
@@ -3162,7 +5995,7 @@ async def update_user_permission_admin(username: str, permission_data: dict):
 
 # Endpoint do aktualizacji konfiguracji Twilio użytkownika
 @app.put("/admin/users/{username}/twilio")
-async def update_user_twilio_admin(username: str, twilio_data: dict):
+def update_user_twilio_admin(username: str, twilio_data: dict):
     """Aktualizuj konfigurację Twilio użytkownika"""
     print(f"📱 Aktualizacja Twilio dla {username}: {twilio_data}")
     
@@ -3195,6 +6028,8 @@ async def update_user_twilio_admin(username: str, twilio_data: dict):
         
         # Zapisz zmiany
         doc_ref.set(settings_data)
+        invalidate_tenant_settings(username)
+        evict_twilio_client_for_user(username, settings_data["twilio"])
         
         print(f"✅ Twilio zaktualizowane dla {username}")
         
@@ -3211,7 +6046,7 @@ async def update_user_twilio_admin(username: str, twilio_data: dict):
 
 # Endpoint do pobierania statystyk SMS użytkownika
 @app.get("/admin/users/{username}/sms-stats")
-async def get_user_sms_stats(username: str):
+def get_user_sms_stats(username: str):
     """Pobierz statystyki SMS użytkownika"""
     print(f"📊 Pobieranie statystyk SMS dla {username}")
     
@@ -3233,22 +6068,18 @@ async def get_user_sms_stats(username: str):
         sms_count = messaging_settings.get("smsCount", 0)
         sms_limit = messaging_settings.get("smsLimit", 10)
         
-        # Pobierz szczegóły SMS z kolekcji miesięcznych
+        # Pobierz liczby SMS z liczników miesięcznych
         current_month = datetime.now().strftime("%Y-%m")
-        sms_collection = db.collection(username).document("SMS").collection(current_month)
-        sms_docs = list(sms_collection.stream())
         
         # Statystyki miesięczne
-        monthly_sent = len(sms_docs)
+        monthly_sent = get_monthly_sms_count(username, current_month)
         monthly_remaining = max(0, sms_limit - monthly_sent)
         
         # Statystyki z ostatnich 3 miesięcy
         stats_by_month = {}
         for i in range(3):
             month = (datetime.now() - timedelta(days=30*i)).strftime("%Y-%m")
-            month_collection = db.collection(username).document("SMS").collection(month)
-            month_docs = list(month_collection.stream())
-            stats_by_month[month] = len(month_docs)
+            stats_by_month[month] = get_monthly_sms_count(username, month)
         
         print(f"📊 Statystyki SMS dla {username}: wysłane={sms_count}, limit={sms_limit}")
         
@@ -3269,7 +6100,7 @@ async def get_user_sms_stats(username: str):
 
 # Endpoint do ręcznego resetowania limitu SMS
 @app.post("/admin/users/{username}/reset-sms-limit")
-async def reset_user_sms_limit(username: str):
+def reset_user_sms_limit(username: str):
     """Ręcznie zresetuj limit SMS dla użytkownika"""
     print(f"🔄 Ręczne resetowanie limitu SMS dla {username}")
     
@@ -3311,7 +6142,7 @@ async def reset_user_sms_limit(username: str):
 
 # Endpoint do resetowania limitu SMS dla wszystkich użytkowników
 @app.post("/admin/reset-all-sms-limits")
-async def reset_all_sms_limits():
+def reset_all_sms_limits():
     """Zresetuj limit SMS dla wszystkich użytkowników (nowy miesiąc)"""
     print(f"🔄 Resetowanie limitów SMS dla wszystkich użytkowników")
     
@@ -3323,31 +6154,21 @@ async def reset_all_sms_limits():
         reset_count = 0
         errors = []
         
-        # Pobierz wszystkich użytkowników
-        collections = db.collections()
-        
-        for collection in collections:
-            collection_name = collection.id
-            
-            # Pomiń kolekcje systemowe
-            if collection_name in ["temp_clients"]:
-                continue
+        # Pobierz wszystkich użytkowników z rejestru tenants (uprawnienia są w rejestrze)
+        for tenant_doc in db.collection(TENANTS_COLLECTION).stream():
+            collection_name = tenant_doc.id
             
             try:
-                # Sprawdź czy to użytkownik
-                settings_doc = db.collection(collection_name).document("Dane").get()
-                if settings_doc.exists:
-                    settings_data = settings_doc.to_dict()
-                    permission = settings_data.get("permission", "Demo")
-                    sms_limit = get_sms_limit_for_permission(UserPermission(permission))
+                permission = tenant_doc.to_dict().get("permission", "Demo")
+                sms_limit = get_sms_limit_for_permission(UserPermission(permission))
+                
+                # Zresetuj limit
+                success = reset_sms_limit_for_month(collection_name, current_month, sms_limit)
+                if success:
+                    reset_count += 1
+                else:
+                    errors.append(f"Błąd resetowania dla {collection_name}")
                     
-                    # Zresetuj limit
-                    success = reset_sms_limit_for_month(collection_name, current_month, sms_limit)
-                    if success:
-                        reset_count += 1
-                    else:
-                        errors.append(f"Błąd resetowania dla {collection_name}")
-                        
             except Exception as e:
                 errors.append(f"Błąd dla {collection_name}: {str(e)}")
                 continue
@@ -3388,7 +6209,7 @@ class NotificationReadResponse(BaseModel):
 
 # Endpointy dla powiadomień
 @app.get("/notifications/{user_email}", response_model=NotificationResponse)
-async def get_notifications(user_email: str):
+def get_notifications(user_email: str):
     """Pobierz powiadomienia dla użytkownika"""
     print(f"🔔 Pobieranie powiadomień dla: {user_email}")
     
@@ -3446,7 +6267,7 @@ async def get_notifications(user_email: str):
         raise HTTPException(status_code=500, detail=f"Błąd pobierania powiadomień: {str(e)}")
 
 @app.put("/notifications/{user_email}/{notification_id}/read", response_model=NotificationReadResponse)
-async def mark_notification_as_read(user_email: str, notification_id: str):
+def mark_notification_as_read(user_email: str, notification_id: str):
     """Oznacz powiadomienie jako przeczytane"""
     print(f"📖 Oznaczanie powiadomienia jako przeczytane: {notification_id} dla {user_email}")
     
@@ -3474,7 +6295,7 @@ async def mark_notification_as_read(user_email: str, notification_id: str):
         raise HTTPException(status_code=500, detail=f"Błąd oznaczania powiadomienia: {str(e)}")
 
 @app.put("/notifications/{user_email}/read-all", response_model=NotificationReadResponse)
-async def mark_all_notifications_as_read(user_email: str):
+def mark_all_notifications_as_read(user_email: str):
     """Oznacz wszystkie powiadomienia jako przeczytane"""
     print(f"📖 Oznaczanie wszystkich powiadomień jako przeczytane dla: {user_email}")
     
@@ -3514,7 +6335,7 @@ async def mark_all_notifications_as_read(user_email: str):
         raise HTTPException(status_code=500, detail=f"Błąd oznaczania wszystkich powiadomień: {str(e)}")
 
 @app.post("/notifications/{user_email}/create", response_model=NotificationReadResponse)
-async def create_notification(user_email: str, notification_data: dict):
+def create_notification(user_email: str, notification_data: dict):
     """Utwórz nowe powiadomienie (do użycia wewnętrznego)"""
     print(f"🔔 Tworzenie powiadomienia dla: {user_email}")
     
@@ -3546,7 +6367,7 @@ async def create_notification(user_email: str, notification_data: dict):
 
 
 @app.delete("/notifications/{user_email}/{notification_id}", response_model=NotificationReadResponse)
-async def delete_notification(user_email: str, notification_id: str):
+def delete_notification(user_email: str, notification_id: str):
     """Usuń pojedyncze powiadomienie użytkownika"""
     print(f"🗑️ Usuwanie powiadomienia: {notification_id} dla {user_email}")
 
@@ -3580,7 +6401,7 @@ async def delete_notification(user_email: str, notification_id: str):
 
 
 @app.delete("/notifications/{user_email}", response_model=NotificationReadResponse)
-async def delete_all_notifications(user_email: str):
+def delete_all_notifications(user_email: str):
     """Usuń wszystkie powiadomienia użytkownika"""
     print(f"🗑️ Usuwanie wszystkich powiadomień dla: {user_email}")
 
@@ -3606,22 +6427,3 @@ async def delete_all_notifications(user_email: str):
     except Exception as e:
         print(f"❌ Błąd usuwania wszystkich powiadomień: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Błąd usuwania wszystkich powiadomień: {str(e)}")
-
-
-if __name__ == "__main__":
-    port = int(os.getenv("PORT", 8000))
-    
-    print("🚀 Uruchamianie next review booster API...")
-    print(f"🔧 Port: {port}")
-    print(f"🌐 API: http://0.0.0.0:{port}")
-    print(f"📚 Dokumentacja: http://0.0.0.0:{port}/docs")
-    print(f"❤️  Health Check: http://0.0.0.0:{port}/health")
-
-    is_production = os.getenv("ENVIRONMENT") == "production" or os.getenv("RENDER") == "true"
-    
-    uvicorn.run(
-        "backend_main:app", 
-        host="0.0.0.0", 
-        port=port, 
-        reload=not is_production  
-    )
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Mikrobenchmark renderowania kodów QR - porównuje dotychczasową metodę (box_size + LANCZOS
++ PNG optimize) z renderowaniem ze skalowaniem całkowitym (PNG) i formatem SVG
+"""
+
+import argparse
+import io
+import statistics
+import time
+
+import qrcode
+from PIL import Image
+
+from qr_rendering import qr_matrix, render_qr_png, render_qr_svg
+
+def render_legacy_png(data, size):
+    """Dotychczasowe renderowanie: box_size z przybliżenia, LANCZOS i PNG optimize=True"""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=max(4, size // 30),
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    if img.size[0] > size:
+        img = img.resize((size, size), Image.Resampling.LANCZOS)
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format="PNG", optimize=True)
+    return img_bytes.getvalue()
+
+def measure(render, data, size, iterations, cold=True):
+    """Zwraca (mediana czasu w ms, rozmiar wyniku w bajtach)
+
+    cold=True czyści cache macierzy przed każdym pomiarem (pierwsze renderowanie danych),
+    cold=False mierzy kolejny rozmiar/format tych samych danych.
+    """
+    timings = []
+    render(data, size)
+    for _ in range(iterations):
+        if cold:
+            qr_matrix.cache_clear()
+        start = time.perf_counter()
+        output = render(data, size)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), len(output)
+
+def run_benchmark(data, sizes, iterations):
+    """Uruchamia benchmark dla każdego rozmiaru i wyświetla tabelę wyników"""
+    print(f"🔲 Benchmark kodów QR: {data}")
+    print(f"📊 Powtórzenia: {iterations} (mediana czasu)")
+    print("   PNG/SVG - pierwsze renderowanie danych, (cache) - macierz modułów już policzona")
+    print("=" * 96)
+    print(
+        f"{'Rozmiar':>8} | {'LANCZOS ms':>10} | {'PNG ms':>7} | {'PNG cache':>9} | {'SVG ms':>7} | "
+        f"{'SVG cache':>9} | {'PNG x':>6} | {'cache x':>7} | {'PNG B':>6}"
+    )
+    print("-" * 96)
+
+    for size in sizes:
+        legacy_ms, legacy_bytes = measure(render_legacy_png, data, size, iterations)
+        png_ms, png_bytes = measure(render_qr_png, data, size, iterations)
+        png_warm_ms, _ = measure(render_qr_png, data, size, iterations, cold=False)
+        svg_ms, _ = measure(render_qr_svg, data, size, iterations)
+        svg_warm_ms, _ = measure(render_qr_svg, data, size, iterations, cold=False)
+        print(
+            f"{size:>6}px | {legacy_ms:>10.2f} | {png_ms:>7.2f} | {png_warm_ms:>9.3f} | {svg_ms:>7.2f} | "
+            f"{svg_warm_ms:>9.3f} | {legacy_ms / png_ms:>5.1f}x | {legacy_ms / png_warm_ms:>6.0f}x | {png_bytes:>6}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark renderowania kodów QR next review booster")
+    parser.add_argument("--data", default="https://next-reviews-booster-app.web.app/review/ABCDEFGH", help="Zawartość kodu QR")
+    parser.add_argument("--sizes", default="50,100,200,300,500,750,1000", help="Rozmiary w pikselach (po przecinku)")
+    parser.add_argument("--iterations", type=int, default=20, help="Liczba powtórzeń dla każdego rozmiaru")
+    args = parser.parse_args()
+
+    run_benchmark(args.data, [int(size) for size in args.sizes.split(",")], args.iterations)
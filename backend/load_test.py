@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Prosty test obciążeniowy API - wysyła równoległe żądania GET
+i wyświetla przepustowość oraz percentyle czasu odpowiedzi
+"""
+
+import argparse
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def fetch(url, timeout):
+    """Wykonuje pojedyncze żądanie i zwraca (czas w ms, kod odpowiedzi)"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return (time.perf_counter() - start) * 1000, status
+
+def percentile(values, pct):
+    """Zwraca percentyl z posortowanej listy"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def run_load_test(url, total_requests, concurrency, timeout):
+    """Uruchamia test obciążeniowy i wyświetla wyniki"""
+    print(f"🚀 Test obciążeniowy: {url}")
+    print(f"📊 Żądania: {total_requests}, równoległość: {concurrency}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: fetch(url, timeout), range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status == 0 or status >= 500)
+
+    print("=" * 50)
+    print(f"⏱️ Czas całkowity: {elapsed:.2f} s")
+    print(f"⚡ Przepustowość: {total_requests / elapsed:.1f} req/s")
+    print(f"📈 Średnio: {statistics.mean(latencies):.1f} ms")
+    print(f"   p50: {percentile(latencies, 50):.1f} ms")
+    print(f"   p95: {percentile(latencies, 95):.1f} ms")
+    print(f"   p99: {percentile(latencies, 99):.1f} ms")
+    print(f"❌ Błędy: {errors}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test obciążeniowy API next review booster")
+    parser.add_argument("--url", default="http://localhost:8000/health", help="Adres testowanego endpointu")
+    parser.add_argument("--requests", type=int, default=200, help="Liczba wszystkich żądań")
+    parser.add_argument("--concurrency", type=int, default=20, help="Liczba równoległych żądań")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Limit czasu pojedynczego żądania (s)")
+    args = parser.parse_args()
+
+    run_load_test(args.url, args.requests, args.concurrency, args.timeout)
@@ -0,0 +1,235 @@
+"""
+Szybkie renderowanie kodów QR - macierz modułów liczona raz, skalowanie całkowitą
+wielokrotnością (najbliższy sąsiad, ostre krawędzie modułów) i wypełnianie pikseli
+na tablicy bajtów zamiast rysowania przez PIL. Dostępny też format SVG do druku.
+"""
+
+import io
+import zlib
+from functools import lru_cache
+
+import qrcode
+from PIL import Image
+
+QR_BORDER = 4  # Minimalny margines (quiet zone) zgodnie ze specyfikacją
+QR_MATRIX_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=QR_MATRIX_CACHE_SIZE)
+def qr_matrix(data: str) -> tuple:
+    """Macierz modułów kodu QR (True - moduł ciemny) razem z marginesem
+
+    Wybór wersji i maski jest najdroższą częścią, więc macierz jest liczona raz dla danych
+    i używana ponownie dla każdego rozmiaru i formatu.
+    """
+    qr = qrcode.QRCode(
+        version=None,  # Automatyczny wybór wersji
+        error_correction=qrcode.constants.ERROR_CORRECT_M,  # 15% korekta błędów
+        border=QR_BORDER,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+def render_qr_image(matrix: tuple, size: int) -> Image.Image:
+    """Obraz kodu QR o boku size px (tryb 1-bitowy)
+
+    Moduł ma całkowitą liczbę pikseli (size // liczba modułów), a resztę do żądanego
+    rozmiaru wypełnia biały margines. Jeśli size jest mniejszy niż liczba modułów,
+    obraz ma 1 px na moduł (mniejszy kod nie byłby czytelny).
+    """
+    modules = len(matrix)
+    scale = max(1, size // modules)
+    side = max(size, modules * scale)
+    offset = (side - modules * scale) // 2
+
+    white_row = b"\xff" * side
+    left = b"\xff" * offset
+    right = b"\xff" * (side - offset - modules * scale)
+    dark, light = b"\x00" * scale, b"\xff" * scale
+
+    rows = [white_row] * offset
+    for matrix_row in matrix:
+        row = left + b"".join(dark if module else light for module in matrix_row) + right
+        rows.extend([row] * scale)
+    rows.extend([white_row] * (side - len(rows)))
+
+    image = Image.frombytes("L", (side, side), b"".join(rows))
+    return image.convert("1", dither=Image.Dither.NONE)
+
+def render_qr_png(data: str, size: int = 200) -> bytes:
+    """Kod QR jako PNG o boku size px"""
+    image = render_qr_image(qr_matrix(data), size)
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
+
+def render_qr_svg(data: str, size: int = 200) -> bytes:
+    """Kod QR jako SVG (wektorowo - do druku w dowolnej skali)
+
+    Sąsiednie ciemne moduły w wierszu łączone są w jeden prostokąt jednej ścieżki <path>.
+    """
+    matrix = qr_matrix(data)
+    modules = len(matrix)
+    path = []
+    for y, matrix_row in enumerate(matrix):
+        x = 0
+        while x < modules:
+            if not matrix_row[x]:
+                x += 1
+                continue
+            start = x
+            while x < modules and matrix_row[x]:
+                x += 1
+            path.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+        f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/>'
+        f"</svg>"
+    )
+    return svg.encode("utf-8")
+
+def render_qr_bitmap(data: str, size: int = 200) -> tuple:
+    """Kod QR jako (bok w px, skompresowana bitmapa 1-bit) - obraz strony arkusza PDF"""
+    image = render_qr_image(qr_matrix(data), size)
+    return image.size[0], zlib.compress(image.tobytes())
+
+QR_RENDERERS = {
+    "png": (render_qr_png, "image/png"),
+    "svg": (render_qr_svg, "image/svg+xml"),
+}
+
+# Arkusz PDF z kodami QR - zapisywany strumieniowo (strona po stronie), bez bibliotek PDF.
+# Polskie znaki w podpisach przez własne kodowanie fontu Helvetica (/Differences).
+PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT = 595, 842  # A4 w punktach
+PDF_MARGIN = 36
+PDF_COLUMNS, PDF_ROWS = 3, 4
+PDF_QR_SIDE = 140
+PDF_LABEL_SIZE = 10
+PDF_LABEL_MAX_CHARS = 30
+PDF_POLISH_GLYPHS = {
+    "ą": "aogonek", "ć": "cacute", "ę": "eogonek", "ł": "lslash", "ń": "nacute",
+    "ó": "oacute", "ś": "sacute", "ź": "zacute", "ż": "zdotaccent",
+    "Ą": "Aogonek", "Ć": "Cacute", "Ę": "Eogonek", "Ł": "Lslash", "Ń": "Nacute",
+    "Ó": "Oacute", "Ś": "Sacute", "Ź": "Zacute", "Ż": "Zdotaccent",
+}
+PDF_POLISH_CODES = {char: 128 + index for index, char in enumerate(PDF_POLISH_GLYPHS)}
+
+def pdf_text(text: str) -> bytes:
+    """Tekst jako łańcuch PDF w kodowaniu fontu arkusza (znaki spoza kodowania jako ?)"""
+    encoded = bytearray()
+    for char in text:
+        if char in PDF_POLISH_CODES:
+            encoded.append(PDF_POLISH_CODES[char])
+        elif 32 <= ord(char) < 127:
+            if char in "()\\":
+                encoded.append(ord("\\"))
+            encoded.append(ord(char))
+        else:
+            encoded.append(ord("?"))
+    return b"(" + bytes(encoded) + b")"
+
+class QrPdfSheetWriter:
+    """Strumieniowy zapis arkusza PDF: siatka PDF_COLUMNS x PDF_ROWS kodów QR z podpisami na stronie A4
+
+    add_card zwraca bajty gotowe do wysłania (pełna strona, gdy się zapełni), finish - resztę pliku
+    z tabelą xref. W pamięci jest najwyżej jedna strona kodów.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.object_offsets = {}
+        self.next_object_id = 4  # 1 - katalog, 2 - drzewo stron, 3 - font
+        self.page_ids = []
+        self.cards = []
+
+    def _object(self, object_id: int, body: bytes) -> bytes:
+        chunk = f"{object_id} 0 obj\n".encode() + body + b"\nendobj\n"
+        self.object_offsets[object_id] = self.offset
+        self.offset += len(chunk)
+        return chunk
+
+    def _stream_object(self, object_id: int, dictionary: str, data: bytes) -> bytes:
+        dictionary = f"{dictionary} /Length {len(data)}".strip()
+        return self._object(object_id, f"<< {dictionary} >>\nstream\n".encode() + data + b"\nendstream")
+
+    def _allocate(self) -> int:
+        self.next_object_id += 1
+        return self.next_object_id - 1
+
+    def begin(self) -> bytes:
+        """Nagłówek pliku i font"""
+        header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.offset = len(header)
+        differences = " ".join(f"/{glyph}" for glyph in PDF_POLISH_GLYPHS.values())
+        return header + self._object(3, (
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+            f"/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences [128 {differences}] >> >>"
+        ).encode())
+
+    def add_card(self, side: int, bitmap: bytes, label: str) -> bytes:
+        """Dodaj kod QR (bitmapa z render_qr_bitmap) z podpisem; zwraca zapisaną stronę (lub pusty ciąg bajtów)"""
+        self.cards.append((side, bitmap, label))
+        if len(self.cards) < PDF_COLUMNS * PDF_ROWS:
+            return b""
+        return self._flush_page()
+
+    def _flush_page(self) -> bytes:
+        cell_width = (PDF_PAGE_WIDTH - 2 * PDF_MARGIN) / PDF_COLUMNS
+        cell_height = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) / PDF_ROWS
+        chunks = []
+        images = []
+        content = []
+        for index, (side, bitmap, label) in enumerate(self.cards):
+            image_id = self._allocate()
+            chunks.append(self._stream_object(
+                image_id,
+                f"/Type /XObject /Subtype /Image /Width {side} /Height {side} "
+                "/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode",
+                bitmap
+            ))
+            images.append(f"/Im{index} {image_id} 0 R")
+
+            column, row = index % PDF_COLUMNS, index // PDF_COLUMNS
+            x = PDF_MARGIN + column * cell_width
+            top = PDF_PAGE_HEIGHT - PDF_MARGIN - row * cell_height
+            qr_x = x + (cell_width - PDF_QR_SIDE) / 2
+            qr_y = top - PDF_QR_SIDE - 8
+            content.append(f"q {PDF_QR_SIDE} 0 0 {PDF_QR_SIDE} {qr_x:.2f} {qr_y:.2f} cm /Im{index} Do Q".encode())
+
+            if len(label) > PDF_LABEL_MAX_CHARS:
+                label = label[:PDF_LABEL_MAX_CHARS - 1] + "..."
+            # Szerokość tekstu szacowana średnią szerokością znaku Helvetica (0.5 em)
+            label_x = x + max(0.0, (cell_width - len(label) * PDF_LABEL_SIZE * 0.5) / 2)
+            content.append(
+                f"BT /F1 {PDF_LABEL_SIZE} Tf {label_x:.2f} {qr_y - 14:.2f} Td ".encode() + pdf_text(label) + b" Tj ET"
+            )
+
+        content_id = self._allocate()
+        chunks.append(self._stream_object(content_id, "", b"\n".join(content)))
+        page_id = self._allocate()
+        chunks.append(self._object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> /XObject << {' '.join(images)} >> >> /Contents {content_id} 0 R >>"
+        ).encode()))
+        self.page_ids.append(page_id)
+        self.cards = []
+        return b"".join(chunks)
+
+    def finish(self) -> bytes:
+        """Ostatnia (niepełna) strona, drzewo stron, katalog i tabela xref"""
+        chunks = [self._flush_page()] if self.cards else []
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        chunks.append(self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode()))
+        chunks.append(self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>"))
+
+        xref_offset = self.offset
+        object_count = self.next_object_id
+        xref = [f"xref\n0 {object_count}\n".encode(), b"0000000000 65535 f \n"]
+        for object_id in range(1, object_count):
+            xref.append(f"{self.object_offsets[object_id]:010d} 00000 n \n".encode())
+        xref.append(f"trailer\n<< /Size {object_count} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        chunks.extend(xref)
+        return b"".join(chunks)
@@ -13,4 +13,4 @@ echo "🔧 Środowisko: $ENVIRONMENT"
 
 # Uruchom aplikację
 cd /opt/render/project/src/backend
-python backend_main.py
+uvicorn backend_main:app --host 0.0.0.0 --port $PORT
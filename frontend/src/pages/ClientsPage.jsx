@@ -14,6 +14,7 @@ const ClientsPage = () => {
   const [expandedClients, setExpandedClients] = useState(new Set());
   const [sendingSMS, setSendingSMS] = useState(new Set());
   const [sendingToAll, setSendingToAll] = useState(false);
+  const [sendAllProgress, setSendAllProgress] = useState(null);
   const [isMobile, setIsMobile] = useState(window.innerWidth <= 768);
   const [openMenuId, setOpenMenuId] = useState(null);
   const [formData, setFormData] = useState({
@@ -360,7 +361,7 @@ const ClientsPage = () => {
         const username = generateUsername(user);
         const result = await apiService.sendSMS(username, client.id);
         
-        alert('✅ SMS został wysłany pomyślnie!');
+        alert('✅ SMS został dodany do kolejki wysyłki!');
         fetchClients(); // Odśwież listę klientów
       } catch (error) {
         console.error('❌ Błąd wysyłania SMS:', error);
@@ -404,12 +405,21 @@ const ClientsPage = () => {
         setSendingToAll(true);
         
         const username = generateUsername(user);
-        const result = await apiService.sendSMSToAllClients(username);
+        const { job_id } = await apiService.sendSMSToAllClients(username);
         
-        alert(`✅ Proces zakończony! Wysłano ${result.sent} z ${result.total_found} klientów`);
+        // Wysyłka działa w tle - odpytuj postęp zadania
+        const job = await apiService.waitForJob(job_id, setSendAllProgress);
         
-        if (result.errors && result.errors.length > 0) {
-          console.warn('⚠️ Niektóre SMS-y nie zostały wysłane:', result.errors);
+        if (job.timedOut) {
+          alert(`⏳ Wysyłka wciąż trwa w tle (wysłano ${job.sent} z ${job.total} klientów). Odśwież listę klientów za chwilę.`);
+        } else if (job.status === 'failed') {
+          alert('❌ Wystąpił błąd podczas wysyłania SMS: ' + job.message);
+        } else {
+          alert(`✅ Proces zakończony! Wysłano ${job.sent} z ${job.total} klientów`);
+        }
+        
+        if (job.errors && job.errors.length > 0) {
+          console.warn('⚠️ Niektóre SMS-y nie zostały wysłane:', job.errors);
         }
         
         fetchClients(); // Odśwież listę klientów
@@ -418,6 +428,7 @@ const ClientsPage = () => {
         alert('❌ Wystąpił błąd podczas wysyłania SMS: ' + (error.response?.data?.detail || error.message));
       } finally {
         setSendingToAll(false);
+        setSendAllProgress(null);
       }
     }
   };
@@ -652,7 +663,9 @@ const ClientsPage = () => {
               {sendingToAll ? (
                 <>
                   <span className="loading-spinner-small"></span>
-                  Wysyłanie...
+                  {sendAllProgress && sendAllProgress.total > 0
+                    ? `Wysyłanie... ${sendAllProgress.sent + sendAllProgress.failed + sendAllProgress.skipped}/${sendAllProgress.total}`
+                    : 'Wysyłanie...'}
                 </>
               ) : (
                 <>
@@ -299,12 +299,12 @@ export const apiService = {
     }
   },
 
-  // Endpoint do wysyłania SMS do wszystkich klientów
+  // Endpoint do wysyłania SMS do wszystkich klientów (zlecenie zadania w tle)
   async sendSMSToAllClients(username) {
     console.log('📱 API: Wysyłanie SMS do wszystkich klientów dla:', username);
     try {
       const response = await api.post(`/send-sms-all/${username}`);
-      console.log('✅ API: SMS do wszystkich klientów wysłany:', response.data);
+      console.log('✅ API: Wysyłka SMS do wszystkich klientów zlecona:', response.data);
       return response.data;
     } catch (error) {
       console.error('❌ API: Błąd wysyłania SMS do wszystkich klientów:', error);
@@ -312,6 +312,45 @@ export const apiService = {
     }
   },
 
+  // Endpoint do sprawdzania postępu zadania w tle
+  async getJobStatus(jobId) {
+    try {
+      const response = await api.get(`/jobs/${jobId}`);
+      return response.data;
+    } catch (error) {
+      console.error('❌ API: Błąd pobierania statusu zadania:', error);
+      throw error;
+    }
+  },
+
+  // Odpytuj zadanie aż do zakończenia (completed/failed). Po maxWaitMs albo po stallMs bez postępu
+  // przestajemy czekać - zadanie dalej działa w tle, zwracamy ostatni stan z flagą timedOut
+  async waitForJob(jobId, onProgress, intervalMs = 2000, maxWaitMs = 10 * 60 * 1000, stallMs = 2 * 60 * 1000) {
+    const startedAt = Date.now();
+    let lastProgress = null;
+    let lastProgressAt = startedAt;
+    while (true) {
+      const job = await apiService.getJobStatus(jobId);
+      if (onProgress) {
+        onProgress(job);
+      }
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job;
+      }
+      const progress = `${job.status}:${job.queued}:${job.sent}:${job.failed}:${job.skipped}`;
+      const now = Date.now();
+      if (progress !== lastProgress) {
+        lastProgress = progress;
+        lastProgressAt = now;
+      }
+      if (now - startedAt >= maxWaitMs || now - lastProgressAt >= stallMs) {
+        console.warn('⏳ API: Zadanie wciąż w toku, kończę odpytywanie:', jobId);
+        return { ...job, timedOut: true };
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  },
+
   async getUserStatistics(username) {
     console.log('📊 API: Pobieranie statystyk dla:', username);
     try {
@@ -156,7 +156,7 @@ echo ""
 
 # Uruchom backend w tle
 echo -e "${BLUE}🔧 Uruchamianie FastAPI backend (port 8000)...${NC}"
-python3 backend_main.py &
+python3 -m uvicorn backend_main:app --host 0.0.0.0 --port 8000 --reload &
 BACKEND_PID=$!
 
 # Poczekaj chwilę na uruchomienie backend